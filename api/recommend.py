@@ -0,0 +1,10 @@
+"""
+Vercel entry point: serves recommend.handler. The deployment's build command
+(vercel.json) writes the cold-start snapshot that recommend.py loads.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommend import handler  # noqa: E402,F401
@@ -1,27 +1,79 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+import hmac
 import json
 import os
 import sys
+import time
+import logging
 from datetime import datetime
 
 # Add the current directory to Python path to import other modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(levelname)s: %(message)s")
+
 # Import your existing modules
-from extract_data import extract_player_and_game_data
-from metrics import calculate_game_intensity, calculate_game_outcome, calculate_performance_score, calculate_teamwork_factor
-from rule_engine import determine_desired_song_attributes
+from recommendation_pipeline import get_batch_song_recommendations, get_song_recommendations
+from rule_engine import get_rules, get_rules_info, get_rules_signature
 from threshold import (
-    categorize_game_closeness, 
-    categorize_intensity, 
-    categorize_performance, 
-    categorize_teamwork,
+    current_thresholds,
+    get_thresholds_info,
+    get_thresholds_signature,
+    refresh_thresholds,
+    save_thresholds,
+)
+from metric_sketches import (
+    THRESHOLD_HIGH_PERCENTILE, THRESHOLD_LOW_PERCENTILE, capture_metrics, get_metric_sketches, record_metrics,
 )
-from song_management import load_song_database
-from song_matcher import find_matching_songs
+from song_management import get_catalog_artifact, get_catalog_info, get_catalog_signature, get_song_catalog
+from song_index import build_song_index
+from recommendation_table import get_recommendation_table
+from song_embeddings import MATCH_ENGINE, build_song_embeddings, check_engine, recall_report, rule_profiles
+from response_cache import ENABLE_RESPONSE_CACHE, get_response_cache, recommendation_cache_key
+from single_flight import ENABLE_REQUEST_COALESCING, get_single_flight
+from file_signatures import signature_scope
+from job_queue import JobQueue, QueueFullError
+from callback_delivery import deliver_callback, get_callback_stats, is_valid_callback_url
+from instrumentation import (
+    observe_request, render_prometheus, request_finished, request_started,
+    requests_in_flight, requests_in_flight_on_host, set_current_endpoint, share_requests_in_flight,
+)
+from prefetch import Prefetcher, replay_player_ids
+from replay_store import REPLAY_MAX_BYTES, get_replay_store
+from warmup import WARMUP_ON_IMPORT, Warmup
 
 app = Flask(__name__)
 
+# Bearer token for the routes that change host-wide state or cost a full catalog
+# scan (POST /debug/thresholds, GET /debug/embeddings). Empty disables them.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def admin_error():
+    """None when the request carries ADMIN_TOKEN, else the (response, status) to return."""
+    if not ADMIN_TOKEN:
+        return jsonify({"success": False, "error": "Disabled; set ADMIN_TOKEN to enable this endpoint"}), 403
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"success": False, "error": "Admin token required (Authorization: Bearer <ADMIN_TOKEN>)"}), 401
+    return None
+
+@app.before_request
+def start_request_timer():
+    request_started()
+    set_current_endpoint(request.endpoint)
+    request.environ["song_rec.started"] = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = request.environ.get("song_rec.started")
+    if started is not None and request.endpoint != "prometheus_metrics":
+        observe_request(request.endpoint, response.status_code, time.perf_counter() - started)
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    request_finished()
+
 # Your existing sample data
 FULL_REPLAY_DATA_SAMPLE = {
   "date": "2024-11-15T19:43:35+05:30",
@@ -47,103 +99,80 @@ FULL_REPLAY_DATA_SAMPLE = {
   "map_name": "Urban Central", "overtime": True, "playlist": "Ranked Standard", "overtime_seconds": 59
 }
 
-def get_song_recommendation_profile(replay_data, target_player_id):
+def _response_generation():
     """
-    Main function to process a replay for a player and get desired song attributes.
+    What a cached response depends on besides its key: the catalog and rules
+    files and the cutoffs in use. Signatures rather than per-process versions,
+    so every worker sharing a cache (RESPONSE_CACHE_BACKEND=shared) agrees.
+    Inside cached_song_recommendations' signature_scope the pipeline reuses
+    these stats instead of repeating them.
     """
-    try:
-        # 1. Extract data
-        extracted_info = extract_player_and_game_data(replay_data, target_player_id)
-        if not extracted_info:
-            return None 
-
-        player_stats = extracted_info["player_stats"]
-        player_team_stats = extracted_info["player_team_stats"]
-        opponent_team_stats = extracted_info["opponent_team_stats"]
-        game_duration = extracted_info["game_duration"]
-        game_overtime = extracted_info["game_overtime"]
-
-        # 2. Calculate Metrics
-        intensity_score = calculate_game_intensity(player_stats, game_duration)
-        performance_score = calculate_performance_score(player_stats)
-        teamwork_factor = calculate_teamwork_factor(player_stats, player_team_stats)
-        game_outcome_details = calculate_game_outcome(player_team_stats, opponent_team_stats)
-
-        # 3. Categorize Metrics
-        intensity_cat = categorize_intensity(intensity_score)
-        performance_cat = categorize_performance(performance_score)
-        teamwork_cat = categorize_teamwork(teamwork_factor)
-        closeness_cat = categorize_game_closeness(game_outcome_details['abs_score_differential'], game_overtime)
-        
-        # 4. Determine Desired Song Attributes using Rule Engine
-        desired_attributes = determine_desired_song_attributes(
-            intensity_cat,
-            performance_cat,
-            teamwork_cat,
-            game_outcome_details,
-            closeness_cat
-        )
-
-        return {
-            "player_name": player_stats.get("name"),
-            "metrics": {
-                "intensity_score": round(intensity_score, 2),
-                "performance_score": round(performance_score, 2),
-                "teamwork_factor": round(teamwork_factor, 2),
-                "game_outcome": game_outcome_details,
-            },
-            "categories": {
-                "intensity": intensity_cat,
-                "performance": performance_cat,
-                "teamwork": teamwork_cat,
-                "closeness": closeness_cat,
-            },
-            "desired_song_profile": desired_attributes
-        }
-    except Exception as e:
-        app.logger.error(f"Error in get_song_recommendation_profile: {str(e)}")
-        return None
+    return (get_catalog_signature(), get_rules_signature(), get_thresholds_signature())
 
-def get_song_recommendations(replay_data, target_player_id, top_n=3):
+@signature_scope()  # the generation and the pipeline share one stat per file
+def cached_song_recommendations(replay_data, target_player_id, top_n=3, engine=None, record=True):
     """
-    Get song recommendations for a player based on replay data.
-    Returns both the profile and recommendations.
+    get_song_recommendations() through the response cache (see response_cache.py),
+    with identical concurrent misses coalesced into one computation (see single_flight.py).
+    Returns (result, cache_status) with cache_status "HIT", "MISS", "COALESCED"
+    (shared the result of an identical request in flight) or "BYPASS".
+    Only successful results are cached; errors are shared with coalesced requests too.
+
+    Cache entries keep the player's raw metric scores next to the response, so
+    every request (hit or not) records them under its own replay's playlist;
+    record=False (prefetching) records nothing.
     """
-    try:
-        # Get the profile
-        profile_info = get_song_recommendation_profile(replay_data, target_player_id)
-        
-        if not profile_info:
-            return {
-                "success": False,
-                "error": f"Could not generate recommendation profile for player {target_player_id}."
-            }
-        
-        # Load song database
-        song_db = load_song_database()
-        if not song_db:
-            return {
-                "success": False,
-                "error": "Failed to load song database."
-            }
-        
-        # Find matching songs
-        desired_attributes_for_matching = profile_info["desired_song_profile"]
-        recommended_songs = find_matching_songs(song_db, desired_attributes_for_matching, top_n=top_n)
-        
-        return {
-            "success": True,
-            "profile": profile_info,
-            "recommendations": recommended_songs or [],
-            "player_id": target_player_id
-        }
-        
-    except Exception as e:
-        app.logger.error(f"Error in get_song_recommendations: {str(e)}")
-        return {
-            "success": False,
-            "error": f"Error processing recommendation: {str(e)}"
-        }
+    if not ENABLE_RESPONSE_CACHE and not ENABLE_REQUEST_COALESCING:
+        if record:
+            return get_song_recommendations(replay_data, target_player_id, top_n, engine), "BYPASS"
+        with capture_metrics():
+            return get_song_recommendations(replay_data, target_player_id, top_n, engine), "BYPASS"
+    key = recommendation_cache_key(replay_data, target_player_id, top_n, engine or MATCH_ENGINE)
+    generation = _response_generation()
+    entry = None
+    if ENABLE_RESPONSE_CACHE:
+        cache = get_response_cache()
+        entry = cache.get(key, generation)
+    if entry is not None:
+        status = "HIT"
+    else:
+        def compute():
+            with capture_metrics() as samples:
+                result = get_song_recommendations(replay_data, target_player_id, top_n, engine)
+            entry = (result, samples[-1] if samples else None)
+            if ENABLE_RESPONSE_CACHE and result.get("success"):
+                cache.put(key, entry, generation)
+            return entry
+
+        if not ENABLE_REQUEST_COALESCING:
+            entry, status = compute(), "MISS"
+        else:
+            entry, shared = get_single_flight().do((key, generation), compute)
+            status = "COALESCED" if shared else "MISS" if ENABLE_RESPONSE_CACHE else "BYPASS"
+    result, metric_scores = entry
+    if record and metric_scores is not None:
+        record_metrics(replay_data.get("playlist"), *metric_scores)
+    return result, status
+
+def batch_song_recommendations(replay_data, player_ids=None, top_n=3, engine=None, record=True):
+    """get_batch_song_recommendations(); record=False keeps the scores out of the metric sketches (sample data)."""
+    if record:
+        return get_batch_song_recommendations(replay_data, player_ids, top_n, engine)
+    with capture_metrics():
+        return get_batch_song_recommendations(replay_data, player_ids, top_n, engine)
+
+def prefetch_song_recommendations(replay_data, target_player_id, top_n=3, engine=None):
+    """cached_song_recommendations() for a player nobody asked for yet: not recorded in the metric sketches."""
+    return cached_song_recommendations(replay_data, target_player_id, top_n, engine, record=False)
+
+# Computes the other players of a replay in the background (see prefetch.py)
+prefetcher = Prefetcher(prefetch_song_recommendations)
+
+def prefetch_replay(replay_data, target_player_id, top_n=3, engine=None):
+    """Queues the rest of the replay's players after the first request for it (no-op without the response cache)."""
+    if ENABLE_RESPONSE_CACHE:
+        replay_key = recommendation_cache_key(replay_data, None, top_n, engine or MATCH_ENGINE)
+        prefetcher.submit(replay_key, replay_data, target_player_id, top_n, engine)
 
 # Routes
 @app.route('/health', methods=['GET'])
@@ -155,6 +184,18 @@ def health_check():
         "service": "song-recommendation-engine"
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 only once warmup (catalog, indexes, canary) has finished"""
+    if warmup.should_retry():
+        warm_up()
+    status = 200 if warmup.ready else 503
+    return jsonify({
+        "status": "ready" if warmup.ready else "warming_up",
+        "timestamp": datetime.utcnow().isoformat(),
+        "warmup": warmup.info()
+    }), status
+
 @app.route('/', methods=['GET'])
 def api_docs():
     """API documentation endpoint"""
@@ -163,18 +204,45 @@ def api_docs():
         "version": "1.0.0",
         "endpoints": {
             "GET /health": "Health check endpoint",
+            "GET /ready": "Readiness probe (503 until the catalog, indexes and tables are warm)",
             "GET /": "API documentation",
             "POST /recommend": {
                 "description": "Get song recommendations based on replay data",
                 "required_params": ["player_id"],
-                "optional_params": ["replay_data", "top_n"],
+                "optional_params": ["replay_data", "replay_id", "top_n", "engine"],
+                "note": "replay_id names a replay uploaded with PUT /replays/<replay_id> (instead of replay_data). engine: additive (default: MATCH_ENGINE), embedding, embedding_exact or embedding_ivf",
                 "example": {
                     "player_id": "ce45140fcd644755b01660aa2dc6977b",
                     "top_n": 3,
                     "replay_data": "... (full replay data object)"
                 }
             },
-            "GET /recommend/test": "Test endpoint using sample data"
+            "POST /recommend/batch": {
+                "description": "Song recommendations for several players of one replay in one call",
+                "optional_params": ["replay_data", "replay_id", "player_ids", "top_n", "engine"],
+                "note": "player_ids defaults to every player in the replay"
+            },
+            "POST /recommend/stream": {
+                "description": "Bulk recommendations: newline-delimited JSON records in, NDJSON results streamed back",
+                "record_params": ["player_id or player_ids", "replay_data or replay_id", "top_n", "engine"],
+                "note": "Each result carries the input 'line' number; bad records get an inline error"
+            },
+            "GET /recommend/test": "Test endpoint using sample data",
+            "PUT /replays/<replay_id>": "Store a replay (JSON body) so requests can pass replay_id instead of replay_data; 201 when new, 200 when replaced",
+            "POST /webhook/recommend": "Queue a recommendation (same params as /recommend, plus optional callback_url); returns 202 with a job_id",
+            "GET /jobs/<job_id>": "Status and result of a queued recommendation",
+            "GET /metrics": "Prometheus metrics (stage latencies, request/error counts, catalog and cache stats)",
+            "GET /debug/catalog": "Song catalog cache status (version, size, load time)",
+            "GET /debug/rules": "Compiled rule table status (version, validation against the hard-coded rules)",
+            "GET /debug/recommendation-table": "Precomputed recommendation table status (size, build time)",
+            "GET /debug/response-cache": "Response cache size, hit/miss/eviction, request coalescing and background prefetch counters (X-Cache: HIT/MISS/COALESCED on /recommend)",
+            "GET /debug/embeddings": "Embedding matcher status and recall@k (?k=10) against the additive engine and of IVF against exact search. Requires Authorization: Bearer <ADMIN_TOKEN>; cached per catalog version",
+            "GET /debug/thresholds": "Current High/Low cutoffs and live metric distributions (this worker's sketches)",
+            "POST /debug/thresholds": {
+                "description": "Recompute the cutoffs as percentiles of the recorded scores",
+                "optional_params": ["low_percentile", "high_percentile", "playlist", "apply", "reset"],
+                "note": "Requires Authorization: Bearer <ADMIN_TOKEN>. Proposes only unless apply is true; applied cutoffs are saved to THRESHOLDS_PATH for every worker. reset restores the defaults"
+            }
         },
         "sample_player_ids": [
             "ce45140fcd644755b01660aa2dc6977b",  # ZwyxerS
@@ -184,6 +252,83 @@ def api_docs():
     }
     return jsonify(docs)
 
+def resolve_replay(data):
+    """
+    The replay a request refers to: its inline replay_data, the stored replay
+    named by replay_id (see replay_store.py), or the sample replay.
+    Returns (replay_data, using_sample); raises LookupError for an unknown replay_id.
+    """
+    replay_data = data.get('replay_data')
+    if replay_data:
+        return replay_data, False
+    replay_id = data.get('replay_id')
+    if replay_id:
+        replay_data = get_replay_store().get(str(replay_id))
+        if replay_data is None:
+            raise LookupError(f"Unknown replay_id '{replay_id}'; upload it with PUT /replays/<replay_id>")
+        return replay_data, False
+    return FULL_REPLAY_DATA_SAMPLE, True
+
+def read_request_body(limit):
+    """Up to `limit` bytes of the request body, read from the stream."""
+    chunks = []
+    remaining = limit
+    while remaining > 0:
+        chunk = request.stream.read(min(remaining, 65536))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+@app.route('/replays/<replay_id>', methods=['PUT'])
+def put_replay(replay_id):
+    """Stores an uploaded replay so later requests can pass replay_id instead of replay_data"""
+    try:
+        if not request.is_json:
+            return jsonify({
+                "success": False,
+                "error": "Request must be JSON"
+            }), 400
+        # Read at most REPLAY_MAX_BYTES + 1 from the stream, so a chunked upload
+        # without Content-Length is capped too.
+        too_large = request.content_length is not None and request.content_length > REPLAY_MAX_BYTES
+        body = b"" if too_large else read_request_body(REPLAY_MAX_BYTES + 1)
+        if too_large or len(body) > REPLAY_MAX_BYTES:
+            return jsonify({
+                "success": False,
+                "error": f"Replay too large (limit {REPLAY_MAX_BYTES} bytes)"
+            }), 413
+        try:
+            replay_data = json.loads(body)
+        except ValueError:
+            replay_data = None
+        if replay_data is None:
+            return jsonify({
+                "success": False,
+                "error": "Request body is not valid JSON"
+            }), 400
+        try:
+            stored = get_replay_store().put(replay_id, replay_data)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        
+        return jsonify({
+            "success": True,
+            **stored,
+            "player_ids": replay_player_ids(replay_data)
+        }), 201 if stored["created"] else 200
+        
+    except Exception as e:
+        app.logger.error(f"Error in put_replay: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
 @app.route('/recommend', methods=['POST'])
 def recommend_songs():
     """Main recommendation endpoint"""
@@ -199,7 +344,6 @@ def recommend_songs():
         
         # Extract parameters
         target_player_id = data.get('player_id')
-        replay_data = data.get('replay_data')
         top_n = data.get('top_n', 3)
         
         # Validate required parameters
@@ -208,28 +352,43 @@ def recommend_songs():
                 "success": False,
                 "error": "Missing required parameter: player_id"
             }), 400
+        try:
+            engine = check_engine(data.get('engine'))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
-        # Use provided replay data or fall back to sample data
-        if not replay_data:
-            replay_data = FULL_REPLAY_DATA_SAMPLE
-            using_sample = True
-        else:
-            using_sample = False
+        # Use provided or stored replay data, or fall back to sample data
+        try:
+            replay_data, using_sample = resolve_replay(data)
+        except LookupError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 404
         
         # Get recommendations
-        result = get_song_recommendations(replay_data, target_player_id, top_n)
+        result, cache_status = cached_song_recommendations(replay_data, target_player_id, top_n, engine, record=not using_sample)
         
         # Add metadata
         if result.get("success"):
+            if not using_sample:
+                prefetch_replay(replay_data, target_player_id, top_n, engine)
             result["metadata"] = {
                 "used_sample_data": using_sample,
+                "replay_id": data.get('replay_id'),
                 "timestamp": replay_data.get("date"),
                 "request_id": f"{target_player_id}_{top_n}",
+                "engine": engine,
                 "processed_at": datetime.utcnow().isoformat()
             }
         
         status_code = 200 if result.get("success") else 400
-        return jsonify(result), status_code
+        response = jsonify(result)
+        response.headers["X-Cache"] = cache_status
+        return response, status_code
         
     except Exception as e:
         app.logger.error(f"Error in recommend_songs: {str(e)}")
@@ -238,6 +397,107 @@ def recommend_songs():
             "error": f"Internal server error: {str(e)}"
         }), 500
 
+@app.route('/recommend/batch', methods=['POST'])
+def recommend_songs_batch():
+    """Recommendations for several (default: all) players of one replay"""
+    try:
+        if not request.is_json:
+            return jsonify({
+                "success": False,
+                "error": "Request must be JSON"
+            }), 400
+        
+        data = request.get_json()
+        
+        # Extract parameters
+        player_ids = data.get('player_ids')
+        top_n = data.get('top_n', 3)
+        
+        if player_ids is not None and not isinstance(player_ids, list):
+            return jsonify({
+                "success": False,
+                "error": "player_ids must be a list of player ids"
+            }), 400
+        try:
+            engine = check_engine(data.get('engine'))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        
+        # Use provided or stored replay data, or fall back to sample data
+        try:
+            replay_data, using_sample = resolve_replay(data)
+        except LookupError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 404
+        
+        result = batch_song_recommendations(replay_data, player_ids, top_n, engine, record=not using_sample)
+        
+        if result.get("success"):
+            result["metadata"] = {
+                "used_sample_data": using_sample,
+                "replay_id": data.get('replay_id'),
+                "timestamp": replay_data.get("date"),
+                "player_count": len(result["players"]),
+                "engine": engine,
+                "processed_at": datetime.utcnow().isoformat()
+            }
+        
+        status_code = 200 if result.get("success") else 400
+        return jsonify(result), status_code
+        
+    except Exception as e:
+        app.logger.error(f"Error in recommend_songs_batch: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
+def stream_recommendation_records(lines):
+    """
+    Generator pipeline behind /recommend/stream: one NDJSON result line per
+    input record, produced as soon as that record is processed.
+    """
+    for line_number, raw in enumerate(lines, start=1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+            if not isinstance(record, dict):
+                raise ValueError("record must be a JSON object")
+            replay_data, using_sample = resolve_replay(record)
+            top_n = record.get('top_n', 3)
+            engine = check_engine(record.get('engine'))
+            if record.get('player_ids') is not None:
+                if not isinstance(record['player_ids'], list):
+                    raise ValueError("player_ids must be a list of player ids")
+                result = batch_song_recommendations(replay_data, record['player_ids'], top_n, engine, record=not using_sample)
+            elif record.get('player_id'):
+                result, _ = cached_song_recommendations(replay_data, record['player_id'], top_n, engine, record=not using_sample)
+            else:
+                raise ValueError("Missing required parameter: player_id or player_ids")
+        except (ValueError, LookupError) as e:  # includes json.JSONDecodeError
+            result = {"success": False, "error": f"Invalid record: {str(e)}"}
+        except Exception as e:
+            app.logger.error(f"Error in stream_recommendation_records: {str(e)}")
+            result = {"success": False, "error": f"Error processing record: {str(e)}"}
+        result["line"] = line_number
+        yield json.dumps(result) + "\n"
+
+@app.route('/recommend/stream', methods=['POST'])
+def recommend_songs_stream():
+    """Bulk recommendations: NDJSON records in, NDJSON results streamed back"""
+    # request.stream is read line by line while the response is being sent,
+    # so neither the request nor the response is held in memory.
+    return Response(
+        stream_with_context(stream_recommendation_records(request.stream)),
+        mimetype='application/x-ndjson'
+    )
+
 @app.route('/recommend/test', methods=['GET'])
 def test_recommendations():
     """Test endpoint using sample data"""
@@ -246,8 +506,8 @@ def test_recommendations():
         player_id = request.args.get('player_id', 'ce45140fcd644755b01660aa2dc6977b')
         top_n = int(request.args.get('top_n', 3))
         
-        # Use sample data
-        result = get_song_recommendations(FULL_REPLAY_DATA_SAMPLE, player_id, top_n)
+        # Use sample data (not recorded in the metric sketches)
+        result, cache_status = cached_song_recommendations(FULL_REPLAY_DATA_SAMPLE, player_id, top_n, record=False)
         
         if result.get("success"):
             result["metadata"] = {
@@ -257,7 +517,9 @@ def test_recommendations():
                 "processed_at": datetime.utcnow().isoformat()
             }
         
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers["X-Cache"] = cache_status
+        return response
         
     except Exception as e:
         app.logger.error(f"Error in test_recommendations: {str(e)}")
@@ -281,6 +543,7 @@ def webhook_recommend():
         # Extract parameters
         target_player_id = data.get('player_id')
         replay_data = data.get('replay_data')
+        replay_id = data.get('replay_id')
         top_n = data.get('top_n', 3)
         callback_url = data.get('callback_url')  # Optional webhook callback
         
@@ -290,32 +553,49 @@ def webhook_recommend():
                 "error": "Missing required parameter: player_id"
             }), 400
         
-        # For now, process synchronously (you can make this async later with Celery/Redis)
-        if not replay_data:
-            replay_data = FULL_REPLAY_DATA_SAMPLE
-            using_sample = True
-        else:
-            using_sample = False
-        
-        result = get_song_recommendations(replay_data, target_player_id, top_n)
+        if callback_url is not None and not is_valid_callback_url(callback_url):
+            return jsonify({
+                "success": False,
+                "error": "callback_url must be an absolute http(s) URL of a public host"
+            }), 400
+        try:
+            engine = check_engine(data.get('engine'))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
-        if result.get("success"):
-            result["metadata"] = {
-                "used_sample_data": using_sample,
-                "timestamp": replay_data.get("date"),
-                "request_id": f"{target_player_id}_{top_n}",
-                "processed_at": datetime.utcnow().isoformat(),
-                "webhook": True
-            }
+        if not replay_data and replay_id and get_replay_store().get(str(replay_id)) is None:
+            return jsonify({
+                "success": False,
+                "error": f"Unknown replay_id '{replay_id}'; upload it with PUT /replays/<replay_id>"
+            }), 404
         
-        # TODO: If callback_url is provided, send result to that URL
-        # This is where you'd implement the actual webhook callback
+        # Queue the work; a background worker processes it (see job_queue.py)
+        try:
+            job_id = job_queue.submit({
+                "player_id": target_player_id,
+                "replay_data": replay_data,
+                "replay_id": replay_id,
+                "top_n": top_n,
+                "engine": engine,
+                "callback_url": callback_url
+            })
+        except QueueFullError as e:
+            response = jsonify({
+                "success": False,
+                "error": f"Service busy: {str(e)}. Retry later."
+            })
+            response.headers["Retry-After"] = "5"
+            return response, 503
         
         return jsonify({
             "success": True,
-            "message": "Recommendation processed",
-            "result": result
-        })
+            "message": "Recommendation queued",
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}"
+        }), 202
         
     except Exception as e:
         app.logger.error(f"Error in webhook_recommend: {str(e)}")
@@ -324,13 +604,252 @@ def webhook_recommend():
             "error": f"Internal server error: {str(e)}"
         }), 500
 
+def process_webhook_job(payload, job_id):
+    """Job handler for /webhook/recommend: runs the recommendation for a queued request"""
+    target_player_id = payload["player_id"]
+    top_n = payload.get("top_n", 3)
+    engine = payload.get("engine")
+    
+    replay_data, using_sample = resolve_replay(payload)  # LookupError fails the job
+    
+    result, _ = cached_song_recommendations(replay_data, target_player_id, top_n, engine, record=not using_sample)
+    
+    if result.get("success"):
+        if not using_sample:
+            prefetch_replay(replay_data, target_player_id, top_n, engine)
+        result["metadata"] = {
+            "used_sample_data": using_sample,
+            "replay_id": payload.get("replay_id"),
+            "timestamp": replay_data.get("date"),
+            "request_id": f"{target_player_id}_{top_n}",
+            "engine": engine or MATCH_ENGINE,
+            "processed_at": datetime.utcnow().isoformat(),
+            "webhook": True
+        }
+    
+    # Hand the result to the callback delivery workers (never blocks this thread)
+    if payload.get("callback_url"):
+        deliver_callback(payload["callback_url"], {
+            "job_id": job_id,
+            "status": "done",
+            "result": result
+        }, delivery_id=job_id)
+    
+    return result
+
+def notify_webhook_failure(payload, job_id, error):
+    """Failure handler for webhook jobs: tells the callback_url the job will not produce a result"""
+    if payload.get("callback_url"):
+        deliver_callback(payload["callback_url"], {
+            "job_id": job_id,
+            "status": "failed",
+            "error": error
+        }, delivery_id=job_id)
+
+# Opens JOB_DB_PATH on first use; worker threads start with the first submit() or after_fork().
+job_queue = JobQueue(process_webhook_job, on_failure=notify_webhook_failure)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status (and result, once done) of a queued webhook job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": f"Job {job_id} not found"
+        }), 404
+    return jsonify({
+        "success": True,
+        "job": job
+    })
+
+@app.route('/debug/callbacks', methods=['GET'])
+def debug_callbacks():
+    """Reports webhook callback delivery counters for this worker"""
+    return jsonify({
+        "success": True,
+        "callbacks": get_callback_stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (per-process stage latencies, request counts, caches)"""
+    catalog = get_catalog_info()
+    rules = get_rules_info()
+    jobs = job_queue.stats()
+    callbacks = get_callback_stats()
+    responses = get_response_cache().stats()
+    flights = get_single_flight().stats()
+    prefetches = prefetcher.stats()
+    replays = get_replay_store().stats()
+    body = render_prometheus(
+        gauges=[
+            ("song_rec_catalog_songs", "Songs in the loaded catalog.", [({}, catalog["song_count"])]),
+            ("song_rec_catalog_version", "Catalog version (bumped on every reload).", [({}, catalog["version"])]),
+            ("song_rec_rules_version", "Compiled rules version (bumped on every reload).", [({}, rules["version"])]),
+            ("song_rec_jobs", "Webhook jobs by status.", [({"status": status}, count) for status, count in sorted(jobs.items())]),
+            ("song_rec_callbacks_pending", "Callback deliveries scheduled or in flight.",
+             [({"state": "scheduled"}, callbacks["scheduled"]), ({"state": "in_flight"}, callbacks["in_flight"])]),
+            ("song_rec_response_cache_entries", "Responses held in the response cache.", [({}, responses["entries"])]),
+            ("song_rec_response_cache_bytes", "Serialized size of the cached responses.", [({}, responses["bytes"])]),
+            ("song_rec_requests_in_flight", "HTTP requests being handled by this worker.", [({}, requests_in_flight())]),
+            ("song_rec_requests_in_flight_host", "HTTP requests being handled by all workers on this host.", [({}, requests_in_flight_on_host())]),
+            ("song_rec_prefetch_queued_replays", "Replays waiting for background precomputation.", [({}, prefetches["queued_replays"])]),
+        ],
+        counters=[
+            ("song_rec_catalog_loads_total", "Catalog file (re)loads.", [({}, catalog["load_count"])]),
+            ("song_rec_callbacks_total", "Finished callback deliveries by outcome.",
+             [({"outcome": "delivered"}, callbacks["delivered"]), ({"outcome": "dead_lettered"}, callbacks["dead_lettered"])]),
+            ("song_rec_response_cache_removals_total", "Responses dropped from the response cache by reason.",
+             [({"reason": "evicted"}, responses["evictions"]), ({"reason": "expired"}, responses["expirations"])]),
+            ("song_rec_response_cache_invalidations_total", "Response cache flushes after a catalog/rules/thresholds change.",
+             [({}, responses["invalidations"])]),
+            ("song_rec_coalesced_requests_total", "Requests answered with the result of an identical request in flight.",
+             [({}, flights["coalesced"])]),
+            ("song_rec_coalesce_timeouts_total", "Requests that stopped waiting for an identical request and computed their own.",
+             [({}, flights["timeouts"])]),
+            ("song_rec_prefetch_players_total", "Players of already-requested replays precomputed in the background, or skipped.",
+             [({"outcome": "computed"}, prefetches["computed"]), ({"outcome": "skipped_busy"}, prefetches["skipped_busy"]),
+              ({"outcome": "error"}, prefetches["errors"])]),
+            ("song_rec_prefetch_cpu_seconds_total", "CPU time spent on background precomputation.", [({}, prefetches["cpu_seconds"])]),
+        ],
+        caches={
+            "catalog": (catalog["cache_hits"], catalog["cache_misses"]),
+            "catalog_artifacts": (catalog["artifact_hits"], catalog["artifact_builds"]),
+            "response": (responses["hits"], responses["misses"]),
+            "replays": (replays["hits"], replays["misses"]),
+        },
+    )
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route('/debug/catalog', methods=['GET'])
+def debug_catalog():
+    """Reports the cached song catalog's version and load time"""
+    get_song_catalog()  # make sure the catalog is loaded / revalidated
+    return jsonify({
+        "success": True,
+        "catalog": get_catalog_info()
+    })
+
+@app.route('/debug/rules', methods=['GET'])
+def debug_rules():
+    """Reports the compiled rule table's version and validation status"""
+    get_rules()  # make sure the rules are compiled / revalidated
+    return jsonify({
+        "success": True,
+        "rules": get_rules_info()
+    })
+
+@app.route('/debug/recommendation-table', methods=['GET'])
+def debug_recommendation_table():
+    """Reports the size and build time of the precomputed recommendation table"""
+    recommendation_table = get_recommendation_table()
+    return jsonify({
+        "success": True,
+        "catalog_version": get_catalog_info()["version"],
+        "table": recommendation_table.info() if recommendation_table is not None else None
+    })
+
+@app.route('/debug/response-cache', methods=['GET'])
+def debug_response_cache():
+    """Reports the response cache's size and this worker's hit/miss/eviction counters"""
+    return jsonify({
+        "success": True,
+        "response_cache": get_response_cache().stats(),
+        "coalescing": get_single_flight().stats(),
+        "prefetch": prefetcher.stats()
+    })
+
+@app.route('/debug/embeddings', methods=['GET'])
+def debug_embeddings():
+    """Reports the embedding matcher and its recall against the exact engines (scores every rule profile)"""
+    denied = admin_error()
+    if denied is not None:
+        return denied
+    k = request.args.get('k', 10, type=int)
+    if not 1 <= k <= 100:
+        return jsonify({
+            "success": False,
+            "error": "k must be between 1 and 100"
+        }), 400
+    rules = get_rules()
+    if rules is None:
+        return jsonify({
+            "success": False,
+            "error": "No compiled rules to draw profiles from"
+        }), 503
+    try:
+        check_engine("embedding")
+        embeddings = get_catalog_artifact("song_embeddings", build_song_embeddings)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 503
+    # One report per catalog version, rules and k; the additive side reuses the live song index.
+    recall = get_catalog_artifact(
+        "embedding_recall",
+        lambda songs: recall_report(embeddings, rule_profiles(rules), k, get_catalog_artifact("song_index", build_song_index)),
+        key=(rules.fingerprint, k),
+    )
+    return jsonify({
+        "success": True,
+        "default_engine": MATCH_ENGINE,
+        "recall": recall,
+        "embeddings": embeddings.info()
+    })
+
+@app.route('/debug/thresholds', methods=['GET'])
+def debug_thresholds():
+    """Reports the categorization cutoffs and the live metric distributions"""
+    refresh_thresholds()
+    sketches = get_metric_sketches()
+    return jsonify({
+        "success": True,
+        "thresholds": get_thresholds_info(),
+        "playlists": sketches.playlists(),
+        "distributions": sketches.distributions()
+    })
+
+@app.route('/debug/thresholds', methods=['POST'])
+def recompute_thresholds():
+    """Proposes (and optionally applies) cutoffs at target percentiles of the recorded scores"""
+    denied = admin_error()
+    if denied is not None:
+        return denied
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get("reset"):
+            previous = current_thresholds()
+            applied = save_thresholds({}, source={"reset": True})
+            return jsonify({"success": True, "applied": True, "previous": previous, "thresholds": applied})
+
+        low_percentile = float(data.get("low_percentile", THRESHOLD_LOW_PERCENTILE))
+        high_percentile = float(data.get("high_percentile", THRESHOLD_HIGH_PERCENTILE))
+        playlist = data.get("playlist")
+        proposed = get_metric_sketches().propose_thresholds(low_percentile, high_percentile, playlist)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    previous = current_thresholds()
+    if not data.get("apply"):
+        return jsonify({"success": True, "applied": False, "previous": previous, "proposed": proposed})
+    try:
+        applied = save_thresholds(proposed, source={
+            "playlist": playlist, "low_percentile": low_percentile, "high_percentile": high_percentile,
+            "computed_at": datetime.utcnow().isoformat(),
+        })
+    except (OSError, ValueError) as e:
+        return jsonify({"success": False, "error": f"Could not save thresholds: {e}"}), 500
+    return jsonify({"success": True, "applied": True, "previous": previous, "thresholds": applied})
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
         "success": False,
         "error": "Endpoint not found",
-        "available_endpoints": ["/", "/health", "/recommend", "/recommend/test", "/webhook/recommend"]
+        "available_endpoints": ["/", "/health", "/ready", "/recommend", "/recommend/batch", "/recommend/stream", "/recommend/test", "/replays/<replay_id>", "/webhook/recommend", "/jobs/<job_id>", "/metrics", "/debug/catalog", "/debug/callbacks", "/debug/rules", "/debug/recommendation-table", "/debug/response-cache", "/debug/embeddings", "/debug/thresholds"]
     }), 404
 
 @app.errorhandler(500)
@@ -340,6 +859,43 @@ def internal_error(error):
         "error": "Internal server error"
     }), 500
 
+# --- Warmup / pre-fork hooks (see warmup.py and gunicorn.conf.py) ---
+
+warmup = Warmup()
+
+def _canary_recommendation():
+    with capture_metrics():  # sample data stays out of the metric sketches
+        result = get_song_recommendations(FULL_REPLAY_DATA_SAMPLE, "ce45140fcd644755b01660aa2dc6977b", top_n=3)
+    return result["success"] and bool(result["recommendations"])
+
+def warm_up():
+    """
+    Loads the catalog and rules, builds the song index and recommendation table,
+    and runs one canary recommendation; then freezes the heap. Returns readiness.
+    """
+    set_current_endpoint("warmup")
+    return warmup.run([
+        ("catalog", lambda: bool(get_song_catalog())),
+        ("rules", lambda: get_rules() is not None),
+        ("song_index", lambda: get_catalog_artifact("song_index", build_song_index) is not None),
+        ("recommendation_table", lambda: get_recommendation_table() is not None),
+        ("canary", _canary_recommendation),
+    ])
+
+def before_fork():
+    """Called in the gunicorn master after the app is preloaded: no threads may cross fork()."""
+    job_queue.stop()
+    prefetcher.stop()
+    share_requests_in_flight()
+
+def after_fork():
+    """Called in each forked gunicorn worker: drains jobs left over from a previous run."""
+    job_queue.start()
+
+if WARMUP_ON_IMPORT:
+    warm_up()
+
 if __name__ == '__main__':
     # For local development
+    job_queue.start()
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8000)), debug=False)
\ No newline at end of file
@@ -0,0 +1,367 @@
+"""
+Reproducible benchmarks for the recommendation pipeline.
+
+    python benchmark.py run --sizes 10000,100000,1000000 --output bench.json
+    python benchmark.py compare baseline.json bench.json --threshold 0.15
+    python benchmark.py generate-catalog 100000 synthetic_songs.json
+    python benchmark.py generate-replays 500 replays/
+
+Catalogs and replays are generated from a seed, so two runs with the same
+seed time exactly the same inputs. Each stage is repeated until a small time
+budget is spent and reported as median / p95 microseconds per call.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from extract_data import extract_all_players_data, extract_player_and_game_data
+from metrics import calculate_game_intensity, calculate_game_outcome, calculate_performance_score, calculate_teamwork_factor
+from rule_engine import determine_desired_song_attributes
+from threshold import (
+    categorize_game_closeness,
+    categorize_intensity,
+    categorize_performance,
+    categorize_teamwork,
+)
+from song_management import load_song_database, song_records
+from song_matcher import find_matching_songs
+from song_index import NumpySongIndex, PostingsSongIndex, np
+import metric_columns
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_SEED = 42
+
+# Vocabulary: the labels the rules ask for plus the long tail a real catalog has.
+RULE_MOODS = ["Triumphant", "Energetic", "Focused", "Reflective", "Neutral", "Uplifting",
+              "Tense", "Dramatic", "Clutch", "Heartbreak", "Suspenseful"]
+RULE_THEMES = ["Victory", "Collaborative"]
+EXTRA_MOODS = ["Happy", "Sad", "Angry", "Calm", "Romantic", "Dark", "Euphoric", "Melancholic", "Aggressive",
+               "Chill", "Hopeful", "Nostalgic", "Playful", "Mysterious", "Epic", "Dreamy", "Confident", "Rebellious"]
+EXTRA_THEMES = ["Love", "Freedom", "Struggle", "Party", "Journey", "Friendship", "Legacy", "History", "Night",
+                "Summer", "City", "Rebellion", "Ambition", "Loss", "Hope", "Speed", "Power", "Home"]
+ENERGY_LEVELS = ["Low", "Medium", "High"]
+
+
+def _zipf_choice(rng, labels, count):
+    """`count` distinct labels, earlier ones much more likely (Zipf-like)."""
+    weights = [1.0 / (rank + 1) for rank in range(len(labels))]
+    picked = []
+    while len(picked) < min(count, len(labels)):
+        label = rng.choices(labels, weights)[0]
+        if label not in picked:
+            picked.append(label)
+    return picked
+
+
+def make_catalog(size, seed=DEFAULT_SEED):
+    """Synthetic songs.json-style catalog with realistic BPM / energy / label distributions."""
+    rng = random.Random(seed)
+    moods = RULE_MOODS + EXTRA_MOODS
+    themes = RULE_THEMES + EXTRA_THEMES
+    rng.shuffle(moods)
+    rng.shuffle(themes)
+
+    songs = []
+    for i in range(size):
+        # Tempo clusters around ballads, mid-tempo pop and dance/rock.
+        centre = rng.choices((85, 120, 150), weights=(0.25, 0.45, 0.30))[0]
+        bpm = int(min(200, max(60, rng.gauss(centre, 12))))
+        energy = ENERGY_LEVELS[min(2, max(0, (bpm - 60) // 45 + rng.choice((-1, 0, 0, 1))))]
+        songs.append({
+            "title": f"Synthetic Song {i}",
+            "artist": f"Artist {rng.randrange(max(1, size // 10))}",
+            "bpm": bpm,
+            "energy": energy,
+            "moods": _zipf_choice(rng, moods, rng.randint(1, 4)),
+            "themes": _zipf_choice(rng, themes, rng.randint(0, 3)),
+            "source_url": f"https://open.spotify.com/track/synthetic{i}",
+        })
+    return songs
+
+
+def make_replay(seed=DEFAULT_SEED, players_per_team=3):
+    """Synthetic replay matching the FULL_REPLAY_DATA_SAMPLE schema."""
+    rng = random.Random(seed)
+    duration = rng.randint(300, 420)
+    overtime = rng.random() < 0.2
+    teams = {}
+    for color in ("blue", "orange"):
+        players = []
+        for p in range(players_per_team):
+            goals = rng.choices(range(5), weights=(40, 30, 15, 10, 5))[0]
+            shots = goals + rng.randint(0, 4)
+            players.append({
+                "id": f"{rng.getrandbits(128):032x}",
+                "name": f"{color.title()}Player{p}",
+                "goals": goals,
+                "saves": rng.randint(0, 4),
+                "assists": rng.randint(0, 3),
+                "shooting_percentage": round(100 * goals / shots, 4) if shots else 0,
+                "movement": {
+                    "total_distance": rng.randint(420_000, 650_000),
+                    "time_supersonic_speed_percent": round(rng.uniform(2, 15), 6),
+                },
+            })
+        team_goals = sum(p["goals"] for p in players)
+        teams[color] = {
+            "name": color.title(),
+            "goals": team_goals,
+            "saves": sum(p["saves"] for p in players),
+            "assists": sum(p["assists"] for p in players),
+            "shots": team_goals + rng.randint(0, 8),
+            "score": rng.randint(600, 1400),
+            "players": players,
+        }
+    return {
+        "date": "2024-11-15T19:43:35+05:30",
+        "teams": teams,
+        "title": f"Synthetic replay {seed}",
+        "season": 16,
+        "duration": duration,
+        "map_name": "Urban Central",
+        "overtime": overtime,
+        "playlist": "Ranked Standard",
+        "overtime_seconds": rng.randint(1, 120) if overtime else 0,
+    }
+
+
+def _time_calls(fn, budget_seconds=0.5, min_runs=3, max_runs=10_000, min_sample_seconds=0.001):
+    """
+    Runs fn() until the budget is spent; returns per-call stats in microseconds.
+    Fast functions are called in loops of `number` calls per sample (calibrated
+    so one sample takes at least min_sample_seconds) to keep timer noise out.
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= min_sample_seconds or number >= 1_000_000:
+            break
+        number *= 10
+
+    samples = []
+    deadline = time.perf_counter() + budget_seconds
+    while len(samples) < max_runs and (len(samples) < min_runs or time.perf_counter() < deadline):
+        started = time.perf_counter_ns()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter_ns() - started) / 1000 / number)
+    samples.sort()
+    return {
+        "runs": len(samples),
+        "calls_per_run": number,
+        "median_us": round(statistics.median(samples), 3),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_us": round(samples[0], 3),
+    }
+
+
+def bench_pipeline(seed=DEFAULT_SEED, budget=0.5):
+    """Per-stage timings for the catalog-independent part of the pipeline."""
+    replay = make_replay(seed)
+    player_id = replay["teams"]["orange"]["players"][-1]["id"]  # worst case for the linear scan
+    extracted = extract_player_and_game_data(replay, player_id)
+    stats, team, opponents = extracted["player_stats"], extracted["player_team_stats"], extracted["opponent_team_stats"]
+    intensity = calculate_game_intensity(stats, extracted["game_duration"])
+    performance = calculate_performance_score(stats)
+    teamwork = calculate_teamwork_factor(stats, team)
+    outcome = calculate_game_outcome(team, opponents)
+    categories = (categorize_intensity(intensity), categorize_performance(performance), categorize_teamwork(teamwork))
+    closeness = categorize_game_closeness(outcome["abs_score_differential"], extracted["game_overtime"])
+
+    def metrics_stage():
+        calculate_game_intensity(stats, extracted["game_duration"])
+        calculate_performance_score(stats)
+        calculate_teamwork_factor(stats, team)
+        calculate_game_outcome(team, opponents)
+
+    def categorize_stage():
+        categorize_intensity(intensity)
+        categorize_performance(performance)
+        categorize_teamwork(teamwork)
+        categorize_game_closeness(outcome["abs_score_differential"], extracted["game_overtime"])
+
+    return {
+        "extract_player_and_game_data": _time_calls(lambda: extract_player_and_game_data(replay, player_id), budget),
+        "metrics": _time_calls(metrics_stage, budget),
+        "categorize": _time_calls(categorize_stage, budget),
+        "determine_desired_song_attributes": _time_calls(
+            lambda: determine_desired_song_attributes(*categories, outcome, closeness), budget),
+    }
+
+
+def bench_player_games(count=10_000, seed=DEFAULT_SEED, budget=0.5):
+    """Scoring and categorizing `count` player-games: row by row vs metric_columns."""
+    rows = []
+    replay_seed = seed
+    while len(rows) < count:
+        rows.extend(extract_all_players_data(make_replay(replay_seed)).values())
+        replay_seed += 1
+    rows = rows[:count]
+
+    def scalar_stage():
+        for row in rows:
+            stats, team = row["player_stats"], row["player_team_stats"]
+            outcome = calculate_game_outcome(team, row["opponent_team_stats"])
+            categorize_intensity(calculate_game_intensity(stats, row["game_duration"]))
+            categorize_performance(calculate_performance_score(stats))
+            categorize_teamwork(calculate_teamwork_factor(stats, team))
+            categorize_game_closeness(outcome["abs_score_differential"], row["game_overtime"])
+
+    results = {"scalar": _time_calls(scalar_stage, budget, min_runs=1)}
+    if metric_columns.np is not None:
+        columns = metric_columns.player_game_columns(rows)
+        results["player_game_columns"] = _time_calls(lambda: metric_columns.player_game_columns(rows), budget, min_runs=1)
+        results["metric_columns"] = _time_calls(
+            lambda: metric_columns.categorize_metric_columns(
+                metric_columns.calculate_metric_columns(columns), columns["overtime"]), budget, min_runs=1)
+    return results
+
+
+def bench_catalog(size, seed=DEFAULT_SEED, budget=0.5, top_n=3):
+    """Load, index and matching timings for a synthetic catalog of `size` songs."""
+    songs = make_catalog(size, seed)
+    profiles = [
+        determine_desired_song_attributes(i, p, t, {"win_status": w}, c)
+        for i, p, t, w, c in [
+            ("High", "High", "High", "win", "Very Close / Overtime"),
+            ("Medium", "Medium", "Low", "loss", "Moderately Close"),
+            ("Low", "Low", "Medium", "draw", "Not Close"),
+        ]
+    ]
+    results = {}
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(songs, f)
+        results["load_song_database"] = _time_calls(lambda: load_song_database(path), budget, min_runs=1)
+    finally:
+        os.remove(path)
+
+    songs = song_records(songs)
+    results["find_matching_songs[scan]"] = _time_calls(
+        lambda: [find_matching_songs(songs, p, top_n) for p in profiles], budget, min_runs=1)
+
+    index_types = [("postings", PostingsSongIndex)]
+    if np is not None:
+        index_types.append(("numpy", NumpySongIndex))
+    for name, index_type in index_types:
+        results[f"build_song_index[{name}]"] = _time_calls(lambda: index_type(songs), budget, min_runs=1)
+        index = index_type(songs)
+        results[f"find_matching_songs[{name}]"] = _time_calls(
+            lambda: [find_matching_songs(songs, p, top_n, song_index=index) for p in profiles], budget)
+    return results
+
+
+def run(sizes=DEFAULT_SIZES, seed=DEFAULT_SEED, budget=0.5):
+    report = {
+        "meta": {
+            "seed": seed,
+            "budget_seconds": budget,
+            "python": platform.python_version(),
+            "numpy": np.__version__ if np is not None else None,
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {"pipeline": bench_pipeline(seed, budget), "player_games_10000": bench_player_games(10_000, seed, budget)},
+    }
+    for size in sizes:
+        print(f"Benchmarking catalog of {size} songs...", file=sys.stderr)
+        report["results"][f"catalog_{size}"] = bench_catalog(size, seed, budget)
+    return report
+
+
+def compare(baseline, current, threshold=0.15, metric="median_us"):
+    """
+    Returns (rows, regressions): one row per benchmark present in both reports;
+    a regression is a slowdown of more than `threshold` (0.15 = 15%).
+    """
+    rows, regressions = [], []
+    for group, benches in current["results"].items():
+        for name, stats in benches.items():
+            before = baseline.get("results", {}).get(group, {}).get(name)
+            if not before or not before.get(metric):
+                continue
+            change = stats[metric] / before[metric] - 1
+            row = (f"{group}/{name}", before[metric], stats[metric], change)
+            rows.append(row)
+            if change > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the song recommendation pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="Time every pipeline stage and write a JSON report.")
+    p_run.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated catalog sizes.")
+    p_run.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    p_run.add_argument("--budget", type=float, default=0.5, help="Seconds spent timing each stage.")
+    p_run.add_argument("--output", help="Report path (default: stdout).")
+
+    p_cmp = sub.add_parser("compare", help="Flag regressions of a report against a baseline.")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown (0.15 = 15%%).")
+    p_cmp.add_argument("--metric", default="median_us", choices=["median_us", "p95_us", "min_us"])
+
+    p_cat = sub.add_parser("generate-catalog", help="Write a synthetic songs.json.")
+    p_cat.add_argument("size", type=int)
+    p_cat.add_argument("path")
+    p_cat.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    p_rep = sub.add_parser("generate-replays", help="Write synthetic replay files (for recommend.py --batch).")
+    p_rep.add_argument("count", type=int)
+    p_rep.add_argument("directory")
+    p_rep.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        # load_song_database() prints on every call; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = json.dumps(run(sizes, args.seed, args.budget), indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+        else:
+            print(report)
+
+    elif args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+        rows, regressions = compare(baseline, current, args.threshold, args.metric)
+        for name, before, after, change in rows:
+            flag = "  REGRESSION" if change > args.threshold else ""
+            print(f"{name:55s} {before:14.1f} -> {after:14.1f} us  {change:+7.1%}{flag}")
+        print(f"\n{len(rows)} benchmarks compared, {len(regressions)} regression(s) over {args.threshold:.0%}.")
+        sys.exit(1 if regressions else 0)
+
+    elif args.command == "generate-catalog":
+        with open(args.path, "w", encoding="utf-8") as f:
+            json.dump(make_catalog(args.size, args.seed), f)
+
+    elif args.command == "generate-replays":
+        os.makedirs(args.directory, exist_ok=True)
+        for i in range(args.count):
+            with open(os.path.join(args.directory, f"replay_{i:06d}.json"), "w", encoding="utf-8") as f:
+                json.dump(make_replay(args.seed + i), f)
+
+
+if __name__ == "__main__":
+    main()
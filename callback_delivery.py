@@ -0,0 +1,479 @@
+"""
+Background delivery of webhook results to client callback URLs.
+
+submit() records the delivery in the `callbacks` table of the job database
+(CALLBACK_DB_PATH, default JOB_DB_PATH) and puts it on an in-memory
+schedule, so request and job threads never wait on a client's server. A
+small pool of delivery threads POSTs the JSON body, reusing one pooled
+requests.Session per destination host and allowing at most
+CALLBACK_PER_HOST concurrent deliveries to the same host. Failures are
+retried with exponential backoff and jitter; deliveries that never succeed
+are appended to a dead-letter JSONL file.
+
+A row is deleted only once its delivery succeeded or was dead-lettered, and
+its attempt count and next due time are stored after every failure, so
+delivery is at-least-once across restarts: each process loads the rows no
+one holds when it starts and every CALLBACK_RESCAN_SECONDS. Before sending,
+a thread leases the row (leased_until), so several workers sharing the
+database never send the same attempt twice.
+
+Callback URLs must resolve to public addresses: loopback, private,
+link-local (e.g. the 169.254.169.254 metadata service) and other reserved
+addresses are refused, both when the URL is accepted and again before every
+attempt (the DNS answer may change in between), and redirects are not
+followed. CALLBACK_ALLOWED_HOSTS lists host names that skip the check.
+
+If WEBHOOK_SECRET is set, every body is signed with HMAC-SHA256 over
+"<timestamp>.<body>" and sent as:
+    X-Webhook-Timestamp: <unix seconds>
+    X-Webhook-Signature: sha256=<hex digest>
+"""
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from job_queue import JOB_DB_PATH
+
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", 10))  # seconds per attempt
+CALLBACK_WORKERS = int(os.environ.get("CALLBACK_WORKERS", 4))
+CALLBACK_PER_HOST = int(os.environ.get("CALLBACK_PER_HOST", 2))
+CALLBACK_MAX_ATTEMPTS = int(os.environ.get("CALLBACK_MAX_ATTEMPTS", 6))
+CALLBACK_BACKOFF_BASE = float(os.environ.get("CALLBACK_BACKOFF_BASE", 1.0))   # seconds
+CALLBACK_BACKOFF_MAX = float(os.environ.get("CALLBACK_BACKOFF_MAX", 300.0))   # seconds
+CALLBACK_DEAD_LETTER_PATH = os.environ.get("CALLBACK_DEAD_LETTER_PATH", "callbacks_dead_letter.jsonl")
+CALLBACK_DB_PATH = os.environ.get("CALLBACK_DB_PATH") or JOB_DB_PATH
+CALLBACK_RESCAN_SECONDS = 30  # how often stored deliveries of other (or dead) processes are picked up
+# Hosts allowed even though they resolve to loopback/private addresses (comma-separated, e.g. "localhost,hooks.internal").
+CALLBACK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.environ.get("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+
+# Responses worth retrying; any other non-2xx status is a permanent failure.
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS callbacks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    delivery_id TEXT,
+    url TEXT NOT NULL,
+    body BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    due_at REAL NOT NULL,
+    leased_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS callbacks_due ON callbacks (due_at);
+"""
+
+
+def _is_public_address(address):
+    ip = ipaddress.ip_address(address.split("%", 1)[0])  # drop an IPv6 zone id
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def is_public_host(host, port=None):
+    """
+    True if every address `host` resolves to is public (or the host is in
+    CALLBACK_ALLOWED_HOSTS); False for loopback, private, link-local and
+    reserved addresses and for names that do not resolve.
+    """
+    if not host:
+        return False
+    if host.lower() in CALLBACK_ALLOWED_HOSTS:
+        return True
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return False
+    return bool(infos) and all(_is_public_address(info[4][0]) for info in infos)
+
+
+def is_valid_callback_url(url):
+    """True for absolute http(s) URLs whose host resolves to public addresses only."""
+    if not isinstance(url, str):
+        return False
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return False
+    try:
+        port = parts.port
+    except ValueError:
+        return False
+    return is_public_host(parts.hostname, port)
+
+
+def sign_body(body, secret, timestamp):
+    """Hex HMAC-SHA256 of "<timestamp>.<body>" (body as bytes)."""
+    message = str(timestamp).encode("utf-8") + b"." + body
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+class _Delivery:
+    def __init__(self, url, body, delivery_id, row_id=None, attempts=0, last_error=None):
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.body = body
+        self.delivery_id = delivery_id
+        self.row_id = row_id  # in the callbacks table; None if it could not be stored
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+class CallbackDispatcher:
+    """
+    Schedules, sends and retries callback POSTs on dedicated threads.
+    """
+
+    def __init__(self, secret=None, timeout=None, workers=None, per_host=None, max_attempts=None,
+                 backoff_base=None, backoff_max=None, dead_letter_path=None, path=None):
+        self.secret = WEBHOOK_SECRET if secret is None else secret
+        self.timeout = WEBHOOK_TIMEOUT if timeout is None else timeout
+        self.workers = CALLBACK_WORKERS if workers is None else workers
+        self.per_host = CALLBACK_PER_HOST if per_host is None else per_host
+        self.max_attempts = CALLBACK_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.backoff_base = CALLBACK_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = CALLBACK_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.dead_letter_path = dead_letter_path or CALLBACK_DEAD_LETTER_PATH
+        self.path = path or CALLBACK_DB_PATH
+        self.lease_seconds = self.timeout + 30
+
+        self._cond = threading.Condition()
+        self._schedule = []           # heap of (due, seq, delivery)
+        self._seq = itertools.count()
+        self._in_flight = {}          # host -> deliveries being sent
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+        self._known = set()           # row ids on the schedule or being sent by this process
+        self._rescanned_at = 0.0
+        self.delivered = 0
+        self.dead_lettered = 0
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        if not self._schema_ready:  # created on first use, not at import
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    # --- public API ---
+
+    def submit(self, url, payload, delivery_id=None):
+        """Stores and schedules `payload` to be POSTed to `url` as JSON; returns without sending."""
+        now = time.time()
+        delivery = _Delivery(url, json.dumps(payload).encode("utf-8"), delivery_id)
+        try:
+            conn = self._connect()
+            try:
+                delivery.row_id = conn.execute(
+                    "INSERT INTO callbacks (delivery_id, url, body, due_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (str(delivery_id) if delivery_id is not None else None, url, delivery.body, now, now),
+                ).lastrowid
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Error: could not store callback to '{url}' in '{self.path}' (it will not survive a restart): {e}")
+        self.start()
+        self._schedule_at(now, delivery)
+
+    def start(self):
+        """Starts the delivery threads for this process (idempotent, fork-aware)."""
+        with self._cond:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._threads = []
+            self._schedule = []
+            self._known = set()
+            self._rescanned_at = 0.0  # the first delivery thread loads what is stored
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"callback-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stops the delivery threads; stored deliveries are picked up again by the next start()."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        try:
+            conn = self._connect()
+            try:
+                (stored,) = conn.execute("SELECT COUNT(*) FROM callbacks").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            stored = None
+        with self._cond:
+            return {
+                "stored": stored,
+                "scheduled": len(self._schedule),
+                "in_flight": sum(self._in_flight.values()),
+                "delivered": self.delivered,
+                "dead_lettered": self.dead_lettered,
+            }
+
+    # --- scheduling ---
+
+    def _schedule_at(self, due, delivery):
+        with self._cond:
+            if delivery.row_id is not None:
+                self._known.add(delivery.row_id)
+            heapq.heappush(self._schedule, (due, next(self._seq), delivery))
+            self._cond.notify()
+
+    def _forget(self, delivery):
+        with self._cond:
+            self._known.discard(delivery.row_id)
+
+    def _rescan(self):
+        """Schedules stored deliveries that no process holds (left by a restart or a dead worker)."""
+        with self._cond:
+            if time.time() - self._rescanned_at < CALLBACK_RESCAN_SECONDS:
+                return
+            self._rescanned_at = time.time()
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, delivery_id, url, body, attempts, due_at, last_error FROM callbacks "
+                "WHERE leased_until IS NULL OR leased_until < ?",
+                (time.time(),),
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            with self._cond:
+                if row["id"] in self._known:
+                    continue
+            delivery = _Delivery(row["url"], bytes(row["body"]), row["delivery_id"], row["id"],
+                                 row["attempts"], row["last_error"])
+            self._schedule_at(row["due_at"], delivery)
+
+    def _lease(self, delivery):
+        """
+        Takes the stored row for one attempt. False if it was delivered
+        meanwhile, is leased by another process or was rescheduled by one
+        (then it is put back on this schedule at its new due time).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT attempts, due_at, leased_until FROM callbacks WHERE id = ?", (delivery.row_id,)
+            ).fetchone()
+            if row is None or (row["leased_until"] or 0) >= now or row["due_at"] > now:
+                conn.execute("ROLLBACK")
+            else:
+                conn.execute("UPDATE callbacks SET leased_until = ? WHERE id = ?",
+                             (now + self.lease_seconds, delivery.row_id))
+                conn.execute("COMMIT")
+                delivery.attempts = row["attempts"]
+                return True
+        finally:
+            conn.close()
+        self._forget(delivery)
+        if row is not None and (row["leased_until"] or 0) < now:
+            delivery.attempts = row["attempts"]
+            self._schedule_at(row["due_at"], delivery)
+        return False
+
+    def _store_outcome(self, delivery, due=None):
+        """Deletes the row (due None) or records the failed attempt and its next due time."""
+        if delivery.row_id is None:
+            return
+        conn = self._connect()
+        try:
+            if due is None:
+                conn.execute("DELETE FROM callbacks WHERE id = ?", (delivery.row_id,))
+            else:
+                conn.execute(
+                    "UPDATE callbacks SET attempts = ?, due_at = ?, last_error = ?, leased_until = NULL WHERE id = ?",
+                    (delivery.attempts, due, delivery.last_error, delivery.row_id),
+                )
+        finally:
+            conn.close()
+
+    def _next_delivery(self):
+        """
+        Blocks until a delivery is due and its host is under the cap. Returns
+        None once stopping and False when it is time to rescan the database.
+        """
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                if now - self._rescanned_at >= CALLBACK_RESCAN_SECONDS:
+                    return False
+                wait = None
+                deferred = []
+                picked = None
+                while self._schedule and self._schedule[0][0] <= now:
+                    entry = heapq.heappop(self._schedule)
+                    if self._in_flight.get(entry[2].host, 0) < self.per_host:
+                        picked = entry[2]
+                        break
+                    deferred.append(entry)
+                for entry in deferred:
+                    heapq.heappush(self._schedule, entry)
+                if picked is not None:
+                    self._in_flight[picked.host] = self._in_flight.get(picked.host, 0) + 1
+                    return picked
+                if self._schedule and not deferred:
+                    wait = self._schedule[0][0] - now
+                # With only capped hosts due, wait for a delivery to finish.
+                self._cond.wait(timeout=wait if wait is not None else 1.0)
+            return None
+
+    def _release(self, delivery):
+        with self._cond:
+            self._in_flight[delivery.host] -= 1
+            if not self._in_flight[delivery.host]:
+                del self._in_flight[delivery.host]
+            self._cond.notify()
+
+    def _backoff(self, attempts):
+        """Exponential backoff with jitter: half fixed, half random."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # --- sending ---
+
+    def _session(self, host):
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, self.per_host))
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _headers(self, delivery):
+        headers = {"Content-Type": "application/json", "User-Agent": "song-recommendation-engine/1.0"}
+        if delivery.delivery_id:
+            headers["X-Webhook-Id"] = str(delivery.delivery_id)
+        if self.secret:
+            timestamp = int(time.time())
+            headers["X-Webhook-Timestamp"] = str(timestamp)
+            headers["X-Webhook-Signature"] = "sha256=" + sign_body(delivery.body, self.secret, timestamp)
+        return headers
+
+    def _send(self, delivery):
+        """Returns (done, retryable)."""
+        delivery.attempts += 1
+        parts = urlsplit(delivery.url)
+        if not is_public_host(parts.hostname, parts.port):
+            delivery.last_error = "callback host does not resolve to a public address"
+            return False, False
+        try:
+            response = self._session(delivery.host).post(
+                delivery.url, data=delivery.body, headers=self._headers(delivery), timeout=self.timeout,
+                allow_redirects=False,
+            )
+        except requests.RequestException as e:
+            delivery.last_error = f"{type(e).__name__}: {e}"
+            return False, True
+        if 200 <= response.status_code < 300:
+            return True, False
+        # 3xx is a failure too: following a redirect could reach an internal host.
+        delivery.last_error = f"HTTP {response.status_code}"
+        return False, response.status_code in RETRY_STATUSES
+
+    def _dead_letter(self, delivery):
+        record = {
+            "delivery_id": delivery.delivery_id,
+            "url": delivery.url,
+            "attempts": delivery.attempts,
+            "last_error": delivery.last_error,
+            "failed_at": datetime.utcnow().isoformat(),
+            "payload": json.loads(delivery.body),
+        }
+        print(f"Error: giving up on callback to '{delivery.url}' after {delivery.attempts} attempt(s): {delivery.last_error}")
+        with self._dead_letter_lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self.dead_lettered += 1
+
+    def _run(self):
+        while True:
+            try:
+                self._rescan()
+            except sqlite3.Error as e:
+                print(f"Error: could not load stored callbacks from '{self.path}': {e}")
+            delivery = self._next_delivery()
+            if delivery is None:
+                return
+            if delivery is False:
+                continue
+            try:
+                if delivery.row_id is not None and not self._lease(delivery):
+                    continue
+                done, retryable = self._send(delivery)
+            except sqlite3.Error as e:
+                print(f"Error: could not lease callback {delivery.row_id} in '{self.path}': {e}")
+                self._forget(delivery)  # the next rescan retries it
+                continue
+            finally:
+                self._release(delivery)
+
+            due = None
+            if done:
+                with self._cond:
+                    self.delivered += 1
+            elif retryable and delivery.attempts < self.max_attempts:
+                due = time.time() + self._backoff(delivery.attempts)
+            else:
+                try:
+                    self._dead_letter(delivery)
+                except OSError as e:
+                    print(f"Error: could not write dead letter to '{self.dead_letter_path}': {e}")
+            try:
+                self._store_outcome(delivery, due)
+            except sqlite3.Error as e:
+                print(f"Error: could not record callback {delivery.row_id} in '{self.path}': {e}")
+            if due is None:
+                self._forget(delivery)
+            else:
+                self._schedule_at(due, delivery)
+
+
+_dispatcher = CallbackDispatcher()
+
+def deliver_callback(url, payload, delivery_id=None):
+    """Queues a callback POST on the process-wide dispatcher."""
+    _dispatcher.submit(url, payload, delivery_id)
+
+def get_callback_stats():
+    """Delivery counters for the process-wide dispatcher."""
+    return _dispatcher.stats()
@@ -0,0 +1,229 @@
+"""
+Cold-start snapshot for the Vercel handler in recommend.py.
+
+    python cold_start.py build             # before deploying
+    python cold_start.py report [--runs 5] # startup time of a fresh `import recommend`
+
+`build` pickles what the first request would otherwise compute: the parsed
+catalog (Song records), the compiled rules, the precomputed recommendation
+table and the song index. recommend.py loads it at import time with a single
+read and installs it into the process-wide catalog and rule engine. The index
+is stored as its own pickle and only unpickled if a request falls through
+the table (top_n deeper than the table), so numpy stays off the cold path.
+
+The snapshot records the size, mtime and SHA-256 digest of the song and
+rules files. A file whose size and mtime still match is trusted without
+hashing; otherwise it is hashed, and if the digest changed the snapshot is
+ignored and everything is computed as usual.
+
+On Vercel, vercel.json runs `build` as the deployment's build command and
+ships the snapshot with the function (api/recommend.py).
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import time
+
+from rule_engine import RULES_FILE, install_rules, load_rules
+from song_management import SONG_DATABASE_FILE, install_catalog, load_song_database
+
+logger = logging.getLogger(__name__)
+
+COLD_START_SNAPSHOT = os.environ.get("COLD_START_SNAPSHOT", "recommend_snapshot.pickle")  # empty disables it
+SNAPSHOT_FORMAT = 2
+
+
+def _file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _file_unchanged(path, recorded):
+    """True if `path` still has the contents recorded at build time ({"stat", "sha256"})."""
+    if _file_stat(path) == recorded["stat"]:
+        return True
+    return _file_digest(path) == recorded["sha256"]
+
+
+def build_snapshot(path=None, songs_path=None, rules_path=None):
+    """Builds the snapshot file; returns a summary dict."""
+    from recommendation_table import RecommendationTable
+    from song_index import build_song_index
+
+    path = path or COLD_START_SNAPSHOT
+    songs_path = songs_path or SONG_DATABASE_FILE
+    rules_path = rules_path or RULES_FILE
+    songs = load_song_database(songs_path)
+    if not songs:
+        raise ValueError(f"no songs could be loaded from '{songs_path}'")
+    rules = load_rules(rules_path)
+    index = build_song_index(songs)
+    table = RecommendationTable(songs, rules, index=index)
+
+    # The index is pickled on its own, without the songs it shares with the table.
+    index.songs = None
+    index_blob = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "built_at": time.time(),
+        "songs_file": {"stat": _file_stat(songs_path), "sha256": _file_digest(songs_path)},
+        "rules_file": {"stat": _file_stat(rules_path), "sha256": _file_digest(rules_path)},
+        "songs": songs,
+        "rules": rules,
+        "reference_mismatches": len(rules.validate()),
+        "recommendation_table": table,
+        "song_index": index_blob,
+    }
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return {"path": path, "songs": len(songs), "bytes": os.path.getsize(path), "index": type(index).__name__}
+
+
+def _restore_index(blob):
+    def restore(songs):
+        index = pickle.loads(blob)
+        index.songs = songs
+        return index
+    return restore
+
+
+def load_snapshot(path=None, songs_path=None, rules_path=None):
+    """
+    Reads the snapshot and installs it as the process-wide catalog and rules.
+    Returns True if it was used; False (after printing why) if it is missing,
+    unreadable or stale.
+    """
+    path = COLD_START_SNAPSHOT if path is None else path
+    if not path or not os.path.exists(path):
+        return False
+    songs_path = songs_path or SONG_DATABASE_FILE
+    rules_path = rules_path or RULES_FILE
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            logger.warning(f"cold-start snapshot '{path}' has format {snapshot.get('format')}; ignoring it.")
+            return False
+        if (not _file_unchanged(songs_path, snapshot["songs_file"])
+                or not _file_unchanged(rules_path, snapshot["rules_file"])):
+            logger.warning(f"cold-start snapshot '{path}' is older than the song or rules file; ignoring it.")
+            return False
+    except Exception as e:
+        logger.warning(f"could not read cold-start snapshot '{path}': {e}")
+        return False
+
+    rules = snapshot["rules"]
+    install_rules(rules, snapshot["reference_mismatches"])
+    install_catalog(
+        snapshot["songs"],
+        artifacts={"recommendation_table": (rules.fingerprint, snapshot["recommendation_table"])},
+        restorers={"song_index": (None, _restore_index(snapshot["song_index"]))},
+        source=path,
+    )
+    return True
+
+
+# --- startup report ---
+
+_REPORT_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import recommend
+imported = time.perf_counter()
+recommend.get_song_recommendations(recommend.FULL_REPLAY_DATA_SAMPLE, "ce45140fcd644755b01660aa2dc6977b", 3)
+first = time.perf_counter()
+print(json.dumps({"phases": recommend.STARTUP_TIMINGS,
+                  "import_recommend_ms": (imported - started) * 1000,
+                  "first_request_ms": (first - imported) * 1000}))
+"""
+
+
+def _parse_importtime(stderr, module="recommend"):
+    """Cumulative import time (us) of each module imported directly by `module`."""
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # -X importtime prints children (indented two more spaces) before their parent.
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                return children
+            children = {}
+    return {}
+
+
+def startup_report(runs=5):
+    """Runs `import recommend` plus one request in fresh interpreters; returns median timings."""
+    import json
+    import statistics
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples, imports = [], []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _REPORT_SCRIPT],
+                              cwd=here, capture_output=True, text=True, check=True)
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        imports.append(_parse_importtime(proc.stderr))
+
+    def median(values):
+        return round(statistics.median(values), 3)
+
+    phases = {name: median([s["phases"][name] for s in samples]) for name in samples[0]["phases"]}
+    modules = {}
+    for name in imports[0]:
+        modules[name] = median([run.get(name, 0) / 1000 for run in imports])
+    return {
+        "runs": runs,
+        "snapshot": COLD_START_SNAPSHOT if COLD_START_SNAPSHOT and os.path.exists(COLD_START_SNAPSHOT) else None,
+        "import_recommend_ms": median([s["import_recommend_ms"] for s in samples]),
+        "first_request_ms": median([s["first_request_ms"] for s in samples]),
+        "phases_ms": phases,
+        "imports_ms": dict(sorted(modules.items(), key=lambda item: -item[1])),
+    }
+
+
+def main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Build the cold-start snapshot or report startup time.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="Write the snapshot for the current songs and rules.")
+    p_build.add_argument("--output", default=None, help="Snapshot path (default: COLD_START_SNAPSHOT).")
+    p_report = sub.add_parser("report", help="Measure a fresh `import recommend` and the first request.")
+    p_report.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        try:
+            summary = build_snapshot(args.output)
+        except (OSError, ValueError) as e:
+            print(f"Error: could not build the cold-start snapshot: {e}")
+            sys.exit(1)
+        print(json.dumps(summary, indent=2))
+    else:
+        print(json.dumps(startup_report(args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
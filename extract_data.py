@@ -1,3 +1,8 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 def extract_player_and_game_data(replay_data, target_player_id):
     """
     Extracts relevant data for a target player from the replay JSON.
@@ -8,11 +13,12 @@ def extract_player_and_game_data(replay_data, target_player_id):
 
     Returns:
         dict: A dictionary containing 'player_stats', 'player_team_stats',
-              'opponent_team_stats', and 'game_duration', or None if player not found.
+              'opponent_team_stats', 'game_duration', 'game_overtime' and
+              'game_playlist', or None if player not found.
     """
     game_duration = replay_data.get("duration")
     if game_duration is None:
-        print("Error: Game duration not found in replay data.")
+        logger.error("Game duration not found in replay data.")
         return None
 
     player_stats = None
@@ -34,13 +40,13 @@ def extract_player_and_game_data(replay_data, target_player_id):
             break
 
     if not player_stats:
-        print(f"Error: Player with ID '{target_player_id}' not found.")
+        logger.error(f"Player with ID '{target_player_id}' not found.")
         return None
     if not player_team_stats:
-        print(f"Error: Team data for player '{target_player_id}' not found.") # Should not happen if player is found
+        logger.error(f"Team data for player '{target_player_id}' not found.") # Should not happen if player is found
         return None
     if not opponent_team_stats:
-        print(f"Error: Opponent team data not found.") # Should not happen if player is found and teams exist
+        logger.error("Opponent team data not found.") # Should not happen if player is found and teams exist
         return None
 
 
@@ -49,9 +55,49 @@ def extract_player_and_game_data(replay_data, target_player_id):
         "player_team_stats": player_team_stats,
         "opponent_team_stats": opponent_team_stats,
         "game_duration": game_duration,
-        "game_overtime": replay_data.get("overtime", False) # Added for potential future use or context
+        "game_overtime": replay_data.get("overtime", False), # Added for potential future use or context
+        "game_playlist": replay_data.get("playlist")
     }
 
+def extract_all_players_data(replay_data):
+    """
+    Indexes every player in the replay in a single pass over `teams`.
+
+    Args:
+        replay_data (dict): The full replay JSON data.
+
+    Returns:
+        dict: player id -> the same dictionary extract_player_and_game_data()
+              returns for that player (in replay order), or None if the game
+              duration is missing.
+    """
+    game_duration = replay_data.get("duration")
+    if game_duration is None:
+        logger.error("Game duration not found in replay data.")
+        return None
+
+    teams = replay_data.get("teams", {})
+    game_overtime = replay_data.get("overtime", False)
+    game_playlist = replay_data.get("playlist")
+    players = {}
+    for team_color, team_data in teams.items():
+        opponent_team_stats = teams.get("orange" if team_color == "blue" else "blue", {})
+        if not opponent_team_stats:
+            continue
+        for player in team_data.get("players", []):
+            player_id = player.get("id")
+            if player_id is None or player_id in players:
+                continue
+            players[player_id] = {
+                "player_stats": player,
+                "player_team_stats": team_data,
+                "opponent_team_stats": opponent_team_stats,
+                "game_duration": game_duration,
+                "game_overtime": game_overtime,
+                "game_playlist": game_playlist
+            }
+    return players
+
 # Example Usage (assuming replay_data_sample is populated with your full sample):
 # target_player_id = "ce45140fcd644755b01660aa2dc6977b" # ZwyxerS
 # extracted_data = extract_player_and_game_data(replay_data_sample, target_player_id)
@@ -0,0 +1,52 @@
+"""
+(mtime, size) signatures of the files the service hot-reloads (catalog, rules,
+thresholds), stat'ed at most once per request.
+
+Every lookup of the catalog, the rules or the cutoffs checks its file, and one
+cached /recommend touches each of them several times (the response cache
+generation, the pipeline, the recommendation table). Inside
+`with signature_scope():` the first stat of a path is reused for the rest of
+the block, so a request sees one consistent set of files and the response
+cache generation is exactly what the pipeline used. Outside a scope every
+call stats, as before.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def stat_signature(path):
+    """(st_mtime_ns, st_size) of `path`, or None if it cannot be stat'ed."""
+    signatures = getattr(_local, "signatures", None)
+    if signatures is not None and path in signatures:
+        return signatures[path]
+    try:
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        signature = None
+    if signatures is not None:
+        signatures[path] = signature
+    return signature
+
+
+def forget_signature(path):
+    """Drops the scope's signature of `path`, after this thread rewrote the file."""
+    signatures = getattr(_local, "signatures", None)
+    if signatures is not None:
+        signatures.pop(path, None)
+
+
+@contextmanager
+def signature_scope():
+    """Reuses stat_signature() results until the block ends (nested scopes share the outer one)."""
+    if getattr(_local, "signatures", None) is not None:
+        yield
+        return
+    _local.signatures = {}
+    try:
+        yield
+    finally:
+        _local.signatures = None
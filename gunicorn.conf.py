@@ -0,0 +1,34 @@
+"""
+gunicorn settings (picked up automatically from the working directory).
+
+The app is imported once in the master process, which warms it up (catalog,
+indexes, recommendation table, canary) and freezes the heap; workers are
+forked from that warm image and share its memory pages copy-on-write.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))  # > 1 selects the gthread worker
+timeout = 120
+preload_app = True
+
+# Warm the preloaded app up in the master (see warmup.py); off by default elsewhere.
+os.environ.setdefault("WARMUP_ON_IMPORT", "true")
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app was imported, right before the first fork.
+    import app
+    app.before_fork()
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
+
+
+def on_exit(server):
+    # The shared response cache (RESPONSE_CACHE_BACKEND=shared) outlives worker restarts, not the server.
+    import response_cache
+    response_cache.remove_shared_response_cache()
@@ -0,0 +1,306 @@
+"""
+In-process request/stage timing and Prometheus text exposition.
+
+(metrics.py holds the game metrics; this module is about the service itself.)
+
+Histograms and counters live in this process only; with several gunicorn
+workers each one reports its own numbers and Prometheus sums them per
+instance. Recording a stage is one perf_counter() call and one append to a
+deque (atomic, no lock); samples are folded into the histograms when
+/metrics is scraped or, by mark() itself, when the backlog gets long, so
+processes that never serve HTTP (batch workers, the Vercel handler) stay
+bounded too.
+
+The in-flight request count is also kept host-wide once
+share_requests_in_flight() ran in the gunicorn master: every forked worker
+adds its count to its own slot of an anonymous shared array, so
+requests_in_flight_on_host() sees requests held by the other workers,
+which is what piles up in the listen backlog when sync workers are busy.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Upper bounds (seconds) of the latency buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Fold pending stage samples into histograms once this many have queued up.
+MAX_PENDING_SAMPLES = 10000
+
+_local = threading.local()
+_pending_samples = deque()   # (endpoint, stage, seconds)
+_in_flight_lock = threading.Lock()
+_requests_in_flight = 0
+
+HOST_SLOTS = 256  # worker processes the host-wide counter can track at once
+_host_slots = None  # shared array of (pid, in_flight) pairs, created before forking
+_host_slot = (None, None)  # (pid, index) of this process's slot
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a sum and count (Prometheus semantics)."""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_latency = {}     # (endpoint, stage) -> Histogram
+        self.request_latency = {}   # endpoint -> Histogram
+        self.requests = {}          # (endpoint, status) -> count
+        self.cache_events = {}      # (cache, "hit" | "miss") -> count
+
+    def histogram(self, table, key):
+        hist = table.get(key)
+        if hist is None:
+            with self._lock:
+                hist = table.setdefault(key, Histogram())
+        return hist
+
+    def increment(self, table, key):
+        with self._lock:
+            table[key] = table.get(key, 0) + 1
+
+    def fold_pending(self):
+        """Moves queued stage samples into their histograms."""
+        popleft = _pending_samples.popleft
+        for _ in range(len(_pending_samples)):
+            try:
+                endpoint, stage, seconds = popleft()
+            except IndexError:  # another thread is folding too
+                break
+            self.histogram(self.stage_latency, (endpoint, stage)).observe(seconds)
+
+
+_registry = _Registry()
+
+
+def set_current_endpoint(endpoint):
+    """Labels stage timings recorded on this thread until the next call."""
+    _local.endpoint = endpoint or "unknown"
+
+
+def current_endpoint():
+    return getattr(_local, "endpoint", "unknown")
+
+
+class StageClock:
+    """
+    Times consecutive pipeline stages:
+
+        clock = StageClock()
+        ...extract...
+        clock.mark("extract")   # time since the clock was created
+        ...metrics...
+        clock.mark("metrics")   # time since the previous mark
+    """
+
+    __slots__ = ("endpoint", "last")
+
+    def __init__(self):
+        self.endpoint = current_endpoint()
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        _pending_samples.append((self.endpoint, stage, now - self.last))
+        self.last = now
+        if len(_pending_samples) > MAX_PENDING_SAMPLES:
+            _registry.fold_pending()
+
+
+def request_started():
+    global _requests_in_flight
+    with _in_flight_lock:
+        _requests_in_flight += 1
+    _add_on_host(1)
+
+
+def request_finished():
+    global _requests_in_flight
+    with _in_flight_lock:
+        _requests_in_flight -= 1
+    _add_on_host(-1)
+
+
+def requests_in_flight():
+    """HTTP requests this process is handling right now (between before_request and teardown)."""
+    return _requests_in_flight
+
+
+def share_requests_in_flight(slots=HOST_SLOTS):
+    """Creates the host-wide in-flight counter; call in the master before workers are forked."""
+    global _host_slots
+    if _host_slots is None:
+        import multiprocessing
+        _host_slots = multiprocessing.Array("q", 2 * slots)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _host_index():
+    """This process's slot, claimed on first use (reusing slots of exited workers). Hold the array lock."""
+    global _host_slot
+    pid = os.getpid()
+    if _host_slot[0] == pid:
+        return _host_slot[1]
+    index = None
+    for i in range(0, len(_host_slots), 2):
+        owner = _host_slots[i]
+        if owner == pid or owner == 0 or not _pid_alive(owner):
+            index = i
+            break
+    if index is not None:
+        _host_slots[index] = pid
+        _host_slots[index + 1] = 0
+    _host_slot = (pid, index)
+    return index
+
+
+def _add_on_host(delta):
+    if _host_slots is None:
+        return
+    with _host_slots.get_lock():
+        index = _host_index()
+        if index is not None:
+            _host_slots[index + 1] += delta
+
+
+def requests_in_flight_on_host():
+    """HTTP requests all workers forked from this master are handling (this process's count without the shared counter)."""
+    if _host_slots is None:
+        return _requests_in_flight
+    total = 0
+    with _host_slots.get_lock():
+        for i in range(0, len(_host_slots), 2):
+            if _host_slots[i] and _host_slots[i + 1] > 0 and _pid_alive(_host_slots[i]):
+                total += _host_slots[i + 1]
+    return total
+
+
+def observe_request(endpoint, status_code, seconds):
+    """Records one finished HTTP request."""
+    _registry.histogram(_registry.request_latency, endpoint or "unknown").observe(seconds)
+    _registry.increment(_registry.requests, (endpoint or "unknown", str(status_code)))
+
+
+def record_cache(cache, hit):
+    """Counts a hit or miss for a named cache."""
+    _registry.increment(_registry.cache_events, (cache, "hit" if hit else "miss"))
+
+
+# --- Prometheus text format ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_le(bound):
+    return repr(float(bound))
+
+
+def _histogram_lines(name, help_text, histograms, label_names):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key, hist in sorted(histograms.items()):
+        key = key if isinstance(key, tuple) else (key,)
+        labels = dict(zip(label_names, key))
+        counts, total, count = hist.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(hist.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels(**labels, le=_format_le(bound))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {total}")
+        lines.append(f"{name}_count{_labels(**labels)} {count}")
+    return lines
+
+
+def render_prometheus(gauges=(), counters=(), caches=None):
+    """
+    Returns the registry in Prometheus text exposition format.
+    `gauges` / `counters` are extra (name, help, [(labels_dict, value), ...]) series
+    sampled at scrape time (catalog size, job counts, ...); `caches` maps a cache
+    name to (hits, misses) counted elsewhere (e.g. by SongCatalog).
+    """
+    _registry.fold_pending()
+    lines = []
+    lines += _histogram_lines(
+        "song_rec_stage_duration_seconds", "Time spent in each recommendation pipeline stage.",
+        dict(_registry.stage_latency), ("endpoint", "stage"),
+    )
+    lines += _histogram_lines(
+        "song_rec_request_duration_seconds", "HTTP request latency by endpoint.",
+        dict(_registry.request_latency), ("endpoint",),
+    )
+
+    lines += ["# HELP song_rec_requests_total HTTP requests by endpoint and status code.",
+              "# TYPE song_rec_requests_total counter"]
+    for (endpoint, status), count in sorted(dict(_registry.requests).items()):
+        lines.append(f"song_rec_requests_total{_labels(endpoint=endpoint, status=status)} {count}")
+
+    lines += ["# HELP song_rec_request_errors_total HTTP requests answered with a 4xx/5xx status.",
+              "# TYPE song_rec_request_errors_total counter"]
+    errors = {}
+    for (endpoint, status), count in dict(_registry.requests).items():
+        if status[:1] in ("4", "5"):
+            errors[(endpoint, status[0] + "xx")] = errors.get((endpoint, status[0] + "xx"), 0) + count
+    for (endpoint, status_class), count in sorted(errors.items()):
+        lines.append(f"song_rec_request_errors_total{_labels(endpoint=endpoint, status_class=status_class)} {count}")
+
+    cache_events = dict(_registry.cache_events)
+    for cache, (hits, misses) in (caches or {}).items():
+        cache_events[(cache, "hit")] = cache_events.get((cache, "hit"), 0) + hits
+        cache_events[(cache, "miss")] = cache_events.get((cache, "miss"), 0) + misses
+    lines += ["# HELP song_rec_cache_events_total Cache lookups by cache and result.",
+              "# TYPE song_rec_cache_events_total counter"]
+    for (cache, result), count in sorted(cache_events.items()):
+        lines.append(f"song_rec_cache_events_total{_labels(cache=cache, result=result)} {count}")
+
+    for name, help_text, samples in counters:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_labels(**labels) if labels else ''} {value}" for labels, value in samples]
+
+    ratios = {}
+    for (cache, result), count in cache_events.items():
+        hits, total = ratios.get(cache, (0, 0))
+        ratios[cache] = (hits + (count if result == "hit" else 0), total + count)
+    ratio_samples = [({"cache": cache}, hits / total) for cache, (hits, total) in sorted(ratios.items()) if total]
+    gauges = list(gauges) + [("song_rec_cache_hit_ratio", "Hit ratio per cache since process start.", ratio_samples)]
+    for name, help_text, samples in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_labels(**labels) if labels else ''} {value}" for labels, value in samples]
+
+    return "\n".join(lines) + "\n"
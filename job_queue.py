@@ -0,0 +1,340 @@
+"""
+Durable local job queue for work that should not block an HTTP worker.
+
+Jobs are rows in a SQLite file, so queued work survives a restart of the
+process (or of the container, as long as JOB_DB_PATH is on a volume). Each
+process drains the queue with a small pool of daemon threads, started by the
+first submit() or an explicit start(); the file is only opened on first use.
+Claiming a job is a single IMMEDIATE transaction, so several gunicorn workers
+can share one database file. A job that was running when its process died is picked up
+again once its lease expires.
+
+A claimed job gets a random claim token. While it runs, a heartbeat thread
+renews its lease every JOB_LEASE_SECONDS / 3, so long jobs are not claimed
+twice. The result is only written if the token still matches: a worker
+whose lease lapsed cannot overwrite the result of the worker that took over.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", 100))        # queued jobs before submit() refuses
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 300))  # running jobs not renewed for this long are retried
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 86400))   # seconds finished jobs are kept
+JOB_PRUNE_INTERVAL = 60  # seconds between deletes of expired finished jobs (per process)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    claim_token TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+# Columns added after the first release; added to older databases on open.
+_ADDED_COLUMNS = (("claim_token", "TEXT"), ("heartbeat_at", "REAL"))
+
+
+ABANDONED_ERROR = "worker lost the job too many times"
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit() when the queue is at JOB_QUEUE_MAX."""
+
+
+class JobQueue:
+    """
+    SQLite-backed FIFO of JSON payloads processed by handler(payload, job_id) -> result.
+
+    Job status goes queued -> running -> done | failed. A handler exception
+    marks the job failed; a job whose lease expires while running (worker
+    died) is retried up to max_attempts times. Either way a failed job is
+    reported to on_failure(payload, job_id, error), if given.
+    """
+
+    def __init__(self, handler, path=None, workers=None, max_queued=None,
+                 lease_seconds=None, max_attempts=None, result_ttl=None, on_failure=None):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.path = path or JOB_DB_PATH
+        self.workers = JOB_WORKERS if workers is None else workers
+        self.max_queued = JOB_QUEUE_MAX if max_queued is None else max_queued
+        self.lease_seconds = JOB_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.max_attempts = JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.result_ttl = JOB_RESULT_TTL if result_ttl is None else result_ttl
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._held = {}  # job_id -> claim token of the jobs this process is running
+        self._held_lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._stopped = threading.Event()  # wakes the heartbeat thread on stop()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        if not self._schema_ready:  # created on first use, not at import
+            self._create_schema(conn)
+            self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.executescript(_SCHEMA)
+        # Forked workers open the file at the same time; one of them adds the columns.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in _ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- producer side ---
+
+    def submit(self, payload):
+        """Queues `payload` and returns its job id; raises QueueFullError when full."""
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= self.max_queued:
+                conn.execute("ROLLBACK")
+                raise QueueFullError(f"job queue is full ({queued} queued)")
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(payload), time.time()),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Returns the job as a JSON-serializable dict, or None if unknown."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": row["error"],
+        }
+
+    def stats(self):
+        """Job counts per status."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    # --- consumer side ---
+
+    def start(self):
+        """Starts the worker threads for this process (idempotent, fork-aware)."""
+        if self._pid == os.getpid() and self._threads:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._stopped.clear()
+            self._threads = []
+            with self._held_lock:
+                self._held = {}
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.workers:
+                thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Asks the worker threads to exit after their current job."""
+        self._stopping = True
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = now - self.lease_seconds
+            # Give up on jobs whose workers died too many times.
+            abandoned = conn.execute(
+                "SELECT id, payload FROM jobs "
+                "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ? AND attempts >= ?",
+                (expired, self.max_attempts),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, claim_token = NULL WHERE id = ?",
+                [(ABANDONED_ERROR, now, row["id"]) for row in abandoned],
+            )
+            row = conn.execute(
+                "SELECT id, payload FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND COALESCE(heartbeat_at, started_at) < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (expired,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                self._report_failures(abandoned)
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, claim_token = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (now, now, token, row["id"]),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self._report_failures(abandoned)
+        return row["id"], token, json.loads(row["payload"])
+
+    def _report_failures(self, rows):
+        for row in rows:
+            self._failed(json.loads(row["payload"]), row["id"], ABANDONED_ERROR)
+
+    def _failed(self, payload, job_id, error):
+        if self.on_failure is None:
+            return
+        try:
+            self.on_failure(payload, job_id, error)
+        except Exception:
+            traceback.print_exc()
+
+    def _finish(self, job_id, token, status, result=None, error=None):
+        """Records the outcome if this process still holds the claim; False if the lease was lost."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, claim_token = NULL "
+                "WHERE id = ? AND claim_token = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, token),
+            )
+            finished = cursor.rowcount == 1
+        finally:
+            conn.close()
+        if not finished:
+            print(f"Warning: job {job_id} was claimed by another worker after its lease expired; result discarded")
+        return finished
+
+    def _heartbeat(self):
+        """Renews the lease of every job this process is running."""
+        interval = max(self.lease_seconds / 3, 0.05)
+        while not self._stopped.wait(interval):
+            with self._held_lock:
+                held = list(self._held.items())
+            if not held:
+                continue
+            try:
+                conn = self._connect()
+                try:
+                    now = time.time()
+                    conn.executemany(
+                        "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND claim_token = ? AND status = 'running'",
+                        [(now, job_id, token) for job_id, token in held],
+                    )
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Error: could not renew job leases in '{self.path}': {e}")
+
+    def _prune(self):
+        if not self.result_ttl:
+            return
+        now = time.time()
+        with self._held_lock:  # one delete per JOB_PRUNE_INTERVAL across this process's workers
+            if now - self._pruned_at < JOB_PRUNE_INTERVAL:
+                return
+            self._pruned_at = now
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.result_ttl,),
+            )
+        finally:
+            conn.close()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                print(f"Error: could not claim a job from '{self.path}': {e}")
+                claimed = None
+
+            if claimed is None:
+                try:
+                    self._prune()
+                except sqlite3.Error:
+                    pass
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+
+            job_id, token, payload = claimed
+            with self._held_lock:
+                self._held[job_id] = token
+            try:
+                result = self.handler(payload, job_id)
+            except Exception as e:
+                traceback.print_exc()
+                if self._finish(job_id, token, "failed", error=str(e)):
+                    self._failed(payload, job_id, str(e))
+            else:
+                self._finish(job_id, token, "done", result=result)
+            finally:
+                with self._held_lock:
+                    self._held.pop(job_id, None)
@@ -0,0 +1,326 @@
+"""
+Local HTTP load tests for the Flask app (under gunicorn) and the Vercel handler.
+
+    python loadtest.py gunicorn --workers 2 --worker-class sync --concurrency 16 --duration 20
+    python loadtest.py vercel --concurrency 8 --requests 2000
+    python loadtest.py url http://localhost:8000 --mix recommend=8,recommend_test=2
+
+Each run starts the server on a free local port (except 'url'), waits until it
+answers, drives it from `--concurrency` client threads with a weighted
+request mix built from synthetic replays (see benchmark.make_replay), and
+prints throughput, p50/p95/p99 latency and error rates per request type.
+--output writes the same report as JSON so deployment shapes can be compared.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import make_replay
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = "recommend=6,recommend_test=3,webhook=1"
+
+# Request types and how they map onto each server flavour.
+FLASK_ROUTES = {
+    "recommend": ("POST", "/recommend"),
+    "recommend_test": ("GET", "/recommend/test"),
+    "webhook": ("POST", "/webhook/recommend"),
+}
+VERCEL_ROUTES = {
+    "recommend": ("POST", "/"),
+    "recommend_test": ("GET", "/"),
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(base_url, path, timeout=30):
+    parts = urlsplit(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            conn.request("GET", path)
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not become ready within {timeout}s")
+
+
+def _server_env(scratch_dir):
+    """Keeps the spawned server's job database and dead letters out of the checkout."""
+    env = dict(os.environ)
+    env.setdefault("JOB_DB_PATH", os.path.join(scratch_dir, "jobs.sqlite3"))
+    env.setdefault("CALLBACK_DEAD_LETTER_PATH", os.path.join(scratch_dir, "callbacks_dead_letter.jsonl"))
+    return env
+
+
+def start_gunicorn(workers, worker_class, threads, port, env=None):
+    """Starts `gunicorn app:app` on 127.0.0.1:port; returns the process."""
+    cmd = [
+        sys.executable, "-m", "gunicorn", "app:app",
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--worker-class", worker_class,
+        "--threads", str(threads),
+        "--timeout", "120",
+        "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL)
+
+
+def start_vercel_handler(port, env=None):
+    """Serves recommend.handler with a local ThreadingHTTPServer in a child process."""
+    cmd = [sys.executable, os.path.join(HERE, "loadtest.py"), "_serve-vercel", "--port", str(port)]
+    return subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL)
+
+
+def serve_vercel(port):
+    from http.server import ThreadingHTTPServer
+    from recommend import handler
+
+    class QuietHandler(handler):
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), QuietHandler).serve_forever()
+
+
+def parse_mix(spec, routes):
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in routes:
+            print(f"Warning: '{name}' is not available on this server, skipping it.", file=sys.stderr)
+            continue
+        mix.append((name, float(weight or 1)))
+    if not mix:
+        raise SystemExit("Error: the request mix is empty for this server.")
+    return mix
+
+
+def build_requests(routes, replay_count, seed, top_n):
+    """Returns make(kind) -> (method, path, body) for one request of that type."""
+    rng = random.Random(seed)
+    replays = [make_replay(seed + i) for i in range(replay_count)]
+
+    def make(kind):
+        method, path = routes[kind]
+        replay = rng.choice(replays)
+        player = rng.choice([p for team in replay["teams"].values() for p in team["players"]])
+        if method == "GET":
+            # GET endpoints use the built-in sample replay
+            return method, f"{path}?player_id=ce45140fcd644755b01660aa2dc6977b&top_n={top_n}", None
+        body = {"player_id": player["id"], "replay_data": replay, "top_n": top_n}
+        return method, path, json.dumps(body).encode("utf-8")
+
+    return make
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}    # kind -> [seconds]
+        self.statuses = {}     # kind -> {status: count}
+
+    def record(self, kind, status, seconds):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            counts = self.statuses.setdefault(kind, {})
+            counts[status] = counts.get(status, 0) + 1
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def drive(base_url, mix, make_request, concurrency, duration=None, total_requests=None, seed=0, timeout=30):
+    """Runs the load; returns the report dict."""
+    parts = urlsplit(base_url)
+    stats = _Stats()
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    remaining = [total_requests]
+    remaining_lock = threading.Lock()
+    stop_at = time.perf_counter() + duration if duration else None
+
+    def take_ticket():
+        if stop_at is not None and time.perf_counter() >= stop_at:
+            return False
+        if total_requests is None:
+            return True
+        with remaining_lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def client(worker_id):
+        rng = random.Random(seed + worker_id)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+        while take_ticket():
+            kind = rng.choices(names, weights)[0]
+            method, path, body = make_request(kind)
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                if response.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException) as e:
+                status = f"error:{type(e).__name__}"
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+            stats.record(kind, status, time.perf_counter() - started)
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {"elapsed_seconds": round(elapsed, 3), "concurrency": concurrency, "endpoints": {}}
+    all_latencies = []
+    all_errors = 0
+    for kind, latencies in sorted(stats.latencies.items()):
+        latencies.sort()
+        all_latencies.extend(latencies)
+        statuses = stats.statuses[kind]
+        errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400)
+        all_errors += errors
+        report["endpoints"][kind] = _summary(latencies, errors, elapsed, statuses)
+    all_latencies.sort()
+    report["total"] = _summary(all_latencies, all_errors, elapsed)
+    return report
+
+
+def _summary(latencies, errors, elapsed, statuses=None):
+    count = len(latencies)
+    summary = {
+        "requests": count,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else None,
+        "error_rate": round(errors / count, 4) if count else None,
+        "p50_ms": None, "p95_ms": None, "p99_ms": None,
+    }
+    for name, q in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        value = _percentile(latencies, q)
+        summary[name] = round(value * 1000, 3) if value is not None else None
+    if statuses is not None:
+        summary["statuses"] = {str(status): count for status, count in sorted(statuses.items(), key=str)}
+    return summary
+
+
+def print_report(report):
+    print(f"{'endpoint':16s} {'requests':>9s} {'rps':>9s} {'err%':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    rows = list(report["endpoints"].items()) + [("TOTAL", report["total"])]
+    for kind, s in rows:
+        print(f"{kind:16s} {s['requests']:9d} {s['throughput_rps'] or 0:9.1f} {100 * (s['error_rate'] or 0):6.2f}% "
+              f"{s['p50_ms'] or 0:9.2f} {s['p95_ms'] or 0:9.2f} {s['p99_ms'] or 0:9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP load tests for the recommendation service.")
+    sub = parser.add_subparsers(dest="target", required=True)
+
+    def add_load_args(p):
+        p.add_argument("--concurrency", type=int, default=8, help="Client threads.")
+        p.add_argument("--duration", type=float, default=None, help="Seconds to run (default: 10 unless --requests).")
+        p.add_argument("--requests", type=int, default=None, help="Total requests instead of a duration.")
+        p.add_argument("--mix", default=DEFAULT_MIX, help="Weighted request mix, e.g. recommend=6,recommend_test=3,webhook=1.")
+        p.add_argument("--replays", type=int, default=50, help="Distinct synthetic replays to send.")
+        p.add_argument("--top_n", type=int, default=3)
+        p.add_argument("--seed", type=int, default=42)
+        p.add_argument("--output", help="Write the report as JSON to this path.")
+
+    p_gun = sub.add_parser("gunicorn", help="Start app.py under gunicorn and load it.")
+    p_gun.add_argument("--workers", type=int, default=2)
+    p_gun.add_argument("--worker-class", default="sync", help="gunicorn worker class (sync, gthread, ...).")
+    p_gun.add_argument("--threads", type=int, default=1, help="Threads per worker (gthread).")
+    add_load_args(p_gun)
+
+    p_ver = sub.add_parser("vercel", help="Serve recommend.handler with http.server and load it.")
+    add_load_args(p_ver)
+
+    p_url = sub.add_parser("url", help="Load an already running Flask app.")
+    p_url.add_argument("base_url")
+    add_load_args(p_url)
+
+    p_srv = sub.add_parser("_serve-vercel")
+    p_srv.add_argument("--port", type=int, required=True)
+
+    args = parser.parse_args()
+    if args.target == "_serve-vercel":
+        serve_vercel(args.port)
+        return
+
+    duration = args.duration if args.duration or args.requests else 10
+    process = None
+    scratch = tempfile.TemporaryDirectory(prefix="loadtest-")
+    try:
+        if args.target == "url":
+            base_url, routes, ready_path = args.base_url.rstrip("/"), FLASK_ROUTES, "/health"
+        else:
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            if args.target == "gunicorn":
+                process = start_gunicorn(args.workers, args.worker_class, args.threads, port, _server_env(scratch.name))
+                routes, ready_path = FLASK_ROUTES, "/health"
+            else:
+                process = start_vercel_handler(port, _server_env(scratch.name))
+                routes, ready_path = VERCEL_ROUTES, "/"
+        _wait_until_ready(base_url, ready_path)
+
+        mix = parse_mix(args.mix, routes)
+        make_request = build_requests(routes, args.replays, args.seed, args.top_n)
+        report = drive(base_url, mix, make_request, args.concurrency, duration, args.requests, args.seed)
+        report["target"] = {
+            "kind": args.target,
+            "base_url": base_url,
+            "mix": dict(mix),
+            **({"workers": args.workers, "worker_class": args.worker_class, "threads": args.threads}
+               if args.target == "gunicorn" else {}),
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        scratch.cleanup()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Column-wise versions of metrics.py and threshold.py for scoring many
+player-games at once (re-scoring a replay archive, precomputing categories).
+
+    columns = player_game_columns(rows)        # rows: extract_* dicts
+    metrics = calculate_metric_columns(columns)
+    categories = categorize_metric_columns(metrics, columns["overtime"])
+
+Every column is a float64 numpy array with one entry per player-game, so
+fractional stats are kept as they are. Values and categories are identical
+to calling the scalar functions row by row, including intensity 0 for
+zero-duration games and teamwork 0.0 when the team scored no goals.
+Thresholds are read from threshold.py at call time.
+
+metric_rows() turns the columns back into per-player (intensity,
+performance, teamwork) values for recommendation_pipeline's batch path.
+"""
+import threshold
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; callers fall back to the scalar functions
+    np = None
+
+
+INPUT_COLUMNS = (
+    "total_distance", "duration", "supersonic_percent", "goals", "saves", "shooting_percentage",
+    "assists", "team_goals", "opponent_goals", "overtime",
+)
+
+# Category codes used by categorize_metric_columns, in code order.
+LEVEL_LABELS = ("Low", "Medium", "High")
+CLOSENESS_LABELS = ("Very Close / Overtime", "Moderately Close", "Not Close")
+WIN_STATUS_LABELS = ("loss", "draw", "win")
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("numpy is required for metric_columns; use metrics.py/threshold.py instead")
+
+
+def player_game_columns(rows):
+    """
+    Builds the input columns from extract_player_and_game_data() /
+    extract_all_players_data() dicts, with the same defaults as metrics.py.
+    """
+    _require_numpy()
+    rows = list(rows)
+    values = {name: [] for name in INPUT_COLUMNS}
+    for row in rows:
+        stats, team, opponents = row["player_stats"], row["player_team_stats"], row["opponent_team_stats"]
+        movement = stats.get("movement", {})
+        values["total_distance"].append(movement.get("total_distance", 0))
+        values["duration"].append(row["game_duration"])
+        values["supersonic_percent"].append(movement.get("time_supersonic_speed_percent", 0))
+        values["goals"].append(stats.get("goals", 0))
+        values["saves"].append(stats.get("saves", 0))
+        values["shooting_percentage"].append(stats.get("shooting_percentage", 0.0))
+        values["assists"].append(stats.get("assists", 0))
+        values["team_goals"].append(team.get("goals", 0))
+        values["opponent_goals"].append(opponents.get("goals", 0))
+        values["overtime"].append(bool(row.get("game_overtime")))
+    return {
+        "total_distance": np.asarray(values["total_distance"], dtype=np.float64),
+        "duration": np.asarray(values["duration"], dtype=np.float64),
+        "supersonic_percent": np.asarray(values["supersonic_percent"], dtype=np.float64),
+        "goals": np.asarray(values["goals"], dtype=np.float64),
+        "saves": np.asarray(values["saves"], dtype=np.float64),
+        "shooting_percentage": np.asarray(values["shooting_percentage"], dtype=np.float64),
+        "assists": np.asarray(values["assists"], dtype=np.float64),
+        "team_goals": np.asarray(values["team_goals"], dtype=np.float64),
+        "opponent_goals": np.asarray(values["opponent_goals"], dtype=np.float64),
+        "overtime": np.asarray(values["overtime"], dtype=bool),
+    }
+
+
+def calculate_metric_columns(columns):
+    """
+    Intensity, performance, teamwork and outcome columns for `columns`
+    (a dict with the INPUT_COLUMNS arrays; "overtime" is not used here).
+    """
+    _require_numpy()
+    distance = np.asarray(columns["total_distance"], dtype=np.float64)
+    duration = np.asarray(columns["duration"], dtype=np.float64)
+    supersonic = np.asarray(columns["supersonic_percent"], dtype=np.float64)
+    assists = np.asarray(columns["assists"], dtype=np.float64)
+    team_goals = np.asarray(columns["team_goals"], dtype=np.float64)
+    opponent_goals = np.asarray(columns["opponent_goals"], dtype=np.float64)
+
+    played = duration != 0
+    intensity = np.zeros(len(duration), dtype=np.float64)
+    np.divide(distance, duration, out=intensity, where=played)
+    intensity = np.where(played, intensity + supersonic * 2, 0.0)
+
+    # Same order as the scalar sum: (goals * 100) + (saves * 50), then the shooting percentage.
+    points = np.asarray(columns["goals"], dtype=np.float64) * 100 + np.asarray(columns["saves"], dtype=np.float64) * 50
+    performance = points + np.asarray(columns["shooting_percentage"], dtype=np.float64)
+
+    scored = team_goals != 0
+    teamwork = np.zeros(len(team_goals), dtype=np.float64)
+    np.divide(assists, team_goals, out=teamwork, where=scored)
+
+    score_differential = team_goals - opponent_goals
+    return {
+        "intensity": intensity,
+        "performance": performance,
+        "teamwork": teamwork,
+        "score_differential": score_differential,
+        "abs_score_differential": np.abs(score_differential),
+        "win_status": (np.sign(score_differential) + 1).astype(np.int8),  # index into WIN_STATUS_LABELS
+    }
+
+
+def _row_inputs(row):
+    stats = row["player_stats"]
+    movement = stats.get("movement", {})
+    return (
+        movement.get("total_distance", 0), row["game_duration"], movement.get("time_supersonic_speed_percent", 0),
+        stats.get("goals", 0), stats.get("saves", 0), stats.get("shooting_percentage", 0.0),
+        stats.get("assists", 0), row["player_team_stats"].get("goals", 0), row["opponent_team_stats"].get("goals", 0),
+    )
+
+
+def metric_rows(rows):
+    """
+    [(intensity, performance, teamwork)] for extract_* dicts, equal to the
+    metrics.py results including their Python types (an int performance for
+    integer stats, an int 0 intensity for zero-duration games). Rows whose
+    inputs are not plain numbers get None; metrics.py decides what those mean.
+    """
+    rows = list(rows)
+    inputs = [_row_inputs(row) for row in rows]
+    numeric = [all(isinstance(value, (int, float)) for value in values) for values in inputs]
+    metrics = calculate_metric_columns(player_game_columns(row for row, ok in zip(rows, numeric) if ok))
+    scores = iter(zip(metrics["intensity"].tolist(), metrics["performance"].tolist(), metrics["teamwork"].tolist()))
+
+    results = []
+    for values, ok in zip(inputs, numeric):
+        if not ok:
+            results.append(None)
+            continue
+        intensity, performance, teamwork = next(scores)
+        duration, goals, saves, shooting_percentage = values[1], values[3], values[4], values[5]
+        if duration == 0:
+            intensity = 0
+        if isinstance(goals, int) and isinstance(saves, int) and isinstance(shooting_percentage, int):
+            performance = int(performance)
+        results.append((intensity, performance, teamwork))
+    return results
+
+
+def _levels(values, low, high):
+    """LEVEL_LABELS codes: High if >= high, else Low if <= low, else Medium."""
+    values = np.asarray(values)
+    if low < high:
+        codes = np.digitize(values, (low, high)).astype(np.int8)  # [low, high) -> 1, >= high -> 2
+        codes[values == low] = 0
+        codes[np.isnan(values)] = 1  # NaN fails both comparisons in the scalar version
+        return codes
+    return np.where(values >= high, 2, np.where(values <= low, 0, 1)).astype(np.int8)
+
+
+def categorize_intensity_column(intensity, cutoffs=None):
+    return _levels(intensity, *(cutoffs or threshold.current_cutoffs())["intensity"])
+
+
+def categorize_performance_column(performance, cutoffs=None):
+    return _levels(performance, *(cutoffs or threshold.current_cutoffs())["performance"])
+
+
+def categorize_teamwork_column(teamwork, cutoffs=None):
+    return _levels(teamwork, *(cutoffs or threshold.current_cutoffs())["teamwork"])
+
+
+def categorize_closeness_column(abs_score_differential, overtime):
+    """CLOSENESS_LABELS codes, matching threshold.categorize_game_closeness."""
+    diff = np.asarray(abs_score_differential)
+    codes = np.where(diff <= threshold.SCORE_DIFFERENTIAL_CLOSE, 0,
+                     np.where(diff <= threshold.SCORE_DIFFERENTIAL_MODERATE, 1, 2)).astype(np.int8)
+    codes[np.asarray(overtime, dtype=bool)] = 0
+    return codes
+
+
+def categorize_metric_columns(metrics, overtime):
+    """Category codes for the output of calculate_metric_columns."""
+    cutoffs = threshold.current_cutoffs()
+    return {
+        "intensity": categorize_intensity_column(metrics["intensity"], cutoffs),
+        "performance": categorize_performance_column(metrics["performance"], cutoffs),
+        "teamwork": categorize_teamwork_column(metrics["teamwork"], cutoffs),
+        "closeness": categorize_closeness_column(metrics["abs_score_differential"], overtime),
+    }
+
+
+def labels(codes, names):
+    """Category codes -> list of label strings, e.g. labels(codes, LEVEL_LABELS)."""
+    return [names[code] for code in np.asarray(codes).tolist()]
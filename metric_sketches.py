@@ -0,0 +1,268 @@
+"""
+Streaming distributions of the intensity, performance and teamwork scores.
+
+Every profile app.py builds feeds its three scores into t-digest sketches:
+one set for all traffic and, with METRIC_SKETCH_BY_PLAYLIST, one per replay
+playlist ("Ranked Standard", "Ranked Duel 1v1", ...). A sketch keeps a few
+hundred weighted centroids however many values it has seen, so the live
+distribution can be inspected and the High/Low cutoffs in threshold.py
+recomputed as target percentiles without storing raw values.
+
+Each answered request counts once. Requests answered from the response cache
+(or by sharing an identical request's computation) record the scores stored
+with the cached response under their own replay's playlist, and background
+prefetches record nothing, so caching does not change what the sketches see.
+The built-in sample replay (warmup canary, /recommend/test, requests without
+replay data) is never recorded, so probes do not skew the distributions.
+
+Sketches live in each process; behind several gunicorn workers a request
+sees the distribution of the worker that answered it. Cutoffs applied with
+propose_thresholds() + threshold.save_thresholds() go through the thresholds
+file and so reach every worker.
+"""
+import math
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+import threshold
+
+ENABLE_METRIC_SKETCHES = os.environ.get("ENABLE_METRIC_SKETCHES", "true").strip().lower() not in ("0", "false", "no", "off")
+METRIC_SKETCH_COMPRESSION = int(os.environ.get("METRIC_SKETCH_COMPRESSION", 100))  # higher = more centroids, more accurate
+METRIC_SKETCH_BY_PLAYLIST = os.environ.get("METRIC_SKETCH_BY_PLAYLIST", "true").strip().lower() not in ("0", "false", "no", "off")
+METRIC_SKETCH_MAX_PLAYLISTS = int(os.environ.get("METRIC_SKETCH_MAX_PLAYLISTS", 32))  # the rest share "other"
+THRESHOLD_LOW_PERCENTILE = float(os.environ.get("THRESHOLD_LOW_PERCENTILE", 25))
+THRESHOLD_HIGH_PERCENTILE = float(os.environ.get("THRESHOLD_HIGH_PERCENTILE", 75))
+THRESHOLD_MIN_SAMPLES = int(os.environ.get("THRESHOLD_MIN_SAMPLES", 500))  # per metric before cutoffs are proposed
+
+SKETCHED_METRICS = ("intensity", "performance", "teamwork")
+REPORT_PERCENTILES = (1, 5, 10, 25, 50, 75, 90, 95, 99)
+ALL_PLAYLISTS = "all"
+OTHER_PLAYLIST = "other"
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning & Ertl) with the arcsine scale function: values
+    are buffered and merged into centroids that are small near the tails and
+    larger in the middle, so extreme percentiles stay accurate. Not thread-safe.
+    """
+
+    __slots__ = ("compression", "means", "weights", "count", "min", "max", "_buffer", "_buffer_limit")
+
+    def __init__(self, compression=METRIC_SKETCH_COMPRESSION):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+        self._buffer_limit = 5 * compression
+
+    def add(self, value):
+        value = float(value)
+        if value != value:  # NaN would poison the ordering
+            return
+        self._buffer.append(value)
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self._buffer_limit:
+            self._compress()
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k):
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + [(value, 1) for value in self._buffer])
+        self._buffer = []
+        total = self.count
+        means, weights = [], []
+        mean, weight = points[0]
+        done = 0
+        q_limit = self._q(self._k(0) + 1)
+        for next_mean, next_weight in points[1:]:
+            if (done + weight + next_weight) / total <= q_limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                done += weight
+                q_limit = self._q(min(self._k(done / total) + 1, self.compression / 4))
+                mean, weight = next_mean, next_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def _curve(self):
+        """(values, ranks): the piecewise-linear CDF through min, centroid centres and max."""
+        self._compress()
+        values, ranks = [self.min], [0.0]
+        done = 0
+        for mean, weight in zip(self.means, self.weights):
+            values.append(mean)
+            ranks.append(done + weight / 2)
+            done += weight
+        values.append(self.max)
+        ranks.append(float(done))
+        return values, ranks
+
+    def quantile(self, q):
+        """Estimated value at quantile q (0..1); None while empty."""
+        if not self.count:
+            return None
+        values, ranks = self._curve()
+        target = min(max(q, 0.0), 1.0) * self.count
+        i = min(max(bisect_left(ranks, target), 1), len(ranks) - 1)
+        low, high = ranks[i - 1], ranks[i]
+        if high <= low:
+            return values[i]
+        return values[i - 1] + (values[i] - values[i - 1]) * (target - low) / (high - low)
+
+    def cdf(self, value):
+        """Estimated fraction of values <= `value`; None while empty."""
+        if not self.count:
+            return None
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        values, ranks = self._curve()
+        i = bisect_right(values, value)
+        low, high = values[i - 1], values[i]
+        if high <= low:
+            return ranks[i - 1] / self.count
+        return (ranks[i - 1] + (ranks[i] - ranks[i - 1]) * (value - low) / (high - low)) / self.count
+
+    def summary(self, percentiles=REPORT_PERCENTILES):
+        return {
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "centroids": len(self.means) + len(self._buffer),
+            "percentiles": {str(p): self.quantile(p / 100) for p in percentiles},
+        }
+
+
+class MetricSketches:
+    """TDigests of each SKETCHED_METRICS score, overall and per playlist."""
+
+    def __init__(self, compression=METRIC_SKETCH_COMPRESSION, by_playlist=METRIC_SKETCH_BY_PLAYLIST,
+                 max_playlists=METRIC_SKETCH_MAX_PLAYLISTS):
+        self.compression = compression
+        self.by_playlist = by_playlist
+        self.max_playlists = max_playlists
+        self._lock = threading.Lock()
+        self._sketches = {}
+
+    def _group(self, playlist):
+        group = self._sketches.get(playlist)
+        if group is None:
+            group = self._sketches[playlist] = {metric: TDigest(self.compression) for metric in SKETCHED_METRICS}
+        return group
+
+    def record(self, playlist, intensity, performance, teamwork):
+        """Adds one player-game's scores."""
+        scores = (intensity, performance, teamwork)
+        with self._lock:
+            groups = [self._group(ALL_PLAYLISTS)]
+            if self.by_playlist:
+                name = playlist if isinstance(playlist, str) and playlist else OTHER_PLAYLIST
+                if name not in self._sketches and len(self._sketches) > self.max_playlists:
+                    name = OTHER_PLAYLIST
+                groups.append(self._group(name))
+            for group in groups:
+                for metric, score in zip(SKETCHED_METRICS, scores):
+                    group[metric].add(score)
+
+    def playlists(self):
+        with self._lock:
+            return sorted(name for name in self._sketches if name != ALL_PLAYLISTS)
+
+    def distributions(self):
+        """Per playlist and metric: count, min/max, percentiles and the share each current cutoff classifies."""
+        cutoffs = threshold.current_thresholds()
+        with self._lock:
+            report = {}
+            for playlist, group in self._sketches.items():
+                report[playlist] = {}
+                for metric, sketch in group.items():
+                    summary = sketch.summary()
+                    if sketch.count:
+                        # categorize_*: Low is <= low, High is >= high (the cdf cannot tell < from <=)
+                        summary["share_low"] = round(sketch.cdf(cutoffs[metric]["low"]), 4)
+                        summary["share_high"] = round(1 - sketch.cdf(cutoffs[metric]["high"]), 4)
+                    report[playlist][metric] = summary
+            return report
+
+    def propose_thresholds(self, low_percentile=THRESHOLD_LOW_PERCENTILE, high_percentile=THRESHOLD_HIGH_PERCENTILE,
+                           playlist=None, min_samples=THRESHOLD_MIN_SAMPLES):
+        """
+        Cutoffs that would put `low_percentile`% of the recorded games at or
+        below Low and the top (100 - `high_percentile`)% at High, in the form
+        threshold.set_thresholds()/save_thresholds() take. Raises ValueError
+        when the percentiles are out of order or a metric has too few samples.
+        """
+        if not 0 < low_percentile < high_percentile < 100:
+            raise ValueError("percentiles must satisfy 0 < low < high < 100")
+        playlist = playlist or ALL_PLAYLISTS
+        with self._lock:
+            group = self._sketches.get(playlist)
+            if group is None:
+                raise ValueError(f"no scores recorded for playlist '{playlist}'")
+            proposed = {}
+            for metric in SKETCHED_METRICS:
+                sketch = group[metric]
+                if sketch.count < min_samples:
+                    raise ValueError(f"only {sketch.count} {metric} scores recorded for '{playlist}' (need {min_samples})")
+                low, high = sketch.quantile(low_percentile / 100), sketch.quantile(high_percentile / 100)
+                if not low < high:
+                    raise ValueError(f"{metric} scores for '{playlist}' are too concentrated to split at "
+                                     f"p{low_percentile:g}/p{high_percentile:g} ({low} .. {high})")
+                proposed[metric] = {"low": low, "high": high}
+            return proposed
+
+    def reset(self):
+        with self._lock:
+            self._sketches = {}
+
+
+_sketches = MetricSketches()
+
+def get_metric_sketches():
+    """Returns the process-wide MetricSketches."""
+    return _sketches
+
+_capture = threading.local()
+
+@contextmanager
+def capture_metrics():
+    """
+    Within the block, record_metrics() calls in this thread append
+    (intensity, performance, teamwork) to the yielded list instead of feeding
+    the sketches; the caller records them (or not) itself.
+    """
+    previous = getattr(_capture, "samples", None)
+    _capture.samples = samples = []
+    try:
+        yield samples
+    finally:
+        _capture.samples = previous
+
+def record_metrics(playlist, intensity, performance, teamwork):
+    """Feeds one player-game into the process-wide sketches (no-op unless ENABLE_METRIC_SKETCHES)."""
+    samples = getattr(_capture, "samples", None)
+    if samples is not None:
+        samples.append((intensity, performance, teamwork))
+    elif ENABLE_METRIC_SKETCHES:
+        _sketches.record(playlist, intensity, performance, teamwork)
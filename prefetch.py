@@ -0,0 +1,184 @@
+"""
+Speculative recommendations for the rest of a replay's players.
+
+Once one player of a replay asks for songs, the other players almost always
+follow within seconds. The first request for a replay hands it to the
+Prefetcher, whose background thread runs the same computation for every
+other player in replay_data["teams"] (same top_n and engine) through
+app.prefetch_song_recommendations (the cached path without metric
+recording), so the results land in the response cache and the follow-ups
+are hits. A follow-up that arrives while its player is
+being computed joins that computation (single_flight.py).
+
+Background work must not slow down real requests:
+
+- the thread lowers its own scheduling priority (PREFETCH_NICE, Linux);
+- after each player it sleeps long enough that its CPU time stays at most
+  PREFETCH_CPU_SHARE of wall time;
+- a replay's remaining players are skipped while more than
+  PREFETCH_MAX_IN_FLIGHT requests are being handled on the host (all
+  gunicorn workers, see instrumentation.requests_in_flight_on_host), and
+  new replays are dropped once PREFETCH_QUEUE_MAX are waiting.
+
+The results only help follow-ups served by another worker when the response
+cache is shared between workers, so prefetching is on by default only with
+RESPONSE_CACHE_BACKEND=shared. ENABLE_PREFETCH=true forces it on (useful
+with a single worker).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from instrumentation import requests_in_flight_on_host
+from response_cache import RESPONSE_CACHE_BACKEND
+
+# Unset or empty: on only when workers share the response cache.
+ENABLE_PREFETCH = (os.environ.get("ENABLE_PREFETCH") or ("true" if RESPONSE_CACHE_BACKEND == "shared" else "false")).strip().lower() not in ("0", "false", "no", "off")
+PREFETCH_CPU_SHARE = float(os.environ.get("PREFETCH_CPU_SHARE", 0.25))  # of one core
+PREFETCH_MAX_IN_FLIGHT = int(os.environ.get("PREFETCH_MAX_IN_FLIGHT", 2))  # requests on the host (all workers)
+PREFETCH_QUEUE_MAX = int(os.environ.get("PREFETCH_QUEUE_MAX", 32))  # replays waiting
+PREFETCH_NICE = int(os.environ.get("PREFETCH_NICE", 10))
+PREFETCH_SEEN_MAX = 4096  # replays remembered so only the first request triggers a prefetch
+
+
+def replay_player_ids(replay_data):
+    """Player ids of every team in replay order."""
+    ids = []
+    for team in (replay_data.get("teams") or {}).values():
+        if isinstance(team, dict):
+            ids.extend(player.get("id") for player in team.get("players") or () if player.get("id"))
+    return ids
+
+
+class Prefetcher:
+    """
+    Queue of replays plus one low-priority daemon thread that runs
+    compute(replay_data, player_id, top_n, engine) for their other players.
+    """
+
+    def __init__(self, compute, cpu_share=None, max_in_flight=None, max_queued=None, nice=None, busy=None):
+        self.compute = compute
+        self.cpu_share = PREFETCH_CPU_SHARE if cpu_share is None else cpu_share
+        self.max_in_flight = PREFETCH_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.max_queued = PREFETCH_QUEUE_MAX if max_queued is None else max_queued
+        self.nice = PREFETCH_NICE if nice is None else nice
+        self.busy = busy or requests_in_flight_on_host
+        self._wakeup = threading.Condition()
+        self._queue = deque()  # (replay_data, player_ids, top_n, engine)
+        self._seen = OrderedDict()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.replays = 0
+        self.computed = 0
+        self.skipped_busy = 0
+        self.dropped = 0
+        self.errors = 0
+        self.cpu_seconds = 0.0
+        self.throttled_seconds = 0.0
+
+    def submit(self, replay_key, replay_data, player_id, top_n, engine=None):
+        """
+        Queues the other players of `replay_data` unless `replay_key` (any
+        hashable id of the replay and request options) was seen before.
+        Returns True when something was queued.
+        """
+        if not ENABLE_PREFETCH or self.cpu_share <= 0:
+            return False
+        others = [other for other in replay_player_ids(replay_data) if other != player_id]
+        with self._wakeup:
+            if replay_key in self._seen:
+                self._seen.move_to_end(replay_key)
+                return False
+            self._seen[replay_key] = True
+            if len(self._seen) > PREFETCH_SEEN_MAX:
+                self._seen.popitem(last=False)
+            if not others:
+                return False
+            if len(self._queue) >= self.max_queued:
+                self.dropped += 1
+                return False
+            self._queue.append((replay_data, others, top_n, engine))
+            self.replays += 1
+            self._wakeup.notify()
+        self.start()
+        return True
+
+    def start(self):
+        """Starts the background thread for this process (idempotent, fork-aware)."""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._wakeup:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Asks the thread to exit after its current player and forgets queued replays."""
+        with self._wakeup:
+            self._stopping = True
+            self._queue.clear()
+            self._wakeup.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _lower_priority(self):
+        try:
+            # On Linux the "process" priority of a thread id applies to that thread only.
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError) as e:
+            print(f"Warning: could not lower the prefetch thread's priority: {e}")
+
+    def _run(self):
+        if self.nice:
+            self._lower_priority()
+        while True:
+            with self._wakeup:
+                while not self._queue and not self._stopping:
+                    self._wakeup.wait()
+                if self._stopping:
+                    return
+                replay_data, player_ids, top_n, engine = self._queue.popleft()
+            for index, player_id in enumerate(player_ids):
+                if self._stopping:
+                    return
+                if self.busy() > self.max_in_flight:
+                    with self._wakeup:
+                        self.skipped_busy += len(player_ids) - index
+                    break
+                started_cpu = time.thread_time()
+                try:
+                    self.compute(replay_data, player_id, top_n, engine)
+                except Exception as e:
+                    print(f"Error: prefetch for player {player_id} failed: {e}")
+                    with self._wakeup:
+                        self.errors += 1
+                    continue
+                cpu = time.thread_time() - started_cpu
+                pause = cpu * (1 - self.cpu_share) / self.cpu_share
+                with self._wakeup:
+                    self.computed += 1
+                    self.cpu_seconds += cpu
+                    self.throttled_seconds += pause
+                time.sleep(pause)
+
+    def stats(self):
+        with self._wakeup:
+            return {
+                "enabled": ENABLE_PREFETCH,
+                "cpu_share": self.cpu_share,
+                "max_in_flight": self.max_in_flight,
+                "queued_replays": len(self._queue),
+                "replays": self.replays,
+                "computed": self.computed,
+                "skipped_busy": self.skipped_busy,
+                "dropped_replays": self.dropped,
+                "errors": self.errors,
+                "cpu_seconds": round(self.cpu_seconds, 6),
+                "throttled_seconds": round(self.throttled_seconds, 6),
+            }
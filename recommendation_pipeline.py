@@ -0,0 +1,273 @@
+"""
+The recommendation pipeline shared by the Flask app (app.py) and the Vercel
+handler / CLI (recommend.py): replay -> metrics -> categories -> desired song
+profile (rule engine) -> ranked songs.
+
+numpy-backed modules (song_index.py, song_embeddings.py) are imported only
+when a request needs them, so the Vercel handler's cold path stays light
+when the precomputed recommendation table can answer.
+"""
+import logging
+import os
+
+from extract_data import extract_all_players_data, extract_player_and_game_data
+from file_signatures import signature_scope
+from instrumentation import StageClock, record_cache
+from metric_sketches import record_metrics
+from metrics import calculate_game_intensity, calculate_game_outcome, calculate_performance_score, calculate_teamwork_factor
+from recommendation_table import get_recommendation_table
+from rule_engine import determine_desired_song_attributes
+from song_management import get_catalog_artifact, get_song_catalog
+from song_matcher import find_matching_songs
+from threshold import (
+    categorize_game_closeness,
+    categorize_intensity,
+    categorize_performance,
+    categorize_teamwork,
+    current_cutoffs,
+    refresh_thresholds,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _default_match_engine():
+    """song_embeddings.MATCH_ENGINE, without importing numpy when it is the additive engine."""
+    if os.environ.get("MATCH_ENGINE", "additive") == "additive":
+        return "additive"
+    from song_embeddings import MATCH_ENGINE
+    return MATCH_ENGINE
+
+def get_song_recommendation_profile(replay_data, target_player_id):
+    """
+    Main function to process a replay for a player and get desired song attributes.
+    """
+    try:
+        # 1. Extract data
+        clock = StageClock()
+        extracted_info = extract_player_and_game_data(replay_data, target_player_id)
+        clock.mark("extract")
+        if not extracted_info:
+            return None
+
+        return build_song_recommendation_profile(extracted_info, clock=clock)
+    except Exception as e:
+        logger.error(f"could not read player {target_player_id} from the replay: {e}")
+        return None
+
+def build_song_recommendation_profile(extracted_info, scores=None, clock=None):
+    """
+    Computes metrics, categories and the desired song profile for one player's
+    extracted data (see extract_data.py). `scores` is an already computed
+    (intensity, performance, teamwork) triple, e.g. from metric_columns.metric_rows.
+    The stages are timed on `clock` (a new StageClock by default).
+    """
+    try:
+        clock = clock or StageClock()
+        player_stats = extracted_info["player_stats"]
+        player_team_stats = extracted_info["player_team_stats"]
+        opponent_team_stats = extracted_info["opponent_team_stats"]
+        game_duration = extracted_info["game_duration"]
+        game_overtime = extracted_info["game_overtime"]
+
+        # 2. Calculate Metrics
+        if scores is None:
+            intensity_score = calculate_game_intensity(player_stats, game_duration)
+            performance_score = calculate_performance_score(player_stats)
+            teamwork_factor = calculate_teamwork_factor(player_stats, player_team_stats)
+        else:
+            intensity_score, performance_score, teamwork_factor = scores
+        game_outcome_details = calculate_game_outcome(player_team_stats, opponent_team_stats)
+        record_metrics(extracted_info.get("game_playlist"), intensity_score, performance_score, teamwork_factor)
+        clock.mark("metrics")
+
+        # 3. Categorize Metrics (with tuned cutoffs, if threshold.py's file changed)
+        refresh_thresholds()
+        cutoffs = current_cutoffs()  # one snapshot for all three metrics
+        intensity_cat = categorize_intensity(intensity_score, cutoffs)
+        performance_cat = categorize_performance(performance_score, cutoffs)
+        teamwork_cat = categorize_teamwork(teamwork_factor, cutoffs)
+        closeness_cat = categorize_game_closeness(game_outcome_details['abs_score_differential'], game_overtime)
+        clock.mark("categorize")
+
+        # 4. Determine Desired Song Attributes using Rule Engine
+        desired_attributes = determine_desired_song_attributes(
+            intensity_cat,
+            performance_cat,
+            teamwork_cat,
+            game_outcome_details,
+            closeness_cat
+        )
+        clock.mark("rules")
+
+        return {
+            "player_name": player_stats.get("name"),
+            "metrics": {
+                "intensity_score": round(intensity_score, 2),
+                "performance_score": round(performance_score, 2),
+                "teamwork_factor": round(teamwork_factor, 2),
+                "game_outcome": game_outcome_details,
+            },
+            "categories": {
+                "intensity": intensity_cat,
+                "performance": performance_cat,
+                "teamwork": teamwork_cat,
+                "closeness": closeness_cat,
+            },
+            "desired_song_profile": desired_attributes
+        }
+    except Exception as e:
+        logger.error(f"could not build a recommendation profile: {e}")
+        return None
+
+def match_songs_for_profile(profile_info, song_db, recommendation_table, top_n, engine=None):
+    """
+    Returns the recommended songs for a profile: from the precomputed table when
+    it can answer, otherwise by live matching against the song index. The
+    embedding engines (see song_embeddings.py) rank by vector distance instead.
+    """
+    engine = engine or _default_match_engine()
+    if engine != "additive":
+        from song_embeddings import build_song_embeddings
+
+        embeddings = get_catalog_artifact("song_embeddings", build_song_embeddings)
+        return embeddings.recommend(profile_info["desired_song_profile"], top_n, engine)
+
+    recommended_songs = None
+    if recommendation_table is not None:
+        recommended_songs = recommendation_table.recommend(
+            profile_info["categories"], profile_info["metrics"]["game_outcome"]["win_status"], top_n
+        )
+        record_cache("recommendation_table", recommended_songs is not None)
+    if recommended_songs is None:
+        from song_index import build_song_index  # numpy (unless SONG_INDEX=postings); only needed when the table can't answer
+
+        desired_attributes_for_matching = profile_info["desired_song_profile"]
+        song_index = get_catalog_artifact("song_index", build_song_index)
+        recommended_songs = find_matching_songs(song_db, desired_attributes_for_matching, top_n=top_n, song_index=song_index)
+    return recommended_songs or []
+
+@signature_scope()
+def get_song_recommendations(replay_data, target_player_id, top_n=3, engine=None):
+    """
+    Get song recommendations for a player based on replay data.
+    Returns both the profile and recommendations. `engine` is one of
+    song_embeddings.MATCH_ENGINES (default: MATCH_ENGINE).
+    """
+    try:
+        # Get the profile
+        profile_info = get_song_recommendation_profile(replay_data, target_player_id)
+
+        if not profile_info:
+            return {
+                "success": False,
+                "error": f"Could not generate recommendation profile for player {target_player_id}."
+            }
+
+        # Song database (cached for the process lifetime, reloaded when the file changes)
+        clock = StageClock()
+        song_db = get_song_catalog()
+        recommendation_table = get_recommendation_table()
+        clock.mark("catalog")
+        if not song_db:
+            return {
+                "success": False,
+                "error": "Failed to load song database."
+            }
+
+        # Find matching songs
+        recommended_songs = match_songs_for_profile(profile_info, song_db, recommendation_table, top_n, engine)
+        clock.mark("match")
+
+        return {
+            "success": True,
+            "profile": profile_info,
+            "recommendations": recommended_songs,
+            "player_id": target_player_id
+        }
+
+    except Exception as e:
+        logger.error(f"recommendations for player {target_player_id} failed: {e}")
+        return {
+            "success": False,
+            "error": f"Error processing recommendation: {str(e)}"
+        }
+
+def _batch_metric_scores(players, player_ids):
+    """
+    {player_id: (intensity, performance, teamwork)} for the batch path, scored
+    column-wise by metric_columns. Empty without numpy; missing players and
+    rows metric_columns can't score fall back to metrics.py.
+    """
+    import metric_columns
+
+    if metric_columns.np is None:
+        return {}
+    scored_ids = [player_id for player_id in player_ids if players.get(player_id)]
+    rows = metric_columns.metric_rows(players[player_id] for player_id in scored_ids)
+    return {player_id: scores for player_id, scores in zip(scored_ids, rows) if scores is not None}
+
+@signature_scope()
+def get_batch_song_recommendations(replay_data, player_ids=None, top_n=3, engine=None):
+    """
+    Get song recommendations for several players of one replay (default: everyone).
+    The replay is indexed once, the players' metrics are computed together
+    (metric_columns.py) and all players share one catalog lookup.
+    """
+    try:
+        clock = StageClock()
+        players = extract_all_players_data(replay_data)
+        clock.mark("extract")
+        if players is None:
+            return {
+                "success": False,
+                "error": "Could not read replay data (missing game duration)."
+            }
+        if player_ids is None:
+            player_ids = list(players)
+
+        song_db = get_song_catalog()
+        if not song_db:
+            return {
+                "success": False,
+                "error": "Failed to load song database."
+            }
+        recommendation_table = get_recommendation_table()
+        clock.mark("catalog")
+
+        clock = StageClock()
+        metric_scores = _batch_metric_scores(players, player_ids)
+        clock.mark("metrics")
+
+        results = []
+        for player_id in player_ids:
+            clock = StageClock()
+            extracted_info = players.get(player_id)
+            profile_info = (build_song_recommendation_profile(extracted_info, metric_scores.get(player_id), clock)
+                            if extracted_info else None)
+            if not profile_info:
+                results.append({
+                    "success": False,
+                    "error": f"Could not generate recommendation profile for player {player_id}.",
+                    "player_id": player_id
+                })
+                continue
+            results.append({
+                "success": True,
+                "profile": profile_info,
+                "recommendations": match_songs_for_profile(profile_info, song_db, recommendation_table, top_n, engine),
+                "player_id": player_id
+            })
+            clock.mark("match")
+
+        return {
+            "success": True,
+            "players": results
+        }
+
+    except Exception as e:
+        logger.error(f"batch recommendations failed: {e}")
+        return {
+            "success": False,
+            "error": f"Error processing recommendation: {str(e)}"
+        }
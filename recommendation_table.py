@@ -0,0 +1,119 @@
+"""
+Precomputed recommendations for every discrete input the rule engine can see.
+
+threshold.py only produces High/Medium/Low for intensity, performance and
+teamwork plus three closeness buckets, and calculate_game_outcome() only
+produces win/loss/draw, so there are 3*3*3*3*3 = 243 possible inputs to
+determine_desired_song_attributes() (the domains declared in rules.json).
+The table below runs the matcher once for each of them when the catalog or the
+rules are loaded; a request is then a dict lookup plus a slice to top_n.
+"""
+import os
+import time
+
+from rule_engine import get_rules
+from song_management import get_catalog_artifact
+from song_matcher import calculate_match_score, match_result
+
+# How many ranked songs are stored per profile. Larger top_n values fall back
+# to live matching.
+RECOMMENDATION_TABLE_DEPTH = int(os.environ.get("RECOMMENDATION_TABLE_DEPTH", 50))
+
+
+def table_key(categories, win_status):
+    """(intensity, performance, teamwork, win_status, closeness) for a profile's categories."""
+    return (
+        categories.get("intensity"),
+        categories.get("performance"),
+        categories.get("teamwork"),
+        win_status,
+        categories.get("closeness"),
+    )
+
+
+def _profile_signature(profile):
+    return (profile.get("bpm"), profile.get("energy"), tuple(profile.get("moods") or ()), tuple(profile.get("themes") or ()))
+
+
+class RecommendationTable:
+    """
+    Ranked (song, score, matched_criteria) lists for every category combination.
+    Combinations that yield the same desired profile share one ranked list.
+    """
+
+    def __init__(self, songs, rules, depth=None, index=None):
+        started = time.perf_counter()
+        self.songs = songs
+        self.depth = RECOMMENDATION_TABLE_DEPTH if depth is None else depth
+        self._entries = {}
+        by_profile = {}
+
+        if index is None:
+            # Imported here so loading a pickled table does not pull in numpy.
+            from song_index import build_song_index
+            index = build_song_index(songs)
+        keys = list(rules.keys())
+        for key, profile in zip(keys, rules.lookup_many(keys)):
+            signature = _profile_signature(profile)
+            ranked = by_profile.get(signature)
+            if ranked is None:
+                ranked = by_profile[signature] = [
+                    (row, score, calculate_match_score(songs[row], profile)[1])
+                    for row, score in index.top_matches(profile, self.depth)
+                ]
+            self._entries[key] = ranked
+
+        self.distinct_profiles = len(by_profile)
+        self.build_seconds = time.perf_counter() - started
+
+    def __len__(self):
+        return len(self._entries)
+
+    def recommend(self, categories, win_status, top_n):
+        """
+        Returns the top_n songs for the given categories, or None if the table
+        cannot answer (unknown category or top_n deeper than the table).
+        """
+        ranked = self._entries.get(table_key(categories, win_status))
+        if ranked is None or not isinstance(top_n, int) or top_n < 0 or top_n > self.depth:
+            return None
+
+        return [match_result(self.songs[row], score, criteria) for row, score, criteria in ranked[:top_n]]
+
+    def info(self):
+        """Returns a JSON-serializable summary of the table."""
+        return {
+            "entries": len(self._entries),
+            "distinct_profiles": self.distinct_profiles,
+            "depth": self.depth,
+            "stored_songs": sum(len(ranked) for ranked in {id(r): r for r in self._entries.values()}.values()),
+            "build_ms": round(self.build_seconds * 1000, 3),
+        }
+
+
+def build_recommendation_table(songs, rules, index=None):
+    """Builds the table for `songs` (ranked with `index` if given), or None for an empty catalog or missing rules."""
+    if not songs or rules is None:
+        return None
+    return RecommendationTable(songs, rules, index=index)
+
+
+def _catalog_song_index(songs):
+    """The catalog's "song_index" artifact (shared with live matching) if it indexes `songs`, else None."""
+    from song_index import build_song_index
+
+    index = get_catalog_artifact("song_index", build_song_index)
+    return index if index is not None and index.songs is songs else None
+
+
+def get_recommendation_table():
+    """
+    Returns the table for the current catalog and rules; it is rebuilt
+    automatically after either of them is reloaded.
+    """
+    rules = get_rules()
+    return get_catalog_artifact(
+        "recommendation_table",
+        lambda songs: build_recommendation_table(songs, rules, _catalog_song_index(songs)),
+        key=rules.fingerprint if rules is not None else None,
+    )
@@ -0,0 +1,254 @@
+"""
+Local store of uploaded replays, so clients send a replay once
+(PUT /replays/<id>) and then ask for recommendations by `replay_id`
+instead of re-uploading the whole JSON with every request.
+
+Replays are rows in a SQLite file (REPLAY_DB_PATH) holding zlib-compressed
+compact JSON, typically a quarter of the upload. Each process keeps an LRU
+of parsed replays in front of it; a hit costs one primary-key lookup of the
+row's revision (bumped when a replay is uploaded again under the same id,
+possibly through another worker) instead of a read, inflate and parse.
+Parsed replays are shared between requests: treat them as read-only.
+
+Uploads expire REPLAY_TTL seconds after they were stored, and only the
+newest REPLAY_MAX_ROWS are kept; both are enforced by a prune that runs
+after an upload at most once per REPLAY_PRUNE_INTERVAL per process.
+
+    python replay_store.py put <replay_id> replay.json
+    python replay_store.py prune
+    python replay_store.py stats
+"""
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+REPLAY_DB_PATH = os.environ.get("REPLAY_DB_PATH", "replays.sqlite3")
+REPLAY_CACHE_SIZE = int(os.environ.get("REPLAY_CACHE_SIZE", 256))  # parsed replays kept per process
+REPLAY_MAX_BYTES = int(os.environ.get("REPLAY_MAX_BYTES", 1024 * 1024))  # largest accepted upload
+REPLAY_TTL = float(os.environ.get("REPLAY_TTL", 7 * 86400))  # seconds an upload is kept; 0 keeps it forever
+REPLAY_MAX_ROWS = int(os.environ.get("REPLAY_MAX_ROWS", 10000))  # newest uploads kept; 0 for no limit
+REPLAY_PRUNE_INTERVAL = 60  # seconds between prunes after uploads (per process)
+REPLAY_COMPRESSION_LEVEL = 6
+
+REPLAY_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replays (
+    id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    raw_bytes INTEGER NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replays_stored_at ON replays (stored_at);
+"""
+
+
+def check_replay(replay_id, replay_data):
+    """Raises ValueError unless `replay_id` is a valid id and `replay_data` looks like a replay."""
+    if not isinstance(replay_id, str) or not REPLAY_ID_PATTERN.match(replay_id):
+        raise ValueError("replay_id must be 1-128 characters of A-Z, a-z, 0-9, '_', '.' or '-'")
+    if not isinstance(replay_data, dict) or not isinstance(replay_data.get("teams"), dict):
+        raise ValueError("replay must be a JSON object with a 'teams' object")
+
+
+class ReplayStore:
+    """SQLite-backed replays by id with a per-process LRU of parsed replays."""
+
+    def __init__(self, path=None, cache_size=None, ttl=None, max_rows=None):
+        self.path = path or REPLAY_DB_PATH
+        self.cache_size = REPLAY_CACHE_SIZE if cache_size is None else cache_size
+        self.ttl = REPLAY_TTL if ttl is None else ttl
+        self.max_rows = REPLAY_MAX_ROWS if max_rows is None else max_rows
+        self._pruned_at = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # replay_id -> (revision, replay_data)
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.stores = 0
+        self.pruned = 0
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _reader(self):
+        """This thread's connection for lookups (reopened after a fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    def put(self, replay_id, replay_data):
+        """
+        Stores `replay_data` under `replay_id` (replacing any previous upload).
+        Returns {"replay_id", "revision", "created", "raw_bytes", "stored_bytes"}.
+        """
+        check_replay(replay_id, replay_data)
+        raw = json.dumps(replay_data, separators=(",", ":")).encode("utf-8")
+        body = zlib.compress(raw, REPLAY_COMPRESSION_LEVEL)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT revision FROM replays WHERE id = ?", (replay_id,)).fetchone()
+            revision = row[0] + 1 if row else 1
+            conn.execute(
+                "INSERT OR REPLACE INTO replays (id, revision, body, raw_bytes, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (replay_id, revision, body, len(raw), time.time()),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        with self._lock:
+            self.stores += 1
+            self._remember(replay_id, revision, replay_data)
+            prune = time.time() - self._pruned_at >= REPLAY_PRUNE_INTERVAL
+            if prune:
+                self._pruned_at = time.time()
+        if prune:
+            try:
+                self.prune()
+            except sqlite3.Error as e:
+                print(f"Warning: could not prune the replay store: {e}")
+        return {
+            "replay_id": replay_id,
+            "revision": revision,
+            "created": revision == 1,
+            "raw_bytes": len(raw),
+            "stored_bytes": len(body),
+        }
+
+    def get(self, replay_id):
+        """The parsed replay stored under `replay_id`, or None."""
+        conn = self._reader()
+        row = conn.execute("SELECT revision FROM replays WHERE id = ?", (replay_id,)).fetchone()
+        if row is None:
+            with self._lock:
+                self._cache.pop(replay_id, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            cached = self._cache.get(replay_id)
+            if cached is not None and cached[0] == row[0]:
+                self._cache.move_to_end(replay_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        row = conn.execute("SELECT revision, body FROM replays WHERE id = ?", (replay_id,)).fetchone()
+        if row is None:
+            return None
+        replay_data = json.loads(zlib.decompress(row[1]))
+        with self._lock:
+            self.loads += 1
+            self._remember(replay_id, row[0], replay_data)
+        return replay_data
+
+    def prune(self):
+        """Deletes uploads older than the TTL and all but the newest max_rows. Returns the number deleted."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = 0
+            if self.ttl > 0:
+                deleted += conn.execute("DELETE FROM replays WHERE stored_at < ?", (time.time() - self.ttl,)).rowcount
+            if self.max_rows > 0:
+                deleted += conn.execute(
+                    "DELETE FROM replays WHERE id IN (SELECT id FROM replays ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        with self._lock:
+            self.pruned += deleted
+        return deleted
+
+    def _remember(self, replay_id, revision, replay_data):
+        if self.cache_size <= 0:
+            return
+        self._cache[replay_id] = (revision, replay_data)
+        self._cache.move_to_end(replay_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self):
+        conn = self._reader()
+        count, raw_bytes, stored_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(LENGTH(body)), 0) FROM replays"
+        ).fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "replays": count,
+                "raw_bytes": raw_bytes,
+                "stored_bytes": stored_bytes,
+                "ttl_seconds": self.ttl,
+                "max_rows": self.max_rows,
+                "pruned": self.pruned,
+                "cached": len(self._cache),
+                "cache_size": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "loads": self.loads,
+                "stores": self.stores,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_replay_store():
+    """Returns the process-wide ReplayStore (opened on first use)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReplayStore()
+    return _store
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the local replay store (REPLAY_DB_PATH).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    put = commands.add_parser("put", help="Store a replay JSON file under an id.")
+    put.add_argument("replay_id")
+    put.add_argument("file", help="Replay JSON file, or '-' for stdin.")
+    commands.add_parser("prune", help="Delete expired uploads and those beyond REPLAY_MAX_ROWS.")
+    commands.add_parser("stats", help="Print the store's size.")
+    args = parser.parse_args(argv)
+
+    store = get_replay_store()
+    if args.command == "put":
+        with (sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8")) as f:
+            replay_data = json.load(f)
+        try:
+            print(json.dumps(store.put(args.replay_id, replay_data)))
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.command == "prune":
+        print(json.dumps({"deleted": store.prune()}))
+    else:
+        print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
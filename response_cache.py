@@ -0,0 +1,449 @@
+"""
+In-process LRU + TTL cache of finished recommendation responses.
+
+Clients retry and re-render, so the same (replay, player, top_n) arrives
+many times. The key is a hash of only the replay fields the pipeline reads
+(see recommendation_cache_key), so cosmetic differences such as the replay's
+title, date or map do not miss. Entries are stored pickled: the size counted
+against the memory budget is exact, and every hit hands out a fresh object
+that callers may modify.
+
+Every entry also belongs to a generation (the catalog and rules file
+signatures and the cutoffs in use). The first lookup with a new generation
+drops everything, so a catalog reload never serves stale songs.
+
+With RESPONSE_CACHE_BACKEND=shared the entries live in one named
+multiprocessing.shared_memory segment that every worker on the host maps
+(SharedResponseCache), so hits are not split across gunicorn workers and no
+response is stored once per worker. The segment outlives worker restarts;
+gunicorn.conf.py removes it when the master exits.
+"""
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the shared backend needs it
+    fcntl = None
+
+ENABLE_RESPONSE_CACHE = os.environ.get("ENABLE_RESPONSE_CACHE", "true").strip().lower() not in ("0", "false", "no", "off")
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 600))  # seconds
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory").strip().lower()  # memory | shared
+RESPONSE_CACHE_SHM_NAME = os.environ.get("RESPONSE_CACHE_SHM_NAME", "song_rec_response_cache")
+RESPONSE_CACHE_SLOT_BYTES = int(os.environ.get("RESPONSE_CACHE_SLOT_BYTES", 4096))  # larger responses are not shared
+
+
+def recommendation_cache_key(replay_data, player_id, top_n, engine=None):
+    """
+    Stable hash of what get_song_recommendations() reads from the replay
+    (duration, overtime, each team's goals and its players' stats, in replay
+    order) plus the player id, top_n and engine.
+    """
+    parts = [replay_data.get("duration"), replay_data.get("overtime", False), player_id, top_n, engine]
+    for color, team in (replay_data.get("teams") or {}).items():
+        if not isinstance(team, dict):
+            continue
+        parts.append((color, team.get("goals")))
+        for player in team.get("players") or ():
+            movement = player.get("movement") or {}
+            parts.append((
+                player.get("id"), player.get("name"), player.get("goals"), player.get("saves"),
+                player.get("assists"), player.get("shooting_percentage"),
+                movement.get("total_distance"), movement.get("time_supersonic_speed_percent"),
+            ))
+    # repr() of JSON values (str/int/float/bool/None and containers) is stable across processes.
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU of pickled responses with a TTL and a byte budget."""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, body)
+        self._generation = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes = 0
+            self._generation = generation
+
+    def get(self, key, generation=None):
+        """The cached response for `key` (a new dict each time), or None."""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            body = entry[1]
+        return pickle.loads(body)
+
+    def put(self, key, response, generation=None):
+        """Stores `response` unless it alone exceeds the budget."""
+        body = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(body) > self.max_bytes:
+            return False
+        with self._lock:
+            self._check_generation(generation)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body)
+            self.bytes += len(body)
+            self.stores += 1
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def _remove(self, key):
+        _, body = self._entries.pop(key)
+        self.bytes -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "enabled": ENABLE_RESPONSE_CACHE,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class SharedResponseCache:
+    """
+    ResponseCache over a shared memory segment, for every process on the host.
+
+    The segment is a 64-byte header followed by fixed-size slots grouped into
+    buckets of SHARED_CACHE_WAYS (a set-associative hash table): a key can only
+    live in the bucket its hash picks, and a full bucket evicts its least
+    recently used slot. Each slot holds a header (SLOT_HEADER) and one pickled
+    response; responses larger than a slot are not cached.
+
+    Readers take no lock. Every slot starts with a sequence number that a
+    writer makes odd before touching the slot and even again when done
+    (a seqlock): a reader copies the entry, re-reads the number and retries if
+    it changed. Writers serialize per lock stripe, with a threading.Lock for
+    the threads of this process and an fcntl byte-range lock on
+    `<tempdir>/<name>.lock` for the other processes. A writer that died
+    mid-write leaves an odd number behind, and the slot is reused by the next
+    write to its bucket.
+
+    Entries carry a 64-bit hash of their generation; entries of an older
+    generation are misses and get overwritten first. Hit/miss counters are
+    per process; entries/bytes count every unexpired slot of the segment.
+    """
+
+    MAGIC = b"SRCACHE1"
+    HEADER = struct.Struct("<8sIII")  # magic, slot_bytes, slot_count, ways
+    HEADER_BYTES = 64
+    # seq, body length, key, generation hash, stored_at, expires_at, last_used
+    SLOT_HEADER = struct.Struct("<II16sQddd")
+    SEQ = struct.Struct("<I")
+    LAST_USED = struct.Struct("<d")
+    LAST_USED_OFFSET = 48
+    WAYS = 8
+    LOCK_STRIPES = 64
+    READ_RETRIES = 3
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL,
+                 name=RESPONSE_CACHE_SHM_NAME, slot_bytes=RESPONSE_CACHE_SLOT_BYTES):
+        if fcntl is None:
+            raise RuntimeError("the shared response cache needs fcntl (POSIX)")
+        if slot_bytes <= self.SLOT_HEADER.size:
+            raise ValueError(f"RESPONSE_CACHE_SLOT_BYTES must exceed {self.SLOT_HEADER.size}")
+        self.name = name
+        self.ttl = ttl
+        self.slot_bytes = slot_bytes
+        self.capacity = slot_bytes - self.SLOT_HEADER.size
+        self.buckets = max(1, (max_bytes - self.HEADER_BYTES) // (slot_bytes * self.WAYS))
+        self.slot_count = self.buckets * self.WAYS
+        self.max_bytes = self.HEADER_BYTES + self.slot_count * slot_bytes
+        self._thread_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a+b")
+        self._stats_lock = threading.Lock()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._shm = self._attach()
+        self._buf = self._shm.buf
+
+    def _attach(self):
+        """Maps the segment, creating it (or replacing one with another layout) under the init lock."""
+        header = self.HEADER.pack(self.MAGIC, self.slot_bytes, self.slot_count, self.WAYS)
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX, 1, 0)
+        try:
+            try:
+                shm = shared_memory.SharedMemory(name=self.name)
+                if bytes(shm.buf[:self.HEADER.size]) != header or shm.size < self.max_bytes:
+                    print(f"Warning: shared response cache '{self.name}' has another layout; recreating it")
+                    shm.close()
+                    shm.unlink()
+                    raise FileNotFoundError
+            except FileNotFoundError:
+                shm = shared_memory.SharedMemory(name=self.name, create=True, size=self.max_bytes)
+                shm.buf[:self.HEADER.size] = header
+        finally:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, 0)
+        # The resource tracker would unlink the segment when this process exits;
+        # it must outlive workers (gunicorn.conf.py's on_exit removes it).
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    @staticmethod
+    def _key_bytes(key):
+        try:
+            raw = bytes.fromhex(key)
+        except (TypeError, ValueError):
+            raw = b""
+        if len(raw) != 16:
+            raw = hashlib.blake2b(str(key).encode("utf-8"), digest_size=16).digest()
+        return raw
+
+    @staticmethod
+    def _generation_hash(generation):
+        return int.from_bytes(hashlib.blake2b(repr(generation).encode("utf-8"), digest_size=8).digest(), "little")
+
+    def _bucket(self, raw_key):
+        return int.from_bytes(raw_key[:8], "little") % self.buckets
+
+    def _slot_offsets(self, bucket):
+        first = self.HEADER_BYTES + bucket * self.WAYS * self.slot_bytes
+        return range(first, first + self.WAYS * self.slot_bytes, self.slot_bytes)
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._generation is not None:
+                self.invalidations += 1
+            self._generation = generation
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key, generation=None):
+        """The cached response for `key` (a new dict each time), or None."""
+        raw_key = self._key_bytes(key)
+        generation_hash = self._generation_hash(generation)
+        with self._stats_lock:
+            self._check_generation(generation)
+        buf = self._buf
+        for _ in range(self.READ_RETRIES):
+            retry = False
+            for offset in self._slot_offsets(self._bucket(raw_key)):
+                seq, length, slot_key, slot_generation, _, expires_at, _ = self.SLOT_HEADER.unpack_from(buf, offset)
+                if slot_key != raw_key:
+                    continue
+                if seq & 1:  # being written
+                    break
+                if slot_generation != generation_hash or length > self.capacity:
+                    break
+                now = time.time()
+                if expires_at < now:
+                    self._count("expirations")
+                    break
+                start = offset + self.SLOT_HEADER.size
+                body = bytes(buf[start:start + length])
+                if self.SEQ.unpack_from(buf, offset)[0] != seq:
+                    retry = True
+                    break
+                # Unlocked LRU hint: a racing writer may overwrite it, which only skews eviction order.
+                self.LAST_USED.pack_into(buf, offset + self.LAST_USED_OFFSET, now)
+                try:
+                    response = pickle.loads(body)
+                except Exception:
+                    break
+                self._count("hits")
+                return response
+            if not retry:
+                break
+        self._count("misses")
+        return None
+
+    def _lock(self, bucket):
+        stripe = bucket % self.LOCK_STRIPES
+        return _StripeLock(self._thread_locks[stripe], self._lock_file, 1 + stripe)
+
+    def put(self, key, response, generation=None):
+        """Stores `response` unless it does not fit in a slot."""
+        body = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(body) > self.capacity:
+            return False
+        raw_key = self._key_bytes(key)
+        generation_hash = self._generation_hash(generation)
+        bucket = self._bucket(raw_key)
+        buf = self._buf
+        with self._stats_lock:
+            self._check_generation(generation)
+        with self._lock(bucket):
+            now = time.time()
+            victim, victim_rank, evicted = None, None, False
+            for offset in self._slot_offsets(bucket):
+                seq, length, slot_key, slot_generation, _, expires_at, last_used = self.SLOT_HEADER.unpack_from(buf, offset)
+                if slot_key == raw_key or seq & 1:  # replace in place / recover an interrupted write
+                    rank = (0, 0.0)
+                elif not length or slot_generation != generation_hash or expires_at < now:
+                    rank = (1, 0.0)
+                else:
+                    rank = (2, last_used)
+                if victim_rank is None or rank < victim_rank:
+                    victim, victim_rank, victim_seq = offset, rank, seq
+                    evicted = rank[0] == 2
+            seq = (victim_seq | 1) & 0xFFFFFFFF  # odd: write in progress
+            self.SEQ.pack_into(buf, victim, seq)
+            start = victim + self.SLOT_HEADER.size
+            buf[start:start + len(body)] = body
+            self.SLOT_HEADER.pack_into(buf, victim, seq, len(body), raw_key, generation_hash, now, now + self.ttl, now)
+            self.SEQ.pack_into(buf, victim, (seq + 1) & 0xFFFFFFFF)
+        with self._stats_lock:
+            self.stores += 1
+            if evicted:
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        """Empties every slot of the segment (for all processes)."""
+        buf = self._buf
+        for bucket in range(self.buckets):
+            with self._lock(bucket):
+                for offset in self._slot_offsets(bucket):
+                    seq = self.SEQ.unpack_from(buf, offset)[0]
+                    self.SLOT_HEADER.pack_into(buf, offset, (seq | 1) & 0xFFFFFFFF, 0, bytes(16), 0, 0.0, 0.0, 0.0)
+                    self.SEQ.pack_into(buf, offset, ((seq | 1) + 1) & 0xFFFFFFFF)
+
+    def unlink(self):
+        """Removes the segment name; processes that still map it keep working on their mapping."""
+        resource_tracker.register(self._shm._name, "shared_memory")  # unlink() unregisters it again
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        now = time.time()
+        entries = size = 0
+        for offset in range(self.HEADER_BYTES, self.max_bytes, self.slot_bytes):
+            seq, length, _, _, _, expires_at, _ = self.SLOT_HEADER.unpack_from(self._buf, offset)
+            if length and not seq & 1 and expires_at >= now:
+                entries += 1
+                size += length
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "shared",
+                "enabled": ENABLE_RESPONSE_CACHE,
+                "name": self.name,
+                "slots": self.slot_count,
+                "slot_bytes": self.slot_bytes,
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class _StripeLock:
+    """One writer lock stripe: the thread lock, then the fcntl byte lock at `byte` of the lock file."""
+
+    __slots__ = ("thread_lock", "lock_file", "byte")
+
+    def __init__(self, thread_lock, lock_file, byte):
+        self.thread_lock = thread_lock
+        self.lock_file = lock_file
+        self.byte = byte
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, self.byte)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, self.byte)
+        finally:
+            self.thread_lock.release()
+
+
+def _create_cache():
+    if RESPONSE_CACHE_BACKEND == "shared" and ENABLE_RESPONSE_CACHE:
+        try:
+            return SharedResponseCache()
+        except Exception as e:
+            print(f"Warning: shared response cache unavailable ({e}); using the per-process cache")
+    elif RESPONSE_CACHE_BACKEND not in ("memory", "shared"):
+        print(f"Warning: unknown RESPONSE_CACHE_BACKEND '{RESPONSE_CACHE_BACKEND}'; using 'memory'")
+    return ResponseCache()
+
+
+_cache = _create_cache()
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache (or SharedResponseCache)."""
+    return _cache
+
+def remove_shared_response_cache(name=RESPONSE_CACHE_SHM_NAME):
+    """Unlinks the shared segment (gunicorn master on exit); False if there was none."""
+    if fcntl is None:
+        return False
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    shm.unlink()
+    return True
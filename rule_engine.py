@@ -1,3 +1,19 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from file_signatures import stat_signature
+
+logger = logging.getLogger(__name__)
+
+RULES_FILE = os.environ.get("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+
+# Order of the lookup key used by the compiled rules.
+RULE_INPUTS = ("intensity", "performance", "teamwork", "win_status", "closeness")
+
 # def determine_desired_song_attributes(
 #     intensity_category, 
 #     performance_category, 
@@ -91,7 +107,7 @@
 #     print(f"Desired Song Attributes: {song_attrs}")
 
 
-def determine_desired_song_attributes(
+def legacy_desired_song_attributes(
     intensity_category,
     performance_category,
     teamwork_category,
@@ -99,7 +115,8 @@ def determine_desired_song_attributes(
     closeness_category
 ):
     """
-    Maps gameplay metrics to a desired song profile, using keys that match your songs.json.
+    Hard-coded rules that rules.json was ported from. Kept as the reference
+    the compiled decision table is validated against (see CompiledRules.validate).
     """
     desired = {
         "bpm": None,          # e.g. "High (140-180)"
@@ -164,4 +181,275 @@ def determine_desired_song_attributes(
     desired["moods"] = list(dict.fromkeys(desired["moods"]))
     desired["themes"] = list(dict.fromkeys(desired["themes"]))
 
-    return desired
\ No newline at end of file
+    return desired
+
+class RuleSetError(ValueError):
+    """Raised when a rules file is malformed."""
+
+
+_WHEN_FIELDS = set(RULE_INPUTS) | {"bpm", "energy"}
+_SET_FIELDS = {"bpm", "energy"}
+_ADD_FIELDS = {"moods", "themes"}
+
+
+def _check_rules(doc):
+    if not isinstance(doc, dict):
+        raise RuleSetError("rules file must contain a JSON object")
+    inputs = doc.get("inputs")
+    if not isinstance(inputs, dict) or set(inputs) != set(RULE_INPUTS):
+        raise RuleSetError(f"'inputs' must define exactly {', '.join(RULE_INPUTS)}")
+    for name, values in inputs.items():
+        if not isinstance(values, list) or not values:
+            raise RuleSetError(f"input '{name}' must list at least one value")
+    groups = doc.get("groups")
+    if not isinstance(groups, list):
+        raise RuleSetError("'groups' must be a list")
+    for g, group in enumerate(groups):
+        rules = group.get("rules") if isinstance(group, dict) else None
+        if not isinstance(rules, list):
+            raise RuleSetError(f"group {g} must have a 'rules' list")
+        for r, rule in enumerate(rules):
+            where = f"group {g} ({group.get('name', '?')}), rule {r}"
+            if not isinstance(rule, dict):
+                raise RuleSetError(f"{where}: rule must be an object")
+            unknown = set(rule.get("when", {})) - _WHEN_FIELDS
+            unknown |= set(rule.get("set", {})) - _SET_FIELDS
+            unknown |= set(rule.get("add", {})) - _ADD_FIELDS
+            if unknown:
+                raise RuleSetError(f"{where}: unknown field(s) {', '.join(sorted(unknown))}")
+            for field, values in rule.get("add", {}).items():
+                if not isinstance(values, list):
+                    raise RuleSetError(f"{where}: 'add.{field}' must be a list")
+
+
+def _matches(when, inputs, desired):
+    for field, expected in when.items():
+        actual = inputs[field] if field in inputs else desired.get(field)
+        if isinstance(expected, list):
+            if actual not in expected:
+                return False
+        elif actual != expected:
+            return False
+    return True
+
+
+def evaluate_rules(groups, key):
+    """
+    Interprets decision-table `groups` for one (intensity, performance,
+    teamwork, win_status, closeness) key and returns the desired profile.
+    """
+    inputs = dict(zip(RULE_INPUTS, key))
+    desired = {"bpm": None, "energy": None, "moods": [], "themes": []}
+    for group in groups:
+        for rule in group["rules"]:
+            if _matches(rule.get("when", {}), inputs, desired):
+                desired.update(rule.get("set", {}))
+                for field, values in rule.get("add", {}).items():
+                    desired[field].extend(values)
+                break
+
+    # dedupe
+    desired["moods"] = list(dict.fromkeys(desired["moods"]))
+    desired["themes"] = list(dict.fromkeys(desired["themes"]))
+    return desired
+
+
+def _freeze(profile):
+    return (profile["bpm"], profile["energy"], tuple(profile["moods"]), tuple(profile["themes"]))
+
+
+def _thaw(frozen):
+    bpm, energy, moods, themes = frozen
+    return {"bpm": bpm, "energy": energy, "moods": list(moods), "themes": list(themes)}
+
+
+class CompiledRules:
+    """
+    A decision table evaluated once for every combination of its input values.
+    Lookups are a dict access keyed by the RULE_INPUTS tuple; keys outside the
+    declared domain are interpreted on the fly.
+    """
+
+    def __init__(self, doc):
+        _check_rules(doc)
+        self.groups = doc["groups"]
+        self.domains = tuple(tuple(doc["inputs"][name]) for name in RULE_INPUTS)
+        self.fingerprint = json.dumps(doc, sort_keys=True)
+        self._table = {key: _freeze(evaluate_rules(self.groups, key)) for key in self.keys()}
+
+    def __len__(self):
+        return len(self._table)
+
+    def keys(self):
+        """Every key in the declared input domain."""
+        return itertools.product(*self.domains)
+
+    def lookup(self, key):
+        """Returns a fresh desired-profile dict for one key."""
+        frozen = self._table.get(tuple(key))
+        if frozen is None:
+            return evaluate_rules(self.groups, key)
+        return _thaw(frozen)
+
+    def lookup_many(self, keys):
+        """Returns one desired-profile dict per key, in order (for batch jobs)."""
+        table = self._table
+        results = []
+        for key in keys:
+            frozen = table.get(tuple(key))
+            results.append(_thaw(frozen) if frozen is not None else evaluate_rules(self.groups, key))
+        return results
+
+    def validate(self, reference=None):
+        """
+        Compares the compiled table with `reference` (the hard-coded rules by
+        default) for every key in the domain. Returns a list of
+        (key, expected, actual) mismatches; empty means identical output.
+        """
+        reference = reference or legacy_desired_song_attributes
+        mismatches = []
+        for key, frozen in self._table.items():
+            intensity, performance, teamwork, win_status, closeness = key
+            expected = reference(intensity, performance, teamwork, {"win_status": win_status}, closeness)
+            if _freeze(expected) != frozen:
+                mismatches.append((key, expected, _thaw(frozen)))
+        return mismatches
+
+
+def load_rules(path=None):
+    """Reads and compiles a rules file (RULES_PATH unless `path` is given)."""
+    with open(path or RULES_FILE, "r", encoding="utf-8") as f:
+        return CompiledRules(json.load(f))
+
+
+class RuleEngine:
+    """
+    Process-lifetime holder of the compiled rules, recompiled when the rules
+    file's (mtime, size) signature changes. A broken file keeps the previous
+    rules in place. Each successful compile bumps `version`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or RULES_FILE
+        self._lock = threading.Lock()
+        self._rules = None
+        self._signature = None
+        self.version = 0
+        self.last_compile_seconds = None
+        self.last_error = None
+        self.reference_mismatches = None
+
+    def _stat_signature(self):
+        return stat_signature(self.path)
+
+    def get(self):
+        """Returns the current CompiledRules, or None if no rules file could be compiled."""
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return self._rules
+
+        with self._lock:
+            if signature != self._signature:
+                self._load(signature)
+            return self._rules
+
+    def _load(self, signature):
+        started = time.perf_counter()
+        try:
+            rules = load_rules(self.path)
+        except (OSError, ValueError) as e:
+            self._signature = signature
+            self.last_error = str(e)
+            logger.error(f"could not compile rules from '{self.path}': {e}")
+            if self._rules is not None:
+                logger.warning(f"keeping rules version {self.version}.")
+            return
+
+        mismatches = rules.validate()
+        if mismatches:
+            logger.warning(f"'{self.path}' differs from the reference rules for {len(mismatches)} input(s).")
+        self._rules = rules
+        self._signature = signature
+        self.version += 1
+        self.last_compile_seconds = time.perf_counter() - started
+        self.last_error = None
+        self.reference_mismatches = len(mismatches)
+
+    def install(self, rules, reference_mismatches=None):
+        """Adopts rules compiled elsewhere (e.g. loaded from a cold-start snapshot)."""
+        with self._lock:
+            self._rules = rules
+            self._signature = self._stat_signature()
+            self.version += 1
+            self.last_compile_seconds = None
+            self.last_error = None
+            self.reference_mismatches = reference_mismatches
+
+    def info(self):
+        """Returns a JSON-serializable summary of the compiled rules."""
+        return {
+            "path": self.path,
+            "version": self.version,
+            "table_size": len(self._rules) if self._rules is not None else 0,
+            "last_compile_ms": round(self.last_compile_seconds * 1000, 3) if self.last_compile_seconds is not None else None,
+            "reference_mismatches": self.reference_mismatches,
+            "last_error": self.last_error,
+        }
+
+
+_engine = RuleEngine()
+
+def get_rules():
+    """Returns the process-wide CompiledRules (hot-reloaded from RULES_PATH)."""
+    return _engine.get()
+
+def get_rules_signature():
+    """(mtime, size) of the rules file the process-wide rules were compiled from; the same in every worker."""
+    _engine.get()
+    return _engine._signature
+
+def install_rules(rules, reference_mismatches=None):
+    """Makes `rules` the process-wide CompiledRules until the rules file changes."""
+    _engine.install(rules, reference_mismatches)
+
+def get_rules_info():
+    """Returns version/compile information about the process-wide rules."""
+    return _engine.info()
+
+
+def determine_desired_song_attributes(
+    intensity_category,
+    performance_category,
+    teamwork_category,
+    game_outcome_details,
+    closeness_category
+):
+    """
+    Maps gameplay metrics to a desired song profile, using keys that match your songs.json.
+    Looks the profile up in the compiled rules.json table; falls back to the
+    hard-coded rules if no rules file could be compiled.
+    """
+    rules = get_rules()
+    if rules is None:
+        return legacy_desired_song_attributes(
+            intensity_category, performance_category, teamwork_category, game_outcome_details, closeness_category
+        )
+    return rules.lookup((
+        intensity_category,
+        performance_category,
+        teamwork_category,
+        game_outcome_details.get("win_status"),
+        closeness_category,
+    ))
+
+
+if __name__ == "__main__":
+    # Validate rules.json against the hard-coded rules: python rule_engine.py [path]
+    import sys
+
+    compiled = load_rules(sys.argv[1] if len(sys.argv) > 1 else None)
+    problems = compiled.validate()
+    for key, expected, actual in problems:
+        print(f"{key}: expected {expected}, got {actual}")
+    print(f"{len(compiled)} inputs checked, {len(problems)} mismatch(es).")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,111 @@
+"""
+Single-flight coalescing of identical in-flight computations.
+
+When a replay finishes, every player's client (and often several tabs) asks
+for the same recommendation within milliseconds, before the first answer can
+reach the response cache. SingleFlight.do(key, fn) runs fn once per key at a
+time: the first caller (the leader) computes, callers arriving with the same
+key while it runs wait for it and share its outcome.
+
+- Results reach waiters as pickled copies, so the leader and every waiter
+  can modify what they got (app.py adds per-request metadata).
+- An exception raised by fn is re-raised in the leader and every waiter.
+- A waiter gives up after `timeout` seconds and computes on its own.
+
+Coalescing is per process (the threads of one gthread worker); separate
+workers still meet in the shared response cache.
+"""
+import os
+import pickle
+import threading
+
+ENABLE_REQUEST_COALESCING = os.environ.get("ENABLE_REQUEST_COALESCING", "true").strip().lower() not in ("0", "false", "no", "off")
+COALESCE_TIMEOUT = float(os.environ.get("COALESCE_TIMEOUT", 10))  # seconds a request waits for an identical one
+
+
+class _Call:
+    __slots__ = ("done", "waiters", "body", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.body = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-safe map of in-flight calls by key."""
+
+    def __init__(self, timeout=COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0  # computations saved
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        Returns (result, shared): fn()'s result, computed by this call
+        (shared=False) or by an identical call already in flight (shared=True).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.timeout if timeout is None else timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return fn(), False
+            with self._lock:
+                self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return pickle.loads(call.body), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+                self.errors += 1
+            call.error = e
+            call.done.set()
+            raise
+        with self._lock:
+            del self._calls[key]  # later callers start a new flight (or hit the cache)
+            waiters = call.waiters
+        if waiters:
+            try:
+                call.body = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                call.error = e
+        call.done.set()
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": ENABLE_REQUEST_COALESCING,
+                "timeout_seconds": self.timeout,
+                "in_flight": len(self._calls),
+                "computations": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+            }
+
+
+_flights = SingleFlight()
+
+def get_single_flight():
+    """Returns the process-wide SingleFlight used around get_song_recommendations."""
+    return _flights
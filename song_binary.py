@@ -0,0 +1,453 @@
+"""
+Binary, memory-mapped form of the song catalog.
+
+    python song_binary.py build [--input songs.json] [--output songs.bin]
+    python song_binary.py info  [songs.bin]
+
+`build` compiles the JSON catalog into one little-endian file with fixed-width
+columns (song_id, bpm, energy code, string ids, label offsets), a string
+table, per-song mood/theme bitmasks, and posting lists (mood/theme/energy ->
+rows, rows in BPM order). The service opens the file with mmap and reads the
+columns in place, so every gunicorn worker shares the same page-cache pages
+instead of holding its own parsed copy of songs.json.
+
+The header records the format version, a CRC32 of the header itself and the
+size, mtime and SHA-256 of the JSON file it was built from. open_catalog()
+returns None (and the caller falls back to the JSON file) when the binary
+file is missing, corrupt, from another format version, or older than the JSON.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from song_management import SONG_DATABASE_FILE, Song, song_records
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SONGBIN\x00"
+FORMAT_VERSION = 1
+
+NO_STRING = 0xFFFFFFFF
+MISSING_INT32 = -(2 ** 31)
+MISSING_INT64 = -(2 ** 63)
+
+# Per-song flags
+HAS_MOODS = 1
+HAS_THEMES = 2
+
+# Sections in file order: name -> array typecode of its items.
+SECTIONS = (
+    ("string_offsets", "I"),   # string_count + 1 byte offsets into string_data
+    ("string_data", "B"),      # UTF-8
+    ("song_id", "q"),
+    ("bpm", "i"),
+    ("energy", "H"),           # 0 = missing, else 1 + index into energy_labels
+    ("flags", "B"),
+    ("title", "I"),            # string ids (NO_STRING = missing)
+    ("artist", "I"),
+    ("track_id", "I"),
+    ("url_prefix", "I"),
+    ("extra", "I"),            # JSON object of any other fields
+    ("mood_offsets", "I"),     # song_count + 1 offsets into mood_ids
+    ("mood_ids", "I"),         # indexes into mood_labels
+    ("theme_offsets", "I"),
+    ("theme_ids", "I"),
+    ("energy_labels", "I"),    # string ids
+    ("mood_labels", "I"),
+    ("theme_labels", "I"),
+    ("mood_masks", "Q"),       # song_count x mood_words bitmask over mood_labels
+    ("theme_masks", "Q"),
+    ("energy_post_offsets", "I"),
+    ("energy_post_rows", "I"),
+    ("mood_post_offsets", "I"),
+    ("mood_post_rows", "I"),
+    ("theme_post_offsets", "I"),
+    ("theme_post_rows", "I"),
+    ("bpm_order", "I"),        # rows sorted by (bpm, row); missing BPM counts as 0
+    ("bpm_sorted", "i"),
+)
+
+# magic, version, song_count, string_count, shared_string_count, mood_words, theme_words,
+# source size, source mtime_ns, source sha256, then (offset, length) per section, then the header CRC.
+_HEADER_HEAD = struct.Struct("<8sIIIIII Qq32s")
+_SECTION_ENTRY = struct.Struct("<QQ")
+_HEADER_CRC = struct.Struct("<I")
+HEADER_SIZE = _HEADER_HEAD.size + _SECTION_ENTRY.size * len(SECTIONS) + _HEADER_CRC.size
+
+
+class CatalogFormatError(Exception):
+    """Raised when a catalog cannot be written to, or read from, the binary format."""
+
+
+def default_binary_path(json_path=None):
+    """songs.json -> songs.bin"""
+    return os.path.splitext(json_path or SONG_DATABASE_FILE)[0] + ".bin"
+
+
+def _source_fingerprint(json_path, with_digest=True):
+    st = os.stat(json_path)
+    digest = b""
+    if with_digest:
+        sha = hashlib.sha256()
+        with open(json_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.digest()
+    return st.st_size, st.st_mtime_ns, digest
+
+
+# --- building ---
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array("I", [0])
+        self.data = bytearray()
+
+    def add(self, value):
+        if value is None:
+            return NO_STRING
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.ids)
+            self.data += value.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return sid
+
+
+def _check_song(song):
+    for field in ("title", "artist", "energy", "track_id"):
+        value = getattr(song, field)
+        if value is not None and not isinstance(value, str):
+            raise CatalogFormatError(f"{song!r}: '{field}' must be a string, got {type(value).__name__}")
+    for field, low in (("song_id", MISSING_INT64), ("bpm", MISSING_INT32)):
+        value = getattr(song, field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)
+                                  or not low < value < -low):
+            raise CatalogFormatError(f"{song!r}: '{field}' must be an integer, got {value!r}")
+    for field in ("moods", "themes"):
+        for label in getattr(song, field) or ():
+            if not isinstance(label, str):
+                raise CatalogFormatError(f"{song!r}: '{field}' must only contain strings")
+
+
+def _postings(groups, count):
+    offsets, rows = array("I", [0]), array("I")
+    for code in range(count):
+        rows.extend(groups.get(code, ()))
+        offsets.append(len(rows))
+    return offsets, rows
+
+
+def _masks(label_ids, offsets, n, words):
+    masks = array("Q", bytes(8 * n * words))
+    for row in range(n):
+        for label in label_ids[offsets[row]:offsets[row + 1]]:
+            masks[row * words + label // 64] |= 1 << (label % 64)
+    return masks
+
+
+def compile_catalog(songs, source_fingerprint=(0, 0, b"")):
+    """Serializes Song records (or songs.json dicts) to the binary format; returns bytes."""
+    if sys.byteorder != "little":
+        raise CatalogFormatError("the binary catalog can only be built on little-endian machines")
+    songs = song_records(songs)
+    n = len(songs)
+    strings = _StringTable()
+
+    # Labels, energies and URL prefixes go first; they are decoded once per process.
+    vocab = {"energy": {}, "moods": {}, "themes": {}}
+    for song in songs:
+        _check_song(song)
+        if song.energy is not None:
+            vocab["energy"].setdefault(song.energy, len(vocab["energy"]))
+        for field in ("moods", "themes"):
+            for label in song.get(field) or ():
+                vocab[field].setdefault(label, len(vocab[field]))
+    if len(vocab["energy"]) >= 0xFFFF:
+        raise CatalogFormatError("too many distinct energy values")
+    for labels in vocab.values():
+        for label in labels:
+            strings.add(label)
+    for song in songs:
+        strings.add(song.url_prefix)
+    shared_string_count = len(strings.ids)
+
+    columns = {name: array(code) for name, code in SECTIONS}
+    label_groups = {"energy": {}, "moods": {}, "themes": {}}
+    offsets = {"moods": columns["mood_offsets"], "themes": columns["theme_offsets"]}
+    ids = {"moods": columns["mood_ids"], "themes": columns["theme_ids"]}
+    offsets["moods"].append(0)
+    offsets["themes"].append(0)
+    for row, song in enumerate(songs):
+        columns["song_id"].append(MISSING_INT64 if song.song_id is None else song.song_id)
+        columns["bpm"].append(MISSING_INT32 if song.bpm is None else song.bpm)
+        if song.energy is None:
+            columns["energy"].append(0)
+        else:
+            code = vocab["energy"][song.energy]
+            columns["energy"].append(code + 1)
+            label_groups["energy"].setdefault(code, []).append(row)
+        columns["flags"].append((HAS_MOODS if song.moods is not None else 0) | (HAS_THEMES if song.themes is not None else 0))
+        columns["title"].append(strings.add(song.title))
+        columns["artist"].append(strings.add(song.artist))
+        columns["track_id"].append(strings.add(song.track_id))
+        columns["url_prefix"].append(strings.add(song.url_prefix))
+        columns["extra"].append(strings.add(json.dumps(song.extra) if song.extra else None))
+        for field in ("moods", "themes"):
+            labels = song.get(field) or ()
+            ids[field].extend(vocab[field][label] for label in labels)
+            offsets[field].append(len(ids[field]))
+            for label in dict.fromkeys(labels):
+                label_groups[field].setdefault(vocab[field][label], []).append(row)
+
+    for name, field in (("energy_labels", "energy"), ("mood_labels", "moods"), ("theme_labels", "themes")):
+        columns[name].extend(strings.ids[label] for label in vocab[field])
+
+    mood_words = max(1, (len(vocab["moods"]) + 63) // 64)
+    theme_words = max(1, (len(vocab["themes"]) + 63) // 64)
+    columns["mood_masks"] = _masks(columns["mood_ids"], columns["mood_offsets"], n, mood_words)
+    columns["theme_masks"] = _masks(columns["theme_ids"], columns["theme_offsets"], n, theme_words)
+
+    for prefix, field in (("energy", "energy"), ("mood", "moods"), ("theme", "themes")):
+        post_offsets, post_rows = _postings(label_groups[field], len(vocab[field]))
+        columns[f"{prefix}_post_offsets"] = post_offsets
+        columns[f"{prefix}_post_rows"] = post_rows
+
+    by_bpm = sorted((0 if song.bpm is None else song.bpm, row) for row, song in enumerate(songs))
+    columns["bpm_order"].extend(row for _, row in by_bpm)
+    columns["bpm_sorted"].extend(bpm for bpm, _ in by_bpm)
+    columns["string_offsets"] = strings.offsets
+    columns["string_data"] = array("B", bytes(strings.data))
+
+    # Lay the sections out after the header, 8-byte aligned.
+    body = bytearray()
+    entries = []
+    for name, _ in SECTIONS:
+        body += bytes(-(HEADER_SIZE + len(body)) % 8)
+        data = columns[name].tobytes()
+        entries.append((HEADER_SIZE + len(body), len(data)))
+        body += data
+
+    size, mtime_ns, digest = source_fingerprint
+    header = _HEADER_HEAD.pack(MAGIC, FORMAT_VERSION, n, len(strings.ids), shared_string_count,
+                               mood_words, theme_words, size, mtime_ns, digest.ljust(32, b"\0"))
+    header += b"".join(_SECTION_ENTRY.pack(offset, length) for offset, length in entries)
+    header += _HEADER_CRC.pack(zlib.crc32(header))
+    return header + bytes(body)
+
+
+def build_binary_catalog(json_path=None, output_path=None):
+    """Compiles `json_path` into `output_path` (written atomically); returns the song count."""
+    json_path = json_path or SONG_DATABASE_FILE
+    output_path = output_path or default_binary_path(json_path)
+    fingerprint = _source_fingerprint(json_path)
+    with open(json_path, "r", encoding="utf-8") as f:
+        songs = json.load(f)
+    if not isinstance(songs, list):
+        raise CatalogFormatError(f"song database '{json_path}' should be a list of songs")
+    data = compile_catalog(songs, fingerprint)
+    tmp_path = f"{output_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return struct.unpack_from("<I", data, 12)[0]
+
+
+# --- reading ---
+
+class _LabelSets:
+    """Lazy per-row frozensets of a song's mood or theme labels (for PostingsSongIndex)."""
+
+    def __init__(self, catalog, field):
+        self.catalog = catalog
+        self.field = field
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, row):
+        return frozenset(self.catalog.labels(self.field, row) or ())
+
+
+class MappedCatalog:
+    """
+    Read-only sequence of Song records backed by an mmap of a binary catalog.
+
+    Columns are memoryviews into the mapping (no copies); catalog[i] builds a
+    transient Song on access. Only the small set of labels, energies and URL
+    prefixes is decoded up front.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        if len(buf) < HEADER_SIZE:
+            raise CatalogFormatError("file is shorter than the header")
+        head = _HEADER_HEAD.unpack_from(buf, 0)
+        magic, version, self.song_count, self.string_count, shared_string_count, self.mood_words, self.theme_words = head[:7]
+        self.source_size, self.source_mtime_ns, self.source_sha256 = head[7:]
+        if magic != MAGIC:
+            raise CatalogFormatError("not a binary song catalog")
+        if version != FORMAT_VERSION:
+            raise CatalogFormatError(f"format version {version}, expected {FORMAT_VERSION}")
+        (stored_crc,) = _HEADER_CRC.unpack_from(buf, HEADER_SIZE - _HEADER_CRC.size)
+        if zlib.crc32(buf[:HEADER_SIZE - _HEADER_CRC.size]) != stored_crc:
+            raise CatalogFormatError("header checksum mismatch")
+        if sys.byteorder != "little":
+            raise CatalogFormatError("the binary catalog can only be read on little-endian machines")
+
+        self.columns = {}
+        for i, (name, code) in enumerate(SECTIONS):
+            offset, length = _SECTION_ENTRY.unpack_from(buf, _HEADER_HEAD.size + i * _SECTION_ENTRY.size)
+            if offset + length > len(buf) or length % array(code).itemsize:
+                raise CatalogFormatError(f"section '{name}' is out of bounds")
+            self.columns[name] = buf[offset:offset + length].cast(code)
+
+        self._shared_strings = [self._decode(sid) for sid in range(shared_string_count)]
+        self.energy_labels = [self.string(sid) for sid in self.columns["energy_labels"]]
+        self.mood_labels = [self.string(sid) for sid in self.columns["mood_labels"]]
+        self.theme_labels = [self.string(sid) for sid in self.columns["theme_labels"]]
+
+    def _decode(self, sid):
+        offsets = self.columns["string_offsets"]
+        return str(self.columns["string_data"][offsets[sid]:offsets[sid + 1]], "utf-8")
+
+    def string(self, sid):
+        if sid == NO_STRING:
+            return None
+        if sid < len(self._shared_strings):
+            return self._shared_strings[sid]
+        return self._decode(sid)
+
+    def labels(self, field, row):
+        """Mood or theme labels of one song, as a tuple (or None when the song had none)."""
+        flag, prefix, names = ((HAS_MOODS, "mood", self.mood_labels) if field == "moods"
+                               else (HAS_THEMES, "theme", self.theme_labels))
+        if not self.columns["flags"][row] & flag:
+            return None
+        offsets = self.columns[f"{prefix}_offsets"]
+        return tuple(names[i] for i in self.columns[f"{prefix}_ids"][offsets[row]:offsets[row + 1]])
+
+    def postings(self, field):
+        """label -> memoryview of the rows carrying it, for 'energy', 'moods' or 'themes'."""
+        prefix, names = {"energy": ("energy", self.energy_labels), "moods": ("mood", self.mood_labels),
+                         "themes": ("theme", self.theme_labels)}[field]
+        offsets = self.columns[f"{prefix}_post_offsets"]
+        rows = self.columns[f"{prefix}_post_rows"]
+        return {label: rows[offsets[i]:offsets[i + 1]] for i, label in enumerate(names)}
+
+    def label_sets(self, field):
+        return _LabelSets(self, field)
+
+    def __len__(self):
+        return self.song_count
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(self.song_count))]
+        if row < 0:
+            row += self.song_count
+        if not 0 <= row < self.song_count:
+            raise IndexError("song index out of range")
+        columns = self.columns
+        song = Song.__new__(Song)
+        song_id = columns["song_id"][row]
+        song.song_id = None if song_id == MISSING_INT64 else song_id
+        song.title = self.string(columns["title"][row])
+        song.artist = self.string(columns["artist"][row])
+        bpm = columns["bpm"][row]
+        song.bpm = None if bpm == MISSING_INT32 else bpm
+        energy = columns["energy"][row]
+        song.energy = self.energy_labels[energy - 1] if energy else None
+        song.moods = self.labels("moods", row)
+        song.themes = self.labels("themes", row)
+        song.track_id = self.string(columns["track_id"][row])
+        song.url_prefix = self.string(columns["url_prefix"][row])
+        extra = self.string(columns["extra"][row])
+        song.extra = json.loads(extra) if extra is not None else None
+        return song
+
+    def __iter__(self):
+        for row in range(self.song_count):
+            yield self[row]
+
+    def is_built_from(self, json_path):
+        """True if the header matches the JSON file's size and (mtime or SHA-256)."""
+        size, mtime_ns, _ = _source_fingerprint(json_path, with_digest=False)
+        if size != self.source_size:
+            return False
+        if mtime_ns == self.source_mtime_ns:
+            return True
+        return _source_fingerprint(json_path)[2] == self.source_sha256
+
+
+def open_catalog(binary_path, json_path=None):
+    """
+    Maps `binary_path` if it is a valid catalog built from the current `json_path`;
+    otherwise prints why and returns None so the caller can load the JSON instead.
+    """
+    if not binary_path or not os.path.exists(binary_path):
+        return None
+    try:
+        catalog = MappedCatalog(binary_path)
+        if json_path and os.path.exists(json_path) and not catalog.is_built_from(json_path):
+            logger.warning(f"binary catalog '{binary_path}' is older than '{json_path}'; using the JSON file.")
+            return None
+    except (OSError, ValueError, CatalogFormatError) as e:
+        logger.warning(f"cannot use binary catalog '{binary_path}' ({e}); using the JSON file.")
+        return None
+    logger.info(f"Successfully mapped {len(catalog)} songs from '{binary_path}'.")
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the memory-mapped song catalog.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="Compile the JSON catalog into the binary format.")
+    p_build.add_argument("--input", default=SONG_DATABASE_FILE, help="JSON catalog (default: SONG_DB_PATH).")
+    p_build.add_argument("--output", help="Binary catalog (default: the input path with a .bin suffix).")
+    p_info = sub.add_parser("info", help="Validate a binary catalog and print its header.")
+    p_info.add_argument("path", nargs="?", default=None)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output = args.output or default_binary_path(args.input)
+        try:
+            count = build_binary_catalog(args.input, output)
+        except (OSError, ValueError, CatalogFormatError) as e:
+            print(f"Error: could not build binary catalog from '{args.input}': {e}")
+            sys.exit(1)
+        print(f"Wrote {count} songs to '{output}' ({os.path.getsize(output)} bytes).")
+        return
+
+    path = args.path or default_binary_path()
+    try:
+        catalog = MappedCatalog(path)
+    except (OSError, CatalogFormatError) as e:
+        print(f"Error: '{path}' is not a usable binary catalog: {e}")
+        sys.exit(1)
+    print(json.dumps({
+        "path": path,
+        "format_version": FORMAT_VERSION,
+        "songs": len(catalog),
+        "strings": catalog.string_count,
+        "energies": len(catalog.energy_labels),
+        "moods": len(catalog.mood_labels),
+        "themes": len(catalog.theme_labels),
+        "source_size": catalog.source_size,
+        "source_sha256": catalog.source_sha256.hex(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
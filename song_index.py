@@ -0,0 +1,339 @@
+"""
+Compiled views of the song catalog used by song_matcher.find_matching_songs.
+
+The plain matcher walks every song dict and rebuilds sets per song. The indexes
+below are built once per catalog version instead:
+  - NumpySongIndex stores the catalog as arrays so a desired profile can be
+    scored with a handful of vectorized operations.
+  - PostingsSongIndex (no numpy needed) keeps inverted mood/theme/energy
+    postings and a BPM-sorted list, and only scores songs that can match.
+Both can also be opened over a song_binary.MappedCatalog, whose file already
+holds these columns and postings.
+Scores are identical to song_matcher.calculate_match_score
+(+50 BPM, +30 energy, +15/mood, +10/theme).
+
+SONG_INDEX picks the index: "numpy", "postings", or "auto" (NumPy when it is
+installed). Postings win when profiles are selective relative to the catalog;
+see `python benchmark.py` for both on your catalog size.
+"""
+import heapq
+import logging
+import os
+from bisect import bisect_left, bisect_right
+
+from song_binary import MISSING_INT32, MappedCatalog
+from song_matcher import parse_bpm_range
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the matcher falls back to a plain scan
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+SONG_INDEX = os.environ.get("SONG_INDEX", "auto").strip().lower()  # auto | numpy | postings
+
+BPM_POINTS = 50
+ENERGY_POINTS = 30
+MOOD_POINTS = 15
+THEME_POINTS = 10
+
+
+def _popcount(words):
+    """Number of set bits per row of a (n, w) uint64 array."""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    as_bytes = words.view(np.uint8).reshape(words.shape[0], -1)
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=1, dtype=np.int64)
+
+
+_POPCOUNT_TABLE = None
+if np is not None:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class _Vocabulary:
+    """Interns string labels (moods or themes) to bit positions."""
+
+    def __init__(self):
+        self.bits = {}
+
+    def add(self, label):
+        bit = self.bits.get(label)
+        if bit is None:
+            bit = self.bits[label] = len(self.bits)
+        return bit
+
+    @classmethod
+    def from_labels(cls, labels):
+        """Vocabulary whose bit i is labels[i] (as stored by song_binary)."""
+        vocab = cls()
+        vocab.bits = {label: bit for bit, label in enumerate(labels)}
+        return vocab
+
+    @property
+    def words(self):
+        return max(1, (len(self.bits) + 63) // 64)
+
+    def mask(self, labels, words=None):
+        """Bitmask (as a uint64 row) of the labels that are in the vocabulary."""
+        row = np.zeros(words or self.words, dtype=np.uint64)
+        for label in set(labels or []):
+            bit = self.bits.get(label)
+            if bit is not None:
+                row[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return row
+
+
+class NumpySongIndex:
+    """
+    Column store of the catalog: BPM as an int array, energy as small-int codes
+    and moods/themes as per-song bitmasks over an interned vocabulary.
+    """
+
+    def __init__(self, songs):
+        self.songs = songs
+        n = len(songs)
+
+        bpm = np.array([song.get("bpm", 0) for song in songs])
+        if bpm.dtype.kind not in "iu":
+            bpm = bpm.astype(np.float64)
+        self.bpm = bpm
+
+        # Energy code 0 is reserved for "missing", which never matches a desired energy.
+        self.energy_codes = {}
+        energy = np.zeros(n, dtype=np.int16)
+        for row, song in enumerate(songs):
+            value = song.get("energy")
+            if value is not None:
+                energy[row] = self.energy_codes.setdefault(value, len(self.energy_codes) + 1)
+        self.energy = energy
+
+        self.mood_vocab = _Vocabulary()
+        self.theme_vocab = _Vocabulary()
+        for song in songs:
+            for mood in song.get("moods") or []:
+                self.mood_vocab.add(mood)
+            for theme in song.get("themes") or []:
+                self.theme_vocab.add(theme)
+        self.mood_masks = np.zeros((n, self.mood_vocab.words), dtype=np.uint64)
+        self.theme_masks = np.zeros((n, self.theme_vocab.words), dtype=np.uint64)
+        for row, song in enumerate(songs):
+            self.mood_masks[row] = self.mood_vocab.mask(song.get("moods"))
+            self.theme_masks[row] = self.theme_vocab.mask(song.get("themes"))
+
+    @classmethod
+    def from_mapped(cls, catalog):
+        """Index over a song_binary.MappedCatalog that reads its columns in place."""
+        index = cls.__new__(cls)
+        index.songs = catalog
+        n = len(catalog)
+        columns = catalog.columns
+        bpm = np.frombuffer(columns["bpm"], dtype=np.int32)
+        missing = bpm == np.int32(MISSING_INT32)
+        index.bpm = np.where(missing, 0, bpm) if missing.any() else bpm
+        index.energy_codes = {label: code for code, label in enumerate(catalog.energy_labels, 1)}
+        index.energy = np.frombuffer(columns["energy"], dtype=np.uint16)
+        index.mood_vocab = _Vocabulary.from_labels(catalog.mood_labels)
+        index.theme_vocab = _Vocabulary.from_labels(catalog.theme_labels)
+        index.mood_masks = np.frombuffer(columns["mood_masks"], dtype=np.uint64).reshape(n, catalog.mood_words)
+        index.theme_masks = np.frombuffer(columns["theme_masks"], dtype=np.uint64).reshape(n, catalog.theme_words)
+        return index
+
+    def __len__(self):
+        return len(self.songs)
+
+    def score(self, desired_profile):
+        """Vector of match scores (int64), one per song, in catalog order."""
+        scores = np.zeros(len(self.songs), dtype=np.int64)
+
+        min_bpm, max_bpm = parse_bpm_range(desired_profile.get("bpm"))
+        if min_bpm is not None and max_bpm is not None:
+            scores += BPM_POINTS * ((self.bpm >= min_bpm) & (self.bpm <= max_bpm))
+
+        desired_energy = desired_profile.get("energy")
+        if desired_energy:
+            code = self.energy_codes.get(desired_energy)
+            if code is not None:
+                scores += ENERGY_POINTS * (self.energy == code)
+
+        if desired_profile.get("moods"):
+            wanted = self.mood_vocab.mask(desired_profile["moods"])
+            if wanted.any():
+                scores += MOOD_POINTS * _popcount(self.mood_masks & wanted)
+
+        if desired_profile.get("themes"):
+            wanted = self.theme_vocab.mask(desired_profile["themes"])
+            if wanted.any():
+                scores += THEME_POINTS * _popcount(self.theme_masks & wanted)
+
+        return scores
+
+    def top_matches(self, desired_profile, top_n):
+        """
+        Returns up to top_n (row, score) pairs with score > 0, best first.
+        Ties keep catalog order, exactly like the stable sort in the plain matcher.
+        """
+        n = len(self.songs)
+        if n == 0 or top_n <= 0:
+            return []
+        scores = self.score(desired_profile)
+
+        # Unique composite key: higher score first, then lower row index.
+        keys = scores * n + (n - 1 - np.arange(n, dtype=np.int64))
+        if top_n < n:
+            picked = np.argpartition(-keys, top_n - 1)[:top_n]
+        else:
+            picked = np.arange(n)
+        picked = picked[np.argsort(-keys[picked])]
+        return [(int(row), int(scores[row])) for row in picked if scores[row] > 0]
+
+
+class PostingsSongIndex:
+    """
+    Inverted index of the catalog: mood/theme -> rows, energy -> rows and a
+    BPM-sorted (bpm, row) list searched with bisect. Only rows that appear in
+    at least one posting for the desired profile are scored.
+    """
+
+    def __init__(self, songs):
+        self.songs = songs
+        self.mood_postings = {}
+        self.theme_postings = {}
+        self.energy_buckets = {}
+        self.song_moods = []
+        self.song_themes = []
+
+        by_bpm = []
+        for row, song in enumerate(songs):
+            bpm = song.get("bpm", 0)
+            if isinstance(bpm, (int, float)) and not isinstance(bpm, bool):
+                by_bpm.append((bpm, row))
+            energy = song.get("energy")
+            if energy is not None:
+                self.energy_buckets.setdefault(energy, []).append(row)
+
+            moods = frozenset(song.get("moods") or [])
+            themes = frozenset(song.get("themes") or [])
+            self.song_moods.append(moods)
+            self.song_themes.append(themes)
+            for mood in moods:
+                self.mood_postings.setdefault(mood, []).append(row)
+            for theme in themes:
+                self.theme_postings.setdefault(theme, []).append(row)
+
+        by_bpm.sort()
+        self.bpm_values = [bpm for bpm, _ in by_bpm]
+        self.bpm_rows = [row for _, row in by_bpm]
+
+    @classmethod
+    def from_mapped(cls, catalog):
+        """Index over a song_binary.MappedCatalog that uses its stored posting lists."""
+        index = cls.__new__(cls)
+        index.songs = catalog
+        index.mood_postings = catalog.postings("moods")
+        index.theme_postings = catalog.postings("themes")
+        index.energy_buckets = catalog.postings("energy")
+        index.song_moods = catalog.label_sets("moods")
+        index.song_themes = catalog.label_sets("themes")
+        index.bpm_values = catalog.columns["bpm_sorted"]
+        index.bpm_rows = catalog.columns["bpm_order"]
+        return index
+
+    def __len__(self):
+        return len(self.songs)
+
+    def top_matches(self, desired_profile, top_n):
+        """
+        Returns up to top_n (row, score) pairs with score > 0, best first.
+        Ties keep catalog order, exactly like the stable sort in the plain matcher.
+        """
+        if not self.songs or top_n <= 0:
+            return []
+
+        candidates = set()
+        max_score = 0
+
+        in_bpm = set()
+        min_bpm, max_bpm = parse_bpm_range(desired_profile.get("bpm"))
+        if min_bpm is not None and max_bpm is not None:
+            lo = bisect_left(self.bpm_values, min_bpm)
+            hi = bisect_right(self.bpm_values, max_bpm)
+            if lo < hi:
+                in_bpm.update(self.bpm_rows[lo:hi])
+                max_score += BPM_POINTS
+
+        energy_rows = set()
+        desired_energy = desired_profile.get("energy")
+        if desired_energy and desired_energy in self.energy_buckets:
+            energy_rows.update(self.energy_buckets[desired_energy])
+            max_score += ENERGY_POINTS
+
+        moods = frozenset(m for m in desired_profile.get("moods") or [] if m in self.mood_postings)
+        themes = frozenset(t for t in desired_profile.get("themes") or [] if t in self.theme_postings)
+        max_score += MOOD_POINTS * len(moods) + THEME_POINTS * len(themes)
+
+        candidates |= in_bpm
+        candidates |= energy_rows
+        for mood in moods:
+            candidates.update(self.mood_postings[mood])
+        for theme in themes:
+            candidates.update(self.theme_postings[theme])
+
+        # Min-heap of (score, -row): the root is the weakest of the current top_n.
+        heap = []
+        for row in sorted(candidates):
+            song_moods = self.song_moods[row]
+            song_themes = self.song_themes[row]
+            if len(heap) == top_n:
+                # Cheap per-song upper bound; a later row never wins a tie.
+                bound = (
+                    (BPM_POINTS if row in in_bpm else 0)
+                    + (ENERGY_POINTS if row in energy_rows else 0)
+                    + MOOD_POINTS * min(len(song_moods), len(moods))
+                    + THEME_POINTS * min(len(song_themes), len(themes))
+                )
+                if bound <= heap[0][0]:
+                    continue
+
+            score = (
+                (BPM_POINTS if row in in_bpm else 0)
+                + (ENERGY_POINTS if row in energy_rows else 0)
+                + MOOD_POINTS * len(song_moods & moods)
+                + THEME_POINTS * len(song_themes & themes)
+            )
+            if len(heap) < top_n:
+                heapq.heappush(heap, (score, -row))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -row))
+
+            # Nothing after this row can beat a full heap of perfect scores.
+            if len(heap) == top_n and heap[0][0] == max_score:
+                break
+
+        best = heapq.nlargest(top_n, heap)
+        return [(-neg_row, score) for score, neg_row in best if score > 0]
+
+
+def _index_class():
+    if SONG_INDEX == "postings":
+        return PostingsSongIndex
+    if SONG_INDEX == "numpy" and np is None:
+        logger.warning("SONG_INDEX=numpy but numpy is not installed; using the postings index")
+    elif SONG_INDEX not in ("auto", "numpy"):
+        logger.warning(f"unknown SONG_INDEX '{SONG_INDEX}'; using 'auto'")
+    return PostingsSongIndex if np is None else NumpySongIndex
+
+
+def build_song_index(songs):
+    """
+    Builds the index SONG_INDEX selects for `songs` (by default the NumPy column
+    store when numpy is installed, otherwise the pure-Python postings index).
+    A memory-mapped catalog is indexed from its stored columns and postings
+    without copying them.
+    """
+    index_class = _index_class()
+    if isinstance(songs, MappedCatalog):
+        return index_class.from_mapped(songs)
+    return index_class(songs)
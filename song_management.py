@@ -1,35 +1,407 @@
+import hashlib
 import json
+import logging
+import os
+import sys
+import threading
+import time
 
-SONG_DATABASE_FILE = "songs.json"
+from file_signatures import stat_signature
 
-def load_song_database():
+logger = logging.getLogger(__name__)
+
+SONG_DATABASE_FILE = os.environ.get("SONG_DB_PATH", "songs.json")
+
+# Catalog caching (see .env.example). When caching is enabled the parsed catalog
+# is kept in memory for the lifetime of the process and only re-read when the
+# file's mtime or size changes, or when it is older than CACHE_TTL seconds and
+# its contents changed in place (checked with a SHA-256 of the files).
+ENABLE_SONG_CACHING = os.environ.get("ENABLE_SONG_CACHING", "true").strip().lower() not in ("0", "false", "no", "off")
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 3600))  # seconds, 0 disables the TTL
+
+# Compiled catalog built by `python song_binary.py build`. Unset means the JSON
+# path with a .bin suffix; an empty value always uses the JSON file.
+SONG_BINARY_PATH = os.environ.get("SONG_BINARY_PATH")
+
+class Song:
     """
-    Loads the song database from the JSON file.
-    Returns a list of song dictionaries, or an empty list if an error occurs.
+    One catalog entry stored as a compact slotted record instead of a dict.
+
+    Artist, energy and label strings are interned and identical mood/theme
+    tuples are shared between songs, BPM is kept as an int, and source_url is
+    rebuilt from a shared prefix plus track_id instead of being stored twice.
+    Read access mirrors a dict (song["bpm"], song.get("moods")) so scoring code
+    works on either; to_dict() produces the JSON shape of songs.json.
     """
+
+    __slots__ = ("song_id", "title", "artist", "bpm", "energy", "moods", "themes", "track_id", "url_prefix", "extra")
+
+    # Key order of the dicts returned by to_dict().
+    FIELDS = ("song_id", "title", "artist", "bpm", "energy", "moods", "themes", "source_url", "track_id")
+
+    @classmethod
+    def from_dict(cls, data, shared_labels=None):
+        """Builds a record from a songs.json entry; `shared_labels` dedupes mood/theme tuples across calls."""
+        shared_labels = {} if shared_labels is None else shared_labels
+        song = cls.__new__(cls)
+        song.song_id = data.get("song_id")
+        song.title = data.get("title")
+        song.artist = _intern(data.get("artist"))
+        song.bpm = _as_int(data.get("bpm"))
+        song.energy = _intern(data.get("energy"))
+        song.moods = _label_tuple(data.get("moods"), shared_labels)
+        song.themes = _label_tuple(data.get("themes"), shared_labels)
+        song.track_id = data.get("track_id")
+        song.url_prefix = None
+        extra = {key: value for key, value in data.items() if key not in _RECORD_KEYS}
+
+        source_url = data.get("source_url")
+        track_id = song.track_id
+        if isinstance(source_url, str) and isinstance(track_id, str) and track_id and source_url.endswith(track_id):
+            song.url_prefix = sys.intern(source_url[:-len(track_id)])
+        elif source_url is not None:
+            extra["source_url"] = source_url
+        song.extra = extra or None
+        return song
+
+    @property
+    def source_url(self):
+        if self.url_prefix is not None:
+            return self.url_prefix + self.track_id
+        return self.extra.get("source_url") if self.extra else None
+
+    def get(self, key, default=None):
+        if key in _SLOT_KEYS:
+            value = getattr(self, key)
+        elif key == "source_url":
+            value = self.source_url
+        else:
+            value = self.extra.get(key) if self.extra else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def to_dict(self):
+        """Returns a new songs.json-style dict (fields that were absent are left out)."""
+        song = {}
+        for key in Song.FIELDS:
+            value = self.get(key)
+            if value is not None:
+                song[key] = list(value) if isinstance(value, tuple) else value
+        if self.extra:
+            for key, value in self.extra.items():
+                song.setdefault(key, value)
+        return song
+
+    def __repr__(self):
+        return f"Song({self.song_id!r}, {self.title!r}, {self.artist!r})"
+
+
+_SLOT_KEYS = frozenset(Song.__slots__) - {"url_prefix", "extra"}
+_RECORD_KEYS = _SLOT_KEYS | {"source_url"}
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _as_int(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _label_tuple(labels, shared_labels):
+    if labels is None:
+        return None
+    labels = tuple(_intern(label) for label in labels)
+    return shared_labels.setdefault(labels, labels)
+
+
+def song_records(songs):
+    """Converts parsed songs.json entries into Song records (non-dict entries are skipped)."""
+    shared_labels = {}
+    records = []
+    for song in songs:
+        if isinstance(song, Song):
+            records.append(song)
+        elif isinstance(song, dict):
+            records.append(Song.from_dict(song, shared_labels))
+        else:
+            logger.warning(f"skipping song entry that is not an object: {song!r}")
+    return records
+
+
+def load_song_database(path=None):
+    """
+    Loads the song database from the JSON file (SONG_DB_PATH unless `path` is given).
+    Returns a list of Song records, or an empty list if an error occurs.
+    """
+    db_path = path or SONG_DATABASE_FILE
     try:
-        with open(SONG_DATABASE_FILE, 'r', encoding='utf-8') as f:
+        with open(db_path, 'r', encoding='utf-8') as f:
             songs = json.load(f)
         # Basic validation: check if it's a list
         if not isinstance(songs, list):
-            print(f"Error: Song database '{SONG_DATABASE_FILE}' should be a list of songs.")
+            logger.error(f"Song database '{db_path}' should be a list of songs.")
             return []
-        # Optional: further validation for each song entry can be added here
-        # For example, check for required keys like 'title', 'artist', 'bpm', etc.
-        print(f"Successfully loaded {len(songs)} songs from '{SONG_DATABASE_FILE}'.")
+        songs = song_records(songs)
+        logger.info(f"Successfully loaded {len(songs)} songs from '{db_path}'.")
         return songs
     except FileNotFoundError:
-        print(f"Error: Song database file '{SONG_DATABASE_FILE}' not found.")
+        logger.error(f"Song database file '{db_path}' not found.")
         return []
     except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from '{SONG_DATABASE_FILE}'. Check for syntax errors.")
+        logger.error(f"Could not decode JSON from '{db_path}'. Check for syntax errors.")
         return []
     except Exception as e:
-        print(f"An unexpected error occurred while loading songs: {e}")
+        logger.error(f"An unexpected error occurred while loading songs: {e}")
         return []
 
+
+class SongCatalog:
+    """
+    Process-lifetime cache around load_song_database().
+
+    get() returns the list of Song records, re-reading the file only when its
+    (mtime, size) signature changes or, once the cached copy is older than the
+    TTL, when the files' digest no longer matches (an unchanged file just
+    starts a new TTL period). Each successful reload bumps `version` so
+    downstream caches can key on it.
+    When an up-to-date binary catalog exists next to the JSON file it is
+    memory-mapped instead (see song_binary.py) and get() returns that sequence.
+    """
+
+    def __init__(self, path=None, caching_enabled=None, ttl=None, binary_path=None):
+        self.path = path or SONG_DATABASE_FILE
+        if binary_path is None:
+            binary_path = SONG_BINARY_PATH
+        if binary_path is None:
+            binary_path = os.path.splitext(self.path)[0] + ".bin"
+        self.binary_path = binary_path
+        self.source = None
+        self.caching_enabled = ENABLE_SONG_CACHING if caching_enabled is None else caching_enabled
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._songs = []
+        self._signature = None
+        self._digest = None  # of the files behind the loaded catalog (with a TTL)
+        self._loaded_at = None
+        self.version = 0
+        self._artifacts = {}
+        self._artifacts_lock = threading.RLock()  # builders may use other artifacts
+        self.load_count = 0
+        self.last_load_seconds = None
+        # Cache effectiveness counters (approximate under heavy thread contention)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0  # TTL expiries that found the files unchanged
+        self.artifact_hits = 0
+        self.artifact_builds = 0
+        self._restorers = {}  # name -> (version, key, restore) for artifacts from a snapshot
+
+    def _stat_signature(self):
+        """(mtime, size) of the JSON file and of the binary catalog; None if neither exists."""
+        signature = ()
+        for path in (self.path, self.binary_path):
+            signature += stat_signature(path) or (None, None)
+        return signature if any(value is not None for value in signature) else None
+
+    def _content_digest(self):
+        """SHA-256 over the JSON file and the binary catalog (whichever exist)."""
+        sha = hashlib.sha256()
+        for path in (self.path, self.binary_path):
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        sha.update(chunk)
+            except OSError:
+                pass
+            sha.update(b"\0")
+        return sha.hexdigest()
+
+    def _revalidate(self, signature):
+        """After the TTL: True (and a new TTL period) if the files still hold the loaded catalog."""
+        if not self._songs or signature is None or signature != self._signature:
+            return False
+        digest = self._content_digest()
+        if self._digest is not None and digest != self._digest:
+            return False
+        self._digest = digest  # None after install(): the snapshot was checked against these files
+        self._loaded_at = time.time()
+        return True
+
+    def _is_fresh(self, signature):
+        if not self.caching_enabled or self._signature is None:
+            return False
+        if signature != self._signature:
+            return False
+        if self.ttl and time.time() - self._loaded_at > self.ttl:
+            return False
+        return True
+
+    def get(self):
+        """Returns the current song list, reloading it if the file has changed."""
+        signature = self._stat_signature()
+        if self._is_fresh(signature):
+            self.hits += 1
+            return self._songs
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock.
+            if self._is_fresh(signature):
+                self.hits += 1
+                return self._songs
+            if self.caching_enabled and self._revalidate(signature):
+                self.revalidations += 1
+                return self._songs
+            self.misses += 1
+            self._load(signature)
+            return self._songs
+
+    def _load(self, signature):
+        # Imported here because song_binary builds on the Song record defined above.
+        from song_binary import open_catalog
+
+        started = time.perf_counter()
+        digest = self._content_digest() if self.caching_enabled and self.ttl else None
+        songs = open_catalog(self.binary_path, self.path)
+        source = self.binary_path
+        if songs is None:
+            songs = load_song_database(self.path)
+            source = self.path
+        elapsed = time.perf_counter() - started
+
+        # Keep serving the previous catalog if the new file is broken.
+        if not songs and self._songs:
+            logger.warning(f"keeping catalog version {self.version} after failed reload of '{self.path}'.")
+            self._signature = signature
+            self._loaded_at = time.time()
+            return
+
+        self._songs = songs
+        self.source = source
+        self._signature = signature
+        self._digest = digest
+        self._loaded_at = time.time()
+        self.load_count += 1
+        self.last_load_seconds = elapsed
+        if songs:
+            self.version += 1
+
+    def artifact(self, name, builder, key=None):
+        """
+        Returns builder(songs) for the current catalog, building it at most once
+        per catalog version (indexes, precomputed tables, ...). Passing a `key`
+        also rebuilds the artifact whenever the key changes (e.g. new rules).
+        """
+        self.get()
+        with self._lock:
+            songs, version = self._songs, self.version
+        cached = self._artifacts.get(name)
+        if cached is not None and cached[:2] == (version, key):
+            self.artifact_hits += 1
+            return cached[2]
+
+        with self._artifacts_lock:
+            cached = self._artifacts.get(name)
+            if cached is not None and cached[:2] == (version, key):
+                self.artifact_hits += 1
+                return cached[2]
+            restorer = self._restorers.pop(name, None)
+            if restorer is not None and restorer[:2] == (version, key):
+                value = restorer[2](songs)
+            else:
+                self.artifact_builds += 1
+                value = builder(songs)
+            self._artifacts[name] = (version, key, value)
+            return value
+
+    def install(self, songs, artifacts=None, restorers=None, source=None):
+        """
+        Adopts an already-built catalog (e.g. from a cold-start snapshot) as a new
+        version. `artifacts` maps name -> (key, value); `restorers` maps
+        name -> (key, restore(songs)) for artifacts that are cheap to store but
+        only worth decoding when first requested.
+        """
+        signature = self._stat_signature()
+        with self._lock, self._artifacts_lock:
+            self._songs = songs
+            self.source = source
+            self._signature = signature
+            self._digest = None
+            self._loaded_at = time.time()
+            self.load_count += 1
+            self.last_load_seconds = None
+            self.version += 1
+            self._artifacts = {name: (self.version, key, value) for name, (key, value) in (artifacts or {}).items()}
+            self._restorers = {name: (self.version, key, restore) for name, (key, restore) in (restorers or {}).items()}
+
+    def info(self):
+        """Returns a JSON-serializable summary of the cached catalog."""
+        return {
+            "path": self.path,
+            "caching_enabled": self.caching_enabled,
+            "ttl_seconds": self.ttl,
+            "binary_path": self.binary_path or None,
+            "source": self.source,
+            "memory_mapped": self.source is not None and self.source == self.binary_path,
+            "version": self.version,
+            "song_count": len(self._songs),
+            "load_count": self.load_count,
+            "last_load_ms": round(self.last_load_seconds * 1000, 3) if self.last_load_seconds is not None else None,
+            "loaded_at": self._loaded_at,
+            "file_signature": list(self._signature) if self._signature else None,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "revalidations": self.revalidations,
+            "artifact_hits": self.artifact_hits,
+            "artifact_builds": self.artifact_builds,
+            "artifacts": sorted(name for name, cached in self._artifacts.items() if cached[0] == self.version),
+        }
+
+
+_catalog = SongCatalog()
+
+def get_song_catalog():
+    """
+    Returns the song list from the process-wide catalog cache.
+    Use this instead of load_song_database() on request paths.
+    """
+    return _catalog.get()
+
+def get_catalog_signature():
+    """
+    (mtime, size) signature of the files behind the process-wide catalog, after
+    revalidating it. Unlike `version` it is the same in every worker on a host.
+    """
+    _catalog.get()
+    return _catalog._signature
+
+def get_catalog_artifact(name, builder, key=None):
+    """
+    Returns a derived structure (e.g. a song index) built from the current catalog.
+    It is cached until the catalog is reloaded or `key` changes.
+    """
+    return _catalog.artifact(name, builder, key)
+
+def install_catalog(songs, artifacts=None, restorers=None, source=None):
+    """Makes `songs` (and prebuilt artifacts) the process-wide catalog; see SongCatalog.install()."""
+    _catalog.install(songs, artifacts, restorers, source)
+
+def get_catalog_info():
+    """Returns version/load-time information about the process-wide catalog."""
+    return _catalog.info()
+
 # Example of how you might use this (not part of the main app flow yet):
 if __name__ == "__main__":
     song_db = load_song_database()
     if song_db:
-        print(f"\nFirst song in DB: {song_db[0]['title']} by {song_db[0]['artist']}")
\ No newline at end of file
+        print(f"\nFirst song in DB: {song_db[0]['title']} by {song_db[0]['artist']}")
@@ -101,24 +101,41 @@ def calculate_match_score(song, desired_profile):
     return score, matched
 
 
-def find_matching_songs(song_database, desired_profile, top_n=3):
+def match_result(song, score, criteria):
+    """The response dict for one recommended song: its catalog fields plus the match details."""
+    result = song.to_dict() if hasattr(song, "to_dict") else dict(song)
+    result["match_score"] = score
+    result["matched_criteria"] = list(criteria)
+    return result
+
+
+def find_matching_songs(song_database, desired_profile, top_n=3, song_index=None):
     """
     Returns the top_n songs (with added 'match_score' and 'matched_criteria') sorted by descending score.
+
+    Scoring only keeps (song, score, criteria) references; response dicts are built
+    for the returned songs alone. If a compiled `song_index` (see song_index.py) is
+    given, scoring runs against the index; results are identical to the scan.
     """
     if not song_database or not desired_profile:
         return []
 
+    if song_index is not None and isinstance(top_n, int) and top_n >= 0:
+        results = []
+        for row, pts in song_index.top_matches(desired_profile, top_n):
+            song = song_index.songs[row]
+            _, crit = calculate_match_score(song, desired_profile)
+            results.append(match_result(song, pts, crit))
+        return results
+
     scored = []
     for song in song_database:
         pts, crit = calculate_match_score(song, desired_profile)
         if pts > 0:
-            s = song.copy()
-            s["match_score"] = pts
-            s["matched_criteria"] = crit
-            scored.append(s)
+            scored.append((song, pts, crit))
 
-    scored.sort(key=lambda x: x["match_score"], reverse=True)
-    return scored[:top_n]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return [match_result(song, pts, crit) for song, pts, crit in scored[:top_n]]
 
 # def find_matching_songs(song_database, desired_profile, top_n=3):
 #     """
@@ -0,0 +1,197 @@
+"""
+callback_delivery against a local stub receiver (http.server on 127.0.0.1).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import callback_delivery
+from callback_delivery import CallbackDispatcher, deliver_callback, is_valid_callback_url, sign_body
+
+
+class StubReceiver:
+    """Records every POST and answers with the queued status codes (then 200)."""
+
+    def __init__(self):
+        self.requests = []  # (monotonic time, headers, body bytes)
+        self.statuses = []
+        self.release = threading.Event()  # answers wait for it when `block` is set
+        self.block = False
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                receiver.requests.append((time.monotonic(), dict(self.headers), body))
+                if receiver.block:
+                    receiver.release.wait(10)
+                self.send_response(receiver.statuses.pop(0) if receiver.statuses else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    monkeypatch.setattr(callback_delivery, "CALLBACK_ALLOWED_HOSTS", {"127.0.0.1"})
+    stub = StubReceiver()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def make_dispatcher(tmp_path):
+    dispatchers = []
+
+    def make(**kwargs):
+        options = dict(secret="", timeout=5, workers=2, per_host=2, max_attempts=4, backoff_base=0.05,
+                       backoff_max=1, dead_letter_path=str(tmp_path / "dead.jsonl"),
+                       path=str(tmp_path / "jobs.sqlite3"))
+        options.update(kwargs)
+        dispatcher = CallbackDispatcher(**options)
+        dispatchers.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher.stop(timeout=2)
+
+
+def read_dead_letters(tmp_path):
+    path = tmp_path / "dead.jsonl"
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_body_is_signed_with_hmac(receiver, make_dispatcher):
+    dispatcher = make_dispatcher(secret="s3cret")
+    dispatcher.submit(receiver.url, {"job_id": "j1", "status": "done"}, delivery_id="j1")
+
+    assert wait_until(lambda: dispatcher.stats()["delivered"] == 1)
+    _, headers, body = receiver.requests[0]
+    assert json.loads(body) == {"job_id": "j1", "status": "done"}
+    assert headers["X-Webhook-Id"] == "j1"
+    timestamp = int(headers["X-Webhook-Timestamp"])
+    assert abs(timestamp - time.time()) < 60
+    assert headers["X-Webhook-Signature"] == "sha256=" + sign_body(body, "s3cret", timestamp)
+
+
+def test_no_signature_without_secret(receiver, make_dispatcher):
+    dispatcher = make_dispatcher()
+    dispatcher.submit(receiver.url, {"status": "done"})
+
+    assert wait_until(lambda: dispatcher.stats()["delivered"] == 1)
+    _, headers, _ = receiver.requests[0]
+    assert "X-Webhook-Signature" not in headers
+
+
+@pytest.mark.parametrize("status", [500, 503, 429])
+def test_retryable_status_is_retried_with_backoff(receiver, make_dispatcher, status):
+    receiver.statuses = [status, status]
+    dispatcher = make_dispatcher(backoff_base=0.2)
+    dispatcher.submit(receiver.url, {"status": "done"})
+
+    assert wait_until(lambda: dispatcher.stats()["delivered"] == 1)
+    times = [t for t, _, _ in receiver.requests]
+    assert len(times) == 3
+    # Backoff is half fixed, half jitter: at least 0.1 s, then at least 0.2 s.
+    assert times[1] - times[0] >= 0.1
+    assert times[2] - times[1] >= 0.2
+    assert wait_until(lambda: dispatcher.stats()["stored"] == 0)
+
+
+@pytest.mark.parametrize("status", [400, 404, 410])
+def test_other_client_errors_are_not_retried(receiver, make_dispatcher, tmp_path, status):
+    receiver.statuses = [status]
+    dispatcher = make_dispatcher()
+    dispatcher.submit(receiver.url, {"status": "done"}, delivery_id="j2")
+
+    assert wait_until(lambda: dispatcher.stats()["dead_lettered"] == 1)
+    time.sleep(0.2)
+    assert len(receiver.requests) == 1
+    [record] = read_dead_letters(tmp_path)
+    assert record["attempts"] == 1
+    assert record["last_error"] == f"HTTP {status}"
+
+
+def test_dead_letter_after_last_attempt(receiver, make_dispatcher, tmp_path):
+    receiver.statuses = [500] * 10
+    dispatcher = make_dispatcher(max_attempts=3)
+    dispatcher.submit(receiver.url, {"job_id": "j3", "status": "done"}, delivery_id="j3")
+
+    assert wait_until(lambda: dispatcher.stats()["dead_lettered"] == 1)
+    assert len(receiver.requests) == 3
+    [record] = read_dead_letters(tmp_path)
+    assert record["delivery_id"] == "j3"
+    assert record["url"] == receiver.url
+    assert record["attempts"] == 3
+    assert record["last_error"] == "HTTP 500"
+    assert record["payload"] == {"job_id": "j3", "status": "done"}
+    assert wait_until(lambda: dispatcher.stats()["stored"] == 0)
+
+
+def test_deliver_callback_does_not_block(receiver, make_dispatcher, monkeypatch):
+    receiver.block = True  # the receiver holds every request until released
+    dispatcher = make_dispatcher()
+    monkeypatch.setattr(callback_delivery, "_dispatcher", dispatcher)
+
+    started = time.monotonic()
+    for i in range(5):
+        deliver_callback(receiver.url, {"n": i})
+    assert time.monotonic() - started < 0.5
+
+    assert wait_until(lambda: len(receiver.requests) == 2)  # per_host caps concurrent sends
+    receiver.release.set()
+    assert wait_until(lambda: dispatcher.stats()["delivered"] == 5)
+
+
+def test_scheduled_retry_survives_restart(receiver, make_dispatcher):
+    receiver.statuses = [503]
+    first = make_dispatcher(backoff_base=2)
+    first.submit(receiver.url, {"status": "done"}, delivery_id="j4")
+    assert wait_until(lambda: len(receiver.requests) == 1)
+    assert wait_until(lambda: first.stats()["scheduled"] == 1)
+    first.stop(timeout=2)  # the retry is due in 1-2 s
+
+    second = make_dispatcher(backoff_base=2)
+    second.start()
+    assert wait_until(lambda: second.stats()["delivered"] == 1, timeout=5)
+    assert len(receiver.requests) == 2
+    assert receiver.requests[1][1]["X-Webhook-Id"] == "j4"
+    assert wait_until(lambda: second.stats()["stored"] == 0)
+
+
+def test_internal_callback_urls_are_refused(monkeypatch):
+    monkeypatch.setattr(callback_delivery, "CALLBACK_ALLOWED_HOSTS", set())
+    for url in ("http://127.0.0.1/hook", "http://localhost/hook", "http://169.254.169.254/latest/meta-data",
+                "http://10.1.2.3/hook", "http://[::1]/hook", "http://[::ffff:192.168.0.1]/hook", "ftp://example.com/"):
+        assert not is_valid_callback_url(url), url
+    assert is_valid_callback_url("http://8.8.8.8/hook")
+
+    monkeypatch.setattr(callback_delivery, "CALLBACK_ALLOWED_HOSTS", {"127.0.0.1"})
+    assert is_valid_callback_url("http://127.0.0.1:8080/hook")
@@ -0,0 +1,54 @@
+"""
+One stat per hot-reloaded file per request.
+"""
+import collections
+import os
+
+import file_signatures
+import recommend
+from file_signatures import forget_signature, signature_scope, stat_signature
+from recommendation_pipeline import get_batch_song_recommendations, get_song_recommendations
+
+
+def count_stats(monkeypatch):
+    calls = collections.Counter()
+    real_stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        calls[path] += 1
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(file_signatures.os, "stat", counting_stat)
+    return calls
+
+
+def test_scope_reuses_signatures(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    path.write_text("{}")
+    calls = count_stats(monkeypatch)
+
+    with signature_scope():
+        first = stat_signature(str(path))
+        path.write_text("{\"changed\": true}")
+        assert stat_signature(str(path)) == first
+        with signature_scope():
+            assert stat_signature(str(path)) == first
+        forget_signature(str(path))
+        assert stat_signature(str(path)) != first
+    assert calls[str(path)] == 2
+    stat_signature(str(path))
+    assert calls[str(path)] == 3
+
+
+def test_pipeline_stats_each_file_once_per_request(monkeypatch):
+    replay = recommend.FULL_REPLAY_DATA_SAMPLE
+    player_id = replay["teams"]["blue"]["players"][0]["id"]
+    get_song_recommendations(replay, player_id)  # load everything first
+    calls = count_stats(monkeypatch)
+
+    assert get_song_recommendations(replay, player_id)["success"]
+    assert calls and max(calls.values()) == 1
+
+    calls.clear()
+    assert get_batch_song_recommendations(replay)["success"]
+    assert calls and max(calls.values()) == 1
@@ -0,0 +1,29 @@
+"""
+Stage timings recorded outside Flask (batch workers, the Vercel handler).
+"""
+import json
+
+import instrumentation
+import recommend
+
+
+def test_batch_path_keeps_pending_samples_bounded(monkeypatch):
+    monkeypatch.setattr(instrumentation, "MAX_PENDING_SAMPLES", 50)
+    line = json.dumps(recommend.FULL_REPLAY_DATA_SAMPLE)
+
+    for i in range(40):  # about 25 stage samples per replay, no request hooks
+        source, result = recommend.process_batch_replay(f"stdin:{i}", None, line, None, 3)
+        assert result["success"], result
+
+    assert len(instrumentation._pending_samples) <= 50
+    folded = sum(hist.count for hist in instrumentation._registry.stage_latency.values())
+    assert folded + len(instrumentation._pending_samples) >= 40 * 6
+
+
+def test_render_prometheus_folds_everything():
+    clock = instrumentation.StageClock()
+    clock.mark("test_stage")
+
+    text = instrumentation.render_prometheus()
+    assert not instrumentation._pending_samples
+    assert 'stage="test_stage"' in text
@@ -0,0 +1,49 @@
+"""
+JobQueue start-up: nothing happens on import or construction, the first
+submit() opens the file and starts the workers.
+"""
+import os
+import subprocess
+import sys
+import time
+
+from job_queue import JobQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_submit_creates_the_file_and_starts_workers(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    queue = JobQueue(lambda payload, job_id: {"echo": payload["n"]}, path=str(path), workers=1)
+    assert not path.exists()
+
+    job_id = queue.submit({"n": 7})
+    try:
+        assert path.exists()
+        assert wait_for(lambda: queue.get(job_id)["status"] == "done")
+        assert queue.get(job_id)["result"] == {"echo": 7}
+    finally:
+        queue.stop(timeout=5)
+
+
+def test_importing_the_app_touches_no_job_file(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    env = dict(os.environ, JOB_DB_PATH=str(path), REPLAY_DB_PATH=str(tmp_path / "replays.sqlite3"),
+               WARMUP_ON_IMPORT="false", PYTHONPATH=ROOT)
+    code = ("import threading, app; "
+            "print(sorted(t.name for t in threading.enumerate() if t.name.startswith('job-')))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=str(tmp_path), env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+    assert not path.exists()
+    assert not (tmp_path / "jobs.sqlite3-wal").exists()
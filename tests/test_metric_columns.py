@@ -0,0 +1,114 @@
+"""
+metric_columns against the scalar metrics.py / threshold.py path, on
+replays mixing integer, fractional, zero and missing stats.
+"""
+import copy
+import json
+
+import pytest
+
+import metric_columns
+from benchmark import make_replay
+from extract_data import extract_all_players_data
+from metrics import calculate_game_intensity, calculate_game_outcome, calculate_performance_score, calculate_teamwork_factor
+from recommendation_pipeline import get_batch_song_recommendations, get_song_recommendations
+from threshold import categorize_game_closeness, categorize_intensity, categorize_performance, categorize_teamwork
+
+if metric_columns.np is None:
+    pytest.skip("numpy is not installed", allow_module_level=True)
+
+
+def mixed_replays():
+    replays = [make_replay(seed) for seed in range(20)]
+
+    fractional = make_replay(100)
+    for i, player in enumerate(fractional["teams"]["blue"]["players"]):
+        player["goals"] = 1.5 + i
+        player["saves"] = 0.25
+        player["assists"] = 2.75
+    fractional["teams"]["blue"]["goals"] = 2.5
+    fractional["teams"]["orange"]["goals"] = 2.4
+    replays.append(fractional)
+
+    zero_duration = make_replay(101)
+    zero_duration["duration"] = 0
+    replays.append(zero_duration)
+
+    scoreless = make_replay(102)
+    scoreless["overtime"] = True
+    for team in scoreless["teams"].values():
+        team["goals"] = 0
+        for player in team["players"]:
+            player["goals"] = 0
+            player["shooting_percentage"] = 0
+    replays.append(scoreless)
+
+    sparse = make_replay(103)
+    for player in sparse["teams"]["orange"]["players"]:
+        del player["movement"]
+        del player["shooting_percentage"]
+    replays.append(sparse)
+    return replays
+
+
+def mixed_rows():
+    return [row for replay in mixed_replays() for row in extract_all_players_data(replay).values()]
+
+
+def scalar_scores(row):
+    stats, team = row["player_stats"], row["player_team_stats"]
+    return (
+        calculate_game_intensity(stats, row["game_duration"]),
+        calculate_performance_score(stats),
+        calculate_teamwork_factor(stats, team),
+    )
+
+
+def test_metric_rows_match_scalar_values_and_types():
+    rows = mixed_rows()
+
+    for row, scores in zip(rows, metric_columns.metric_rows(rows)):
+        expected = scalar_scores(row)
+        assert scores == expected
+        assert [type(value) for value in scores] == [type(value) for value in expected]
+
+
+def test_metric_rows_leave_non_numeric_rows_to_the_scalar_path():
+    rows = extract_all_players_data(make_replay(7))
+    rows = list(rows.values())
+    rows[0]["player_stats"]["goals"] = "2"
+
+    scores = metric_columns.metric_rows(rows)
+    assert scores[0] is None
+    assert scores[1:] == [scalar_scores(row) for row in rows[1:]]
+
+
+def test_columns_match_scalar_outcome_and_categories():
+    rows = mixed_rows()
+    columns = metric_columns.player_game_columns(rows)
+    metrics = metric_columns.calculate_metric_columns(columns)
+    codes = metric_columns.categorize_metric_columns(metrics, columns["overtime"])
+
+    intensity = metric_columns.labels(codes["intensity"], metric_columns.LEVEL_LABELS)
+    performance = metric_columns.labels(codes["performance"], metric_columns.LEVEL_LABELS)
+    teamwork = metric_columns.labels(codes["teamwork"], metric_columns.LEVEL_LABELS)
+    closeness = metric_columns.labels(codes["closeness"], metric_columns.CLOSENESS_LABELS)
+    win_status = metric_columns.labels(metrics["win_status"], metric_columns.WIN_STATUS_LABELS)
+    for i, row in enumerate(rows):
+        scores = scalar_scores(row)
+        outcome = calculate_game_outcome(row["player_team_stats"], row["opponent_team_stats"])
+        assert metrics["score_differential"][i] == outcome["score_differential"]
+        assert win_status[i] == outcome["win_status"]
+        assert intensity[i] == categorize_intensity(scores[0])
+        assert performance[i] == categorize_performance(scores[1])
+        assert teamwork[i] == categorize_teamwork(scores[2])
+        assert closeness[i] == categorize_game_closeness(outcome["abs_score_differential"], row["game_overtime"])
+
+
+def test_batch_path_matches_single_player_path():
+    for replay in mixed_replays():
+        batch = get_batch_song_recommendations(copy.deepcopy(replay))
+        assert batch["success"], batch
+        for result in batch["players"]:
+            single = get_song_recommendations(copy.deepcopy(replay), result["player_id"])
+            assert json.dumps(result, sort_keys=True) == json.dumps(single, sort_keys=True)
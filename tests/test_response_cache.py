@@ -0,0 +1,119 @@
+"""
+Response cache keys and generations.
+"""
+import copy
+import os
+import uuid
+
+import pytest
+
+import response_cache
+from recommend import FULL_REPLAY_DATA_SAMPLE
+from response_cache import ResponseCache, SharedResponseCache, recommendation_cache_key
+
+PLAYER_ID = FULL_REPLAY_DATA_SAMPLE["teams"]["blue"]["players"][0]["id"]
+OTHER_PLAYER_ID = FULL_REPLAY_DATA_SAMPLE["teams"]["orange"]["players"][0]["id"]
+
+
+def replay():
+    return copy.deepcopy(FULL_REPLAY_DATA_SAMPLE)
+
+
+def key(data=None, player_id=PLAYER_ID, top_n=3, engine="additive"):
+    return recommendation_cache_key(replay() if data is None else data, player_id, top_n, engine)
+
+
+def test_key_ignores_fields_the_pipeline_does_not_read():
+    data = replay()
+    data["title"] = "Another title"
+    data["map_name"] = "Somewhere else"
+    data["date"] = "2030-01-01T00:00:00Z"
+    data["teams"]["blue"]["players"][0]["camera"] = {"fov": 110}
+    data["teams"]["orange"]["score"] = 1
+    assert key(data) == key()
+
+
+@pytest.mark.parametrize("change", [
+    lambda data: data.update(duration=data["duration"] + 1),
+    lambda data: data.update(overtime=not data.get("overtime")),
+    lambda data: data["teams"]["blue"].update(goals=data["teams"]["blue"]["goals"] + 1),
+    lambda data: data["teams"]["blue"]["players"][0].update(goals=7),
+    lambda data: data["teams"]["orange"]["players"][-1].update(saves=9),
+    lambda data: data["teams"]["blue"]["players"][1]["movement"].update(total_distance=1),
+    lambda data: data["teams"]["blue"]["players"].reverse(),
+])
+def test_key_changes_with_what_the_pipeline_reads(change):
+    data = replay()
+    change(data)
+    assert key(data) != key()
+
+
+def test_key_includes_player_top_n_and_engine():
+    keys = {key(), key(player_id=OTHER_PLAYER_ID), key(top_n=5), key(engine="exact")}
+    assert len(keys) == 4
+    assert key() == key()
+
+
+def test_generation_change_drops_entries():
+    cache = ResponseCache(max_bytes=1 << 20, ttl=60)
+    cache.put("a", {"songs": [1]}, generation=("catalog-1", "rules-1", "cutoffs-1"))
+    assert cache.get("a", generation=("catalog-1", "rules-1", "cutoffs-1")) == {"songs": [1]}
+
+    assert cache.get("a", generation=("catalog-2", "rules-1", "cutoffs-1")) is None
+    assert cache.invalidations == 1
+    assert cache.stats()["entries"] == 0
+    # Going back does not resurrect the old entries either.
+    assert cache.get("a", generation=("catalog-1", "rules-1", "cutoffs-1")) is None
+
+
+def test_hits_are_copies_and_budget_evicts_lru():
+    cache = ResponseCache(max_bytes=1 << 20, ttl=60)
+    cache.put("a", {"songs": [1]})
+    cache.get("a")["songs"].append(2)
+    assert cache.get("a") == {"songs": [1]}
+
+    small = ResponseCache(max_bytes=200, ttl=60)
+    for name in "abc":
+        small.put(name, {"body": name * 80})
+    assert small.get("a") is None
+    assert small.get("c") == {"body": "c" * 80}
+    assert small.evictions >= 1
+
+
+def test_ttl_expires_entries():
+    cache = ResponseCache(max_bytes=1 << 20, ttl=-1)
+    cache.put("a", {"songs": [1]})
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+
+@pytest.fixture
+def shared_cache():
+    if response_cache.fcntl is None:
+        pytest.skip("the shared cache needs fcntl")
+    cache = SharedResponseCache(max_bytes=64 * 1024, ttl=60, name=f"test_cache_{uuid.uuid4().hex[:12]}", slot_bytes=512)
+    yield cache
+    cache.unlink()
+    cache._lock_file.close()
+    os.remove(cache._lock_file.name)
+
+
+def test_shared_cache_generation_change_misses(shared_cache):
+    shared_cache.put("a", {"songs": [1]}, generation=("catalog-1", "rules-1", "cutoffs-1"))
+    assert shared_cache.get("a", generation=("catalog-1", "rules-1", "cutoffs-1")) == {"songs": [1]}
+
+    assert shared_cache.get("a", generation=("catalog-2", "rules-1", "cutoffs-1")) is None
+    assert shared_cache.invalidations == 1
+    shared_cache.put("a", {"songs": [2]}, generation=("catalog-2", "rules-1", "cutoffs-1"))
+    assert shared_cache.get("a", generation=("catalog-2", "rules-1", "cutoffs-1")) == {"songs": [2]}
+    assert shared_cache.stats()["entries"] == 1
+
+
+def test_shared_cache_is_visible_to_other_attachments(shared_cache):
+    other = SharedResponseCache(max_bytes=64 * 1024, ttl=60, name=shared_cache.name, slot_bytes=512)
+    shared_cache.put("a", {"songs": [1]}, generation="g")
+    assert other.get("a", generation="g") == {"songs": [1]}
+
+    other.clear()
+    assert shared_cache.get("a", generation="g") is None
+    assert not shared_cache.put("big", {"body": "x" * 1024}, generation="g")  # larger than a slot
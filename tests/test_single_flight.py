@@ -0,0 +1,110 @@
+"""
+SingleFlight: one computation per key in flight, shared results and errors.
+"""
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(flights, key, fn, callers, timeout=None):
+    """Starts `callers` threads on flights.do(key, fn); returns their outcomes in finish order."""
+    outcomes = []
+    lock = threading.Lock()
+
+    def call():
+        try:
+            outcome = flights.do(key, fn, timeout)
+        except Exception as e:
+            outcome = e
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flights, key, count):
+    while True:
+        with flights._lock:
+            call = flights._calls.get(key)
+            if call is not None and call.waiters >= count:
+                return
+        time.sleep(0.001)
+
+
+def test_identical_calls_run_once_and_get_copies():
+    flights = SingleFlight(timeout=10)
+    release = threading.Event()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        release.wait(10)
+        return {"songs": [1]}
+
+    threads, outcomes = run_concurrently(flights, "key", compute, 5)
+    wait_for_waiters(flights, "key", 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    assert sorted(shared for _, shared in outcomes) == [False, True, True, True, True]
+    results = [result for result, _ in outcomes]
+    assert all(result == {"songs": [1]} for result in results)
+    assert len({id(result) for result in results}) == 5
+    assert flights.stats()["coalesced"] == 4
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_waiter():
+    flights = SingleFlight(timeout=10)
+    release = threading.Event()
+
+    def compute():
+        release.wait(10)
+        raise ValueError("catalog failed")
+
+    threads, outcomes = run_concurrently(flights, "key", compute, 3)
+    wait_for_waiters(flights, "key", 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(outcomes) == 3
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert flights.errors == 1
+    # The failed flight is gone; the next call computes again.
+    assert flights.do("key", lambda: "ok") == ("ok", False)
+
+
+def test_waiter_times_out_and_computes_itself():
+    flights = SingleFlight(timeout=10)
+    release = threading.Event()
+    leader_threads, _ = run_concurrently(flights, "key", lambda: release.wait(10) and "leader", 1)
+    while not flights._calls:
+        time.sleep(0.001)
+
+    assert flights.do("key", lambda: "own", timeout=0.05) == ("own", False)
+    assert flights.timeouts == 1
+    release.set()
+    leader_threads[0].join()
+
+
+def test_different_keys_do_not_wait():
+    flights = SingleFlight(timeout=10)
+    release = threading.Event()
+    threads, _ = run_concurrently(flights, "a", lambda: release.wait(10), 1)
+    while not flights._calls:
+        time.sleep(0.001)
+
+    assert flights.do("b", lambda: 2) == (2, False)
+    release.set()
+    threads[0].join()
+    with pytest.raises(KeyError):
+        flights.do("c", lambda: {}["missing"])
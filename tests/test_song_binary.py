@@ -0,0 +1,81 @@
+"""
+song_binary round trip: build songs.bin from songs.json, reopen it and
+compare every record with the Song records parsed from the JSON.
+"""
+import json
+
+import pytest
+
+from benchmark import make_catalog
+from song_binary import CatalogFormatError, MappedCatalog, build_binary_catalog, open_catalog
+from song_management import song_records
+
+
+def write_catalog(path):
+    songs = make_catalog(300, seed=3)
+    songs[0].pop("bpm")
+    songs[1].pop("energy")
+    songs[2].pop("moods")
+    songs[3]["themes"] = []
+    songs[4]["moods"] = ["Happy", "Happy", "Calm"]
+    songs[5]["title"] = "Ünïcode — Title"
+    songs[6]["song_id"] = 12345
+    songs[7]["label"] = {"name": "Extra field", "year": 1999}
+    path.write_text(json.dumps(songs), encoding="utf-8")
+    return songs
+
+
+def fields(song):
+    return {name: getattr(song, name) for name in song.__slots__}
+
+
+def test_build_and_reopen_matches_json(tmp_path):
+    json_path = tmp_path / "songs.json"
+    bin_path = tmp_path / "songs.bin"
+    songs = song_records(write_catalog(json_path))
+
+    assert build_binary_catalog(str(json_path), str(bin_path)) == len(songs)
+    catalog = open_catalog(str(bin_path), str(json_path))
+    assert catalog is not None
+    assert len(catalog) == len(songs)
+    for expected, mapped in zip(songs, catalog):
+        assert fields(mapped) == fields(expected)
+        assert mapped.to_dict() == expected.to_dict()
+    assert fields(catalog[-1]) == fields(songs[-1])
+    with pytest.raises(IndexError):
+        catalog[len(songs)]
+
+
+def test_postings_match_records(tmp_path):
+    json_path = tmp_path / "songs.json"
+    bin_path = tmp_path / "songs.bin"
+    songs = song_records(write_catalog(json_path))
+    build_binary_catalog(str(json_path), str(bin_path))
+    catalog = MappedCatalog(str(bin_path))
+
+    for field in ("moods", "themes"):
+        for label, rows in catalog.postings(field).items():
+            assert list(rows) == [row for row, song in enumerate(songs) if label in (song.get(field) or ())]
+    assert list(catalog.columns["bpm_order"]) == [row for _, row in sorted(
+        (song.bpm or 0, row) for row, song in enumerate(songs))]
+
+
+def test_stale_or_corrupt_binary_falls_back(tmp_path):
+    json_path = tmp_path / "songs.json"
+    bin_path = tmp_path / "songs.bin"
+    write_catalog(json_path)
+    build_binary_catalog(str(json_path), str(bin_path))
+
+    songs = json.loads(json_path.read_text(encoding="utf-8"))
+    songs[0]["title"] = "Changed"
+    json_path.write_text(json.dumps(songs), encoding="utf-8")
+    assert open_catalog(str(bin_path), str(json_path)) is None
+
+    build_binary_catalog(str(json_path), str(bin_path))
+    data = bytearray(bin_path.read_bytes())
+    data[20] ^= 0xFF  # inside the header
+    bin_path.write_bytes(bytes(data))
+    with pytest.raises(CatalogFormatError):
+        MappedCatalog(str(bin_path))
+    assert open_catalog(str(bin_path), str(json_path)) is None
+    assert open_catalog(str(tmp_path / "missing.bin"), str(json_path)) is None
@@ -0,0 +1,55 @@
+"""
+SongCatalog reloads: versions only change when the catalog does.
+"""
+import json
+import os
+
+from song_management import SongCatalog
+
+
+def write_songs(path, titles, mtime_ns=None):
+    songs = [{"song_id": i, "title": title, "artist": "A", "bpm": 100, "energy": "Low", "moods": ["Chill"], "themes": ["Love"]}
+             for i, title in enumerate(titles, start=1)]
+    path.write_text(json.dumps(songs))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_ttl_expiry_of_unchanged_file_keeps_version(tmp_path):
+    path = tmp_path / "songs.json"
+    write_songs(path, ["One", "Two"])
+    catalog = SongCatalog(path=str(path), caching_enabled=True, ttl=60, binary_path="")
+    songs = catalog.get()
+    version = catalog.version
+
+    catalog._loaded_at -= 120  # TTL ran out
+    assert catalog.get() is songs
+    assert catalog.version == version
+    assert catalog.load_count == 1
+    assert catalog.revalidations == 1
+
+
+def test_ttl_expiry_catches_in_place_edit(tmp_path):
+    path = tmp_path / "songs.json"
+    write_songs(path, ["One", "Two"], mtime_ns=10**18)
+    catalog = SongCatalog(path=str(path), caching_enabled=True, ttl=60, binary_path="")
+    catalog.get()
+    version = catalog.version
+
+    write_songs(path, ["Uno", "Two"], mtime_ns=10**18)  # same size and mtime
+    assert catalog.get()[0].title == "One"  # within the TTL the stat signature decides
+    catalog._loaded_at -= 120
+    assert catalog.get()[0].title == "Uno"
+    assert catalog.version == version + 1
+
+
+def test_changed_signature_reloads(tmp_path):
+    path = tmp_path / "songs.json"
+    write_songs(path, ["One"])
+    catalog = SongCatalog(path=str(path), caching_enabled=True, ttl=60, binary_path="")
+    catalog.get()
+    version = catalog.version
+
+    write_songs(path, ["One", "Two", "Three"])
+    assert len(catalog.get()) == 3
+    assert catalog.version == version + 1
@@ -0,0 +1,99 @@
+"""
+The compiled song indexes against the plain find_matching_songs scan: same
+songs, same scores and the same order for ties.
+"""
+import itertools
+import json
+
+import pytest
+
+import song_index
+from benchmark import make_catalog
+from rule_engine import determine_desired_song_attributes
+from song_binary import MappedCatalog, compile_catalog
+from song_index import NumpySongIndex, PostingsSongIndex, build_song_index, np
+from song_management import song_records
+from song_matcher import find_matching_songs
+
+LEVELS = ("Low", "Medium", "High")
+OUTCOMES = ("win", "loss", "draw")
+CLOSENESS = ("Very Close / Overtime", "Moderately Close", "Not Close")
+
+
+def tied_catalog():
+    songs = make_catalog(400, seed=7)
+    # Copies that score like the originals: only catalog order can break these ties.
+    copies = [dict(song, title=f"{song['title']} (copy)") for song in songs[:40] + songs[100:120]]
+    return song_records(songs + copies)
+
+
+def rule_profiles():
+    profiles = {}
+    for i, p, t, w, c in itertools.product(LEVELS, LEVELS, LEVELS, OUTCOMES, CLOSENESS):
+        profile = determine_desired_song_attributes(i, p, t, {"win_status": w}, c)
+        profiles.setdefault(json.dumps(profile, sort_keys=True), profile)
+    profiles = list(profiles.values())
+    profiles.append({"bpm": "90-130", "energy": "Medium", "moods": ["Happy", "Calm"], "themes": ["Love"]})
+    profiles.append({"bpm": "not a range", "energy": "Unknown", "moods": [], "themes": None})
+    return profiles
+
+
+def index_builders(tmp_path):
+    builders = {"postings": PostingsSongIndex}
+    if np is not None:
+        builders["numpy"] = NumpySongIndex
+
+    def mapped(index_class):
+        def build(songs):
+            path = tmp_path / "songs.bin"
+            path.write_bytes(compile_catalog(songs))
+            return index_class.from_mapped(MappedCatalog(str(path)))
+        return build
+
+    builders["postings_mapped"] = mapped(PostingsSongIndex)
+    if np is not None:
+        builders["numpy_mapped"] = mapped(NumpySongIndex)
+    return builders
+
+
+def test_ties_are_present():
+    songs = tied_catalog()
+    top = find_matching_songs(songs, rule_profiles()[0], top_n=20)
+    assert len({song["match_score"] for song in top}) < len(top)
+
+
+@pytest.mark.parametrize("name", ["numpy", "postings", "numpy_mapped", "postings_mapped"])
+def test_index_matches_plain_scan(name, tmp_path):
+    builders = index_builders(tmp_path)
+    if name not in builders:
+        pytest.skip("numpy is not installed")
+    songs = tied_catalog()
+    index = builders[name](songs)
+
+    for profile in rule_profiles():
+        for top_n in (1, 3, 10, 50, len(songs) + 5):
+            expected = find_matching_songs(songs, profile, top_n=top_n)
+            assert find_matching_songs(songs, profile, top_n=top_n, song_index=index) == expected
+
+
+def test_empty_catalog_and_zero_top_n(tmp_path):
+    profile = rule_profiles()[0]
+    for build in index_builders(tmp_path).values():
+        assert build([]).top_matches(profile, 3) == []
+        assert build(tied_catalog()).top_matches(profile, 0) == []
+
+
+def test_song_index_setting_selects_the_index(monkeypatch, tmp_path):
+    songs = tied_catalog()
+    path = tmp_path / "songs.bin"
+    path.write_bytes(compile_catalog(songs))
+
+    monkeypatch.setattr(song_index, "SONG_INDEX", "postings")
+    assert type(build_song_index(songs)) is PostingsSongIndex
+    assert type(build_song_index(MappedCatalog(str(path)))) is PostingsSongIndex
+
+    monkeypatch.setattr(song_index, "SONG_INDEX", "auto")
+    expected = PostingsSongIndex if np is None else NumpySongIndex
+    assert type(build_song_index(songs)) is expected
+    monkeypatch.setattr(song_index, "SONG_INDEX", "numpy")
+    assert type(build_song_index(songs)) is expected
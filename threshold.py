@@ -1,3 +1,12 @@
+import json
+import logging
+import os
+import threading
+
+from file_signatures import forget_signature, stat_signature
+
+logger = logging.getLogger(__name__)
+
 # --- Threshold Definitions ---
 # These are initial guesses and WILL need tuning based on observed metric ranges!
 # For Intensity: Rocket League avg speed is ~1300-1500 uu/s. Supersonic is ~2200 uu/s.
@@ -23,27 +32,153 @@ TEAMWORK_THRESHOLD_LOW = 0.2
 SCORE_DIFFERENTIAL_CLOSE = 1 # Game decided by 1 goal or less (e.g. OT)
 SCORE_DIFFERENTIAL_MODERATE = 2 # Game decided by 2 goals
 
+# --- Tuned Cutoffs ---
+# metric_sketches.py can recompute the High/Low cutoffs above as percentiles of
+# live traffic and save them to THRESHOLDS_PATH. refresh_thresholds() re-reads
+# that file whenever it changes (like rules.json), so every worker's
+# categorize_* functions pick the new cutoffs up. The constants above stay the
+# defaults; the cutoffs in use are one immutable mapping, metric -> (low, high),
+# swapped in by a single assignment, so a request never sees half of an update.
+# Callers categorizing several metrics take one snapshot (current_cutoffs())
+# and pass it to each categorize_* call. The recommendation table is keyed by
+# the categories, not the raw metrics, so it stays valid; anything caching
+# finished responses should key on get_thresholds_signature(). Deleting the
+# file restores the defaults.
+THRESHOLDS_FILE = os.environ.get("THRESHOLDS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json"))  # empty disables it
+
+TUNABLE_THRESHOLDS = {
+    "intensity": ("INTENSITY_THRESHOLD_LOW", "INTENSITY_THRESHOLD_HIGH"),
+    "performance": ("PERFORMANCE_THRESHOLD_LOW", "PERFORMANCE_THRESHOLD_HIGH"),
+    "teamwork": ("TEAMWORK_THRESHOLD_LOW", "TEAMWORK_THRESHOLD_HIGH"),
+}
+DEFAULT_THRESHOLDS = {
+    metric: {"low": globals()[low], "high": globals()[high]} for metric, (low, high) in TUNABLE_THRESHOLDS.items()
+}
+THRESHOLDS_VERSION = 0  # bumped whenever the cutoffs change
+
+_thresholds_lock = threading.Lock()
+_thresholds_signature = None
+_cutoffs = {metric: (values["low"], values["high"]) for metric, values in DEFAULT_THRESHOLDS.items()}  # never mutated
+
+
+def current_cutoffs():
+    """Snapshot of the cutoffs in use: {"intensity": (low, high), ...}. Treat as read-only."""
+    return _cutoffs
+
+
+def current_thresholds():
+    """{"intensity": {"low": ..., "high": ...}, ...} as currently used by the categorize functions."""
+    return {metric: {"low": low, "high": high} for metric, (low, high) in _cutoffs.items()}
+
+
+def get_thresholds_signature():
+    """The cutoffs in use (after applying any change to THRESHOLDS_PATH) as a flat tuple."""
+    refresh_thresholds()
+    return tuple(bound for pair in _cutoffs.values() for bound in pair)
+
+
+def get_thresholds_info():
+    """Current and default cutoffs, their version and the file they are tuned from."""
+    return {
+        "current": current_thresholds(),
+        "defaults": DEFAULT_THRESHOLDS,
+        "version": THRESHOLDS_VERSION,
+        "path": THRESHOLDS_FILE or None,
+    }
+
+
+def _checked_thresholds(cutoffs):
+    """Merges `cutoffs` over the defaults; raises ValueError unless every low < high."""
+    merged = {metric: dict(values) for metric, values in DEFAULT_THRESHOLDS.items()}
+    for metric, values in (cutoffs or {}).items():
+        if metric not in merged or not isinstance(values, dict):
+            raise ValueError(f"unknown threshold '{metric}'")
+        for bound, value in values.items():
+            if bound not in ("low", "high") or isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"invalid {metric} threshold {bound}={value!r}")
+            merged[metric][bound] = value
+    for metric, values in merged.items():
+        if not values["low"] < values["high"]:
+            raise ValueError(f"{metric} low threshold ({values['low']}) must be below high ({values['high']})")
+    return merged
+
+
+def set_thresholds(cutoffs):
+    """
+    Replaces the tunable cutoffs in this process ({"teamwork": {"high": 0.4}, ...};
+    anything not given reverts to the default). Returns the cutoffs now in use.
+    """
+    global THRESHOLDS_VERSION, _cutoffs
+    merged = _checked_thresholds(cutoffs)
+    _cutoffs = {metric: (values["low"], values["high"]) for metric, values in merged.items()}
+    THRESHOLDS_VERSION += 1
+    return merged
+
+
+def _thresholds_file_signature():
+    return stat_signature(THRESHOLDS_FILE)
+
+
+def refresh_thresholds():
+    """Applies THRESHOLDS_PATH if it changed since the last call; a broken file keeps the current cutoffs."""
+    global _thresholds_signature
+    if not THRESHOLDS_FILE:
+        return
+    signature = _thresholds_file_signature()
+    if signature == _thresholds_signature:
+        return
+    with _thresholds_lock:
+        if signature == _thresholds_signature:
+            return
+        _thresholds_signature = signature
+        if signature is None:
+            set_thresholds({})
+            return
+        try:
+            with open(THRESHOLDS_FILE, "r", encoding="utf-8") as f:
+                set_thresholds(json.load(f).get("thresholds"))
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"could not apply thresholds from '{THRESHOLDS_FILE}': {e}")
+
+
+def save_thresholds(cutoffs, source=None):
+    """Writes `cutoffs` to THRESHOLDS_PATH (picked up by every worker) and applies them here."""
+    if not THRESHOLDS_FILE:
+        raise ValueError("THRESHOLDS_PATH is empty; tuned thresholds cannot be saved")
+    merged = _checked_thresholds(cutoffs)
+    tmp_path = f"{THRESHOLDS_FILE}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"thresholds": merged, "source": source}, f, indent=2)
+    os.replace(tmp_path, THRESHOLDS_FILE)
+    forget_signature(THRESHOLDS_FILE)
+    refresh_thresholds()
+    return current_thresholds()
+
 # --- Categorization Functions ---
-def categorize_intensity(intensity_score):
-    if intensity_score >= INTENSITY_THRESHOLD_HIGH:
+# `cutoffs` is a current_cutoffs() snapshot; None reads the cutoffs in use now.
+def categorize_intensity(intensity_score, cutoffs=None):
+    low, high = (cutoffs or _cutoffs)["intensity"]
+    if intensity_score >= high:
         return "High"
-    elif intensity_score <= INTENSITY_THRESHOLD_LOW:
+    elif intensity_score <= low:
         return "Low"
     else:
         return "Medium"
 
-def categorize_performance(performance_score):
-    if performance_score >= PERFORMANCE_THRESHOLD_HIGH:
+def categorize_performance(performance_score, cutoffs=None):
+    low, high = (cutoffs or _cutoffs)["performance"]
+    if performance_score >= high:
         return "High"
-    elif performance_score <= PERFORMANCE_THRESHOLD_LOW:
+    elif performance_score <= low:
         return "Low"
     else:
         return "Medium"
 
-def categorize_teamwork(teamwork_factor):
-    if teamwork_factor >= TEAMWORK_THRESHOLD_HIGH:
+def categorize_teamwork(teamwork_factor, cutoffs=None):
+    low, high = (cutoffs or _cutoffs)["teamwork"]
+    if teamwork_factor >= high:
         return "High"
-    elif teamwork_factor <= TEAMWORK_THRESHOLD_LOW:
+    elif teamwork_factor <= low:
         return "Low"
     else:
         return "Medium"
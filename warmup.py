@@ -0,0 +1,98 @@
+"""
+Startup warmup and readiness state.
+
+app.py runs its warmup steps (catalog load, index and table builds, a canary
+recommendation) before the first request instead of inside it. Under
+`gunicorn --preload` (see gunicorn.conf.py) that happens once in the master
+process; the warmed heap is then frozen with gc.freeze() so the collector
+never touches those objects again and forked workers keep sharing their
+pages instead of copying them.
+
+Importing app.py only warms up when WARMUP_ON_IMPORT is set, which
+gunicorn.conf.py does; scripts, tests and `flask run` import it cheaply and
+warm up on the first GET /ready instead.
+"""
+import gc
+import os
+import threading
+import time
+import traceback
+
+WARMUP_ON_IMPORT = os.environ.get("WARMUP_ON_IMPORT", "false").strip().lower() not in ("0", "false", "no", "off")
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", 30))  # between attempts after a failure
+
+
+class Warmup:
+    """
+    Runs named warmup steps once and remembers whether they all succeeded.
+    A step is a callable that returns something truthy on success.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self.attempts = 0
+        self.started_at = None
+        self.finished_at = None
+        self.step_ms = {}
+        self.error = None
+        self.frozen_objects = None
+
+    def run(self, steps, freeze=True):
+        """Runs `steps` [(name, callable), ...]; returns True once warmup has succeeded."""
+        with self._lock:
+            if self.ready:
+                return True
+            self.attempts += 1
+            self.started_at = time.time()
+            self.finished_at = None
+            self.step_ms = {}
+            self.error = None
+            for name, step in steps:
+                started = time.perf_counter()
+                try:
+                    ok = step()
+                except Exception as e:
+                    traceback.print_exc()
+                    ok, self.error = False, f"{name}: {e}"
+                self.step_ms[name] = round((time.perf_counter() - started) * 1000, 3)
+                if not ok:
+                    self.error = self.error or f"{name} failed"
+                    print(f"Error: warmup step '{name}' failed; the service will report not ready.")
+                    break
+            else:
+                self.ready = True
+                if freeze:
+                    self.frozen_objects = freeze_heap()
+            self.finished_at = time.time()
+            return self.ready
+
+    def should_retry(self):
+        """True when warmup failed (or never ran) and the retry interval has passed."""
+        if self.ready:
+            return False
+        if self.finished_at is None:
+            return self.started_at is None  # never ran, or still running
+        return time.time() - self.finished_at >= WARMUP_RETRY_SECONDS
+
+    def info(self):
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "step_ms": dict(self.step_ms),
+            "error": self.error,
+            "frozen_objects": self.frozen_objects,
+        }
+
+
+def freeze_heap():
+    """
+    Collects garbage, then moves every surviving object to the permanent
+    generation so later collections (in this process or forked children)
+    don't write to their pages. Returns the number of frozen objects.
+    """
+    gc.collect()
+    gc.freeze()
+    return gc.get_freeze_count()